@@ -1,129 +1,196 @@
 # app.py
 import gradio as gr
 import logging
-from backend.config import setup_logging, PROMPT_DIR, PROPER_NOUNS_SPOTTING_PROMPT_FILE, STRAIGHT_UP_TRANSLATION_PROMPT_FILE, ISSUE_SPOTTING_PROMPT_FILE, LOOSE_TRANSLATION_PROMPT_FILE
-from backend.config import PROPER_NOUNS_SPOTTING_PROMPT, STRAIGHT_UP_TRANSLATION_PROMPT, ISSUE_SPOTTING_PROMPT, LOOSE_TRANSLATION_PROMPT
+from backend.config import setup_logging
+from backend.config import METRICS_HOST, METRICS_PORT
+from backend.config import GRADIO_STEP_CONCURRENCY, GRADIO_PIPELINE_CONCURRENCY, GRADIO_DEFAULT_CONCURRENCY, GRADIO_MAX_QUEUE_SIZE
 # 确保导入了所有需要的 Service 类
 from backend.services.translation_service import ProperNounsSpottingService, StraightUpTranslationService, IssueSpottingService, LooseTranslationService
+from backend.services.translation_service import apply_delta
+from backend.services.registry import get_service, preload
+from backend.services.pipeline import get_pipeline, segment_limits
+from backend.services.ingestion import segment_document, translatable_segments, read_document
+from backend.services.incremental import PipelineSnapshot
+from backend.services.errors import TranslationServiceError
+from backend.services.metrics import start_metrics_server
+from backend.services.prompt_templates import prompt_templates
 
 # 初始化日志
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# 定义 prompt 文件路径和对应的变量名的字典，方便后续操作
-PROMPT_FILES = {
-    "Proper Nouns Spotting": PROPER_NOUNS_SPOTTING_PROMPT_FILE,
-    "Straight-up Translation": STRAIGHT_UP_TRANSLATION_PROMPT_FILE,
-    "Issue Spotting": ISSUE_SPOTTING_PROMPT_FILE,
-    "Loose Translation": LOOSE_TRANSLATION_PROMPT_FILE,
-}
-
-# 加载 prompt 内容到变量 - 这一步依然需要在程序启动时完成
-# 注意：这里直接从 backend.config 导入了加载好的 PROMPT 变量
-# 如果在 Prompt 编辑器中修改后，需要确保这个修改能反映到实际的服务调用中
-# 我们当前的实现是通过更新内存中的 PROMPTS 字典，并在 Service.__init__ 中加载
-# 如果 Service 是在每次调用时创建新实例，那么它们会加载最新的 PROMPT 内容
-PROMPTS = {
-    "Proper Nouns Spotting": PROPER_NOUNS_SPOTTING_PROMPT,
-    "Straight-up Translation": STRAIGHT_UP_TRANSLATION_PROMPT,
-    "Issue Spotting": ISSUE_SPOTTING_PROMPT,
-    "Loose Translation": LOOSE_TRANSLATION_PROMPT,
+# Prompt 编辑器中显示的名称 -> 模板名称
+# 模板由 prompt_templates 注册表统一管理：编辑器保存时写入文件并立即重新编译，
+# Service 每次构建 Prompt 时从注册表获取模板，因此保存后的修改在下一次调用时生效，无需重启应用
+PROMPT_TEMPLATE_NAMES = {
+    "Proper Nouns Spotting": "proper_nouns_spotting",
+    "Straight-up Translation": "straight_up_translation",
+    "Issue Spotting": "issue_spotting",
+    "Loose Translation": "loose_translation",
+    "Review and Revise (合并模式)": "review_and_revise",
 }
 
 def display_prompt(prompt_name):
     """根据 prompt 名称返回 prompt 内容."""
-    logger.info(f"Displaying prompt: {prompt_name}")
-    # 从内存中的实时 PROMPTS 字典获取 Prompt 内容，这样能反映编辑器的修改
-    return PROMPTS.get(prompt_name, "Prompt not found")
+    logger.info("Displaying prompt: %s", prompt_name)
+    template_name = PROMPT_TEMPLATE_NAMES.get(prompt_name)
+    if not template_name:
+        return "Prompt not found"
+    return prompt_templates.source(template_name)
 
 def save_prompt(prompt_name, prompt_content):
-    """保存 prompt 内容到文件，并更新内存中的字典."""
-    logger.info(f"Saving prompt: {prompt_name}")
-    prompt_file = PROMPT_FILES.get(prompt_name)
-    if not prompt_file:
-        logger.warning(f"Prompt file not found for prompt name: {prompt_name}")
+    """保存 prompt 内容到文件，模板注册表立即重新编译，后续调用使用新的 Prompt."""
+    logger.info("Saving prompt: %s", prompt_name)
+    template_name = PROMPT_TEMPLATE_NAMES.get(prompt_name)
+    if not template_name:
+        logger.warning("Prompt file not found for prompt name: %s", prompt_name)
         return "Error: Prompt name not found."
 
     try:
-        with open(prompt_file, 'w', encoding='utf-8') as f:
-            f.write(prompt_content)
-        # 更新内存中的 PROMPTS 字典，这是关键
-        PROMPTS[prompt_name] = prompt_content
-        logger.info(f"Prompt '{prompt_name}' saved to '{prompt_file}' successfully.")
+        prompt_templates.save(template_name, prompt_content)
+        logger.info("Prompt '%s' saved successfully.", prompt_name)
         return "Prompt saved successfully!"
     except Exception as e:
-        logger.error(f"Error saving prompt '{prompt_name}' to '{prompt_file}': {e}", exc_info=True)
+        logger.error("Error saving prompt '%s': %s", prompt_name, e, exc_info=True)
         return f"Error saving prompt: {e}"
 
 # --- 接力翻译步骤函数 ---
 
-# 注意：这些函数在每次按钮点击时都会被调用，并创建 Service 实例
-# Service 实例会在 __init__ 中加载 Prompt。
-# 如果希望 Service 实例在应用启动时只创建一次，或者需要更复杂的依赖注入，
-# 可以调整 app 结构，例如将 Service 实例作为参数传递，或者使用全局变量。
-# 但目前这种方式对于 Gradio 应用来说，简单且便于 State 管理。
+# 注意：这些函数在每次按钮点击时都会被调用，但 Service 实例通过 get_service 从进程级注册表获取，
+# 只在第一次使用时创建。所有 Service 共享同一个 OpenAI 客户端和 keep-alive 连接池，
+# 避免每次点击都重新建立 TCP/TLS 连接。Service 实例不保存请求状态，可以在多个会话和线程之间复用。
+
+# 各步骤函数都是异步生成器：Service 以流式方式返回文本增量，每收到一段就把累积的文本 yield 给 Gradio，
+# 用户在第一个 token 返回时就能看到输出，而不是等待整个结果生成完毕。
+# 异步处理函数直接运行在 Gradio 的事件循环中，通过 AsyncOpenAI 客户端调用 LLM，等待响应期间不占用 worker 线程，
+# 大量用户同时等待 LLM 时共享一个事件循环，并发上限由 Gradio 队列配置 (见 GRADIO_STEP_CONCURRENCY)。
+# 每次 yield 同时更新输出框和对应的 State，最后一次 yield 的是完整结果，保证下游步骤读取到完整文本。
+# Service 调用失败时抛出 TranslationServiceError，转换为 gr.Error 在界面上提示，错误信息不会被写入 State 传给下游步骤。
 
-def run_proper_nouns_spotting_step(origin_text):
+async def _accumulate_stream(step_name, stream):
+    """累积流式返回的文本增量，每收到一段就 yield 当前的完整文本 (StreamReplacement 代替已累积的文本)."""
+    text = ""
+    try:
+        async for delta in stream:
+            text = apply_delta(text, delta)
+            yield text
+    except TranslationServiceError as e:
+        logger.error("%s step failed: %s", step_name, e)
+        raise gr.Error(f"{step_name} 失败: {e}")
+
+async def run_proper_nouns_spotting_step(origin_text):
     """执行专有名词识别步骤."""
     logger.info("Starting Proper Nouns Spotting step...")
-    service = ProperNounsSpottingService()
-    # run_prompt 方法现在应该只返回一个值 (表格 markdown)
-    result_table_markdown = service.run_prompt(origin_text)
+    service = get_service(ProperNounsSpottingService)
+    async for result_table_markdown in _accumulate_stream("Proper Nouns Spotting", service.astream_prompt(origin_text)):
+        # 返回结果用于更新输出框和 State
+        yield result_table_markdown, result_table_markdown
     logger.info("Proper Nouns Spotting step completed.")
-    # 返回结果用于更新输出框和 State
-    return result_table_markdown, result_table_markdown
 
-def run_straight_up_translation_step(origin_text, proper_nouns_table):
+async def run_straight_up_translation_step(origin_text, proper_nouns_table):
     """执行直接翻译步骤."""
     logger.info("Starting Straight-up Translation step...")
-    service = StraightUpTranslationService()
-    # run_prompt 方法现在应该只返回一个值 (翻译文本)
-    result_text = service.run_prompt(origin_text, proper_nouns_table)
+    service = get_service(StraightUpTranslationService)
+    async for result_text in _accumulate_stream("Straight-up Translation", service.astream_prompt(origin_text, proper_nouns_table)):
+        # 返回结果用于更新输出框和 State
+        yield result_text, result_text
     logger.info("Straight-up Translation step completed.")
-    # 返回结果用于更新 State
-    return result_text
 
-# 纠正 Issue Spotting 函数，使其只更新一个 State
-def run_issue_spotting_step(straight_up_translation_text, origin_text, proper_nouns_table):
+async def run_issue_spotting_step(straight_up_translation_text, origin_text, proper_nouns_table):
     """执行问题识别步骤."""
     logger.info("Starting Issue Spotting step...")
-    service = IssueSpottingService()
-    # IssueSpottingService.run_prompt 应该返回一个值 (问题描述文本)
-    result_text = service.run_prompt(straight_up_translation_text, origin_text, proper_nouns_table)
+    service = get_service(IssueSpottingService)
+    async for result_text in _accumulate_stream("Issue Spotting", service.astream_prompt(straight_up_translation_text, origin_text, proper_nouns_table)):
+        # 返回结果用于更新输出框和 State
+        yield result_text, result_text
     logger.info("Issue Spotting step completed.")
-    # 返回结果用于更新 State
-    return result_text
 
-# 纠正 Loose Translation 函数签名和调用
-def run_loose_translation_step(straight_up_translation_text, issue_spotting_result_text, origin_text, proper_nouns_table):
+async def run_loose_translation_step(straight_up_translation_text, issue_spotting_result_text, origin_text, proper_nouns_table):
     """执行意译步骤."""
     logger.info("Starting Loose Translation step...")
-    service = LooseTranslationService()
-    # LooseTranslationService.run_prompt 应该接收修改后的参数
-    result_text = service.run_prompt(straight_up_translation_text, issue_spotting_result_text, origin_text, proper_nouns_table)
+    service = get_service(LooseTranslationService)
+    async for result_text in _accumulate_stream("Loose Translation", service.astream_prompt(straight_up_translation_text, issue_spotting_result_text, origin_text, proper_nouns_table)):
+        # 返回结果用于更新输出框和 State
+        yield result_text, result_text
     logger.info("Loose Translation step completed.")
-    # 返回结果用于更新 State
-    return result_text
+
+# 一键运行的四个输出框：(阶段名称, 是否按原文结构重组)
+# 译文按原文结构重组 (代码块、表格等不翻译的内容原样保留)，术语表和问题列表按片段顺序用空行拼接
+PIPELINE_OUTPUTS = (
+    ("proper_nouns", False),
+    ("straight_up", True),
+    ("issue_spotting", False),
+    ("loose_translation", True),
+)
+
+def _render_pipeline_outputs(snapshot):
+    """渲染四个输出框的文本，未完成的片段暂时跳过 (译文中显示原文)."""
+    return tuple(snapshot.render(stage, structured) for stage, structured in PIPELINE_OUTPUTS)
+
+def run_full_pipeline(origin_text, proper_nouns_text, straight_up_text, issues_text, loose_text, previous_snapshot):
+    """
+    一键执行全部四个步骤：按文档结构切分原文，需要翻译的段落在流水线中并发推进.
+
+    流水线按输入指纹复用之前的阶段输出，修改原文后重新运行只会为变化的段落调用 LLM.
+    用户在输出框中修改过的内容按上一次运行的快照切回各段落，作为该阶段的输出交给流水线，
+    只有这些段落的下游步骤会重新计算.
+    """
+    logger.info("Starting full pipeline...")
+    overrides = {}
+    if previous_snapshot is not None:
+        edited_texts = (proper_nouns_text, straight_up_text, issues_text, loose_text)
+        for (stage, structured), edited in zip(PIPELINE_OUTPUTS, edited_texts):
+            changed = previous_snapshot.collect_overrides(stage, structured, edited)
+            if changed:
+                logger.info("User edited '%s' output of %s segments", stage, changed)
+        overrides = previous_snapshot.overrides
+    pipeline = get_pipeline()
+    max_tokens, model = segment_limits(pipeline.stages)
+    segments = segment_document(origin_text, max_tokens=max_tokens, model=model)
+    to_translate = translatable_segments(segments)
+    results = [None] * len(to_translate)
+    snapshot = PipelineSnapshot(segments, results, overrides)
+    for result in pipeline.run_iter([segment.text for segment in to_translate], overrides):
+        results[result.index] = result
+        if all(r is not None for r in results):
+            snapshot.prune_overrides()
+        joined = _render_pipeline_outputs(snapshot)
+        # 返回结果用于更新四个输出框、四个 State 和快照 (快照始终与输出框中显示的内容一致)
+        yield joined + joined + (snapshot,)
+    logger.info("Full pipeline completed.")
+
+def load_uploaded_document(file_path):
+    """读取上传的 Markdown / 纯文本文档，填入英文原文输入框."""
+    if not file_path:
+        return ""
+    logger.info("Loading uploaded document: %s", file_path)
+    try:
+        return read_document(file_path)
+    except Exception as e:
+        logger.error("Error reading uploaded document '%s': %s", file_path, e, exc_info=True)
+        return f"Error reading document: {e}"
 
 if __name__ == "__main__":
     logger.info("Starting Gradio application...")
 
-    prompt_names = list(PROMPTS.keys())
+    prompt_names = list(PROMPT_TEMPLATE_NAMES.keys())
     with gr.Blocks(title="Translation App") as iface:
         gr.Markdown("# 翻译流程")
 
         # 初始化 gr.State 组件，存储各个步骤的结果
-        # 这些 State 将在各个按钮点击事件的 outputs 中被隐式更新
+        # 这些 State 和对应的输出框一起出现在各个按钮点击事件的 outputs 中，流式输出时同步更新
         stored_proper_nouns_table = gr.State("")
         stored_straight_up_translation_text = gr.State("")
         stored_issue_spotting_result_text = gr.State("")
         stored_final_translation_text = gr.State("") # 存储最终意译结果
+        pipeline_snapshot = gr.State(None) # 上一次一键运行的结果快照，用于把输出框中的修改映射回各段落
 
         with gr.Tab("翻译流程"):
             gr.Markdown("## 翻译流程")
 
-            # 英文原文输入框 (所有步骤共用)
+            # 英文原文输入框 (所有步骤共用)，也可以上传 Markdown / 纯文本文档
             origin_text_input_relay = gr.TextArea(label="英文原文", lines=5)
+            document_upload_relay = gr.File(label="上传文档 (.md / .txt)", file_types=[".md", ".markdown", ".txt"], type="filepath")
 
             with gr.Row():
                 # 设置按钮宽度比例和点击事件
@@ -131,6 +198,7 @@ if __name__ == "__main__":
                 straight_translate_button_relay = gr.Button("2. 进行直接翻译", scale=1)
                 spot_issues_button_relay = gr.Button("3. 识别翻译问题", scale=1)
                 loose_translate_button_relay = gr.Button("4. 进行意译", scale=1)
+            run_all_button_relay = gr.Button("一键运行全部步骤", variant="primary")
 
             # 四个结果输出框，使用 Row 排列
             with gr.Row():
@@ -148,63 +216,66 @@ if __name__ == "__main__":
 
             # 按钮点击事件配置: 触发函数，输入由哪些组件提供，输出更新哪些组件或 State
 
+            # 步骤函数是异步生成器，流式输出时直接更新输出框，同时把累积结果写入 State，
+            # 不再需要通过 State 的 change 事件转发到输出框
+            # 下游步骤直接读取上游的输出框，用户在输出框中修改过的内容会传给下游步骤
+
             # 步骤 1: 识别专有名词
             spot_nouns_button_relay.click(
                 fn=run_proper_nouns_spotting_step,  # 调用对应的步骤函数
                 inputs=origin_text_input_relay,  # 输入是英文原文
-                # 输出更新专有名词输出Markdown，以及存储专有名词的State
-                outputs=[proper_nouns_output_relay, stored_proper_nouns_table]
+                # 输出更新专有名词输出框，以及存储专有名词的State
+                outputs=[proper_nouns_output_relay, stored_proper_nouns_table],
+                concurrency_limit=GRADIO_STEP_CONCURRENCY, concurrency_id="llm_steps" # 四个步骤共享并发上限
             )
 
-            # 步骤 2: 进行直接翻译 (依赖于英文原文和专有名词State)
+            # 步骤 2: 进行直接翻译 (依赖于英文原文和专有名词)
             straight_translate_button_relay.click(
                 fn=run_straight_up_translation_step,
-                inputs=[origin_text_input_relay, stored_proper_nouns_table],  # 输入：英文原文，存储的专有名词State
-                outputs=stored_straight_up_translation_text  # 输出更新存储直接翻译的State
+                inputs=[origin_text_input_relay, proper_nouns_output_relay],  # 输入：英文原文，专有名词输出框
+                outputs=[straight_up_translation_output_relay, stored_straight_up_translation_text],  # 输出更新直接翻译显示框和State
+                concurrency_limit=GRADIO_STEP_CONCURRENCY, concurrency_id="llm_steps" # 四个步骤共享并发上限
             )
 
-            # 步骤 3: 识别翻译问题 (依赖于直接翻译State，英文原文，专有名词State)
+            # 步骤 3: 识别翻译问题 (依赖于直接翻译，英文原文，专有名词)
             spot_issues_button_relay.click(
                 fn=run_issue_spotting_step,
-                inputs=[stored_straight_up_translation_text, origin_text_input_relay, stored_proper_nouns_table],
-                # 输入：存储的直接翻译State，英文原文，存储的专有名词State
-                outputs=stored_issue_spotting_result_text  # 输出更新存储问题识别结果的State
+                inputs=[straight_up_translation_output_relay, origin_text_input_relay, proper_nouns_output_relay],
+                # 输入：直接翻译输出框，英文原文，专有名词输出框
+                outputs=[issue_spotting_output_relay, stored_issue_spotting_result_text],  # 输出更新问题识别显示框和State
+                concurrency_limit=GRADIO_STEP_CONCURRENCY, concurrency_id="llm_steps" # 四个步骤共享并发上限
             )
 
-            # 步骤 4: 进行意译 (依赖于直接翻译State, 问题识别State, 英文原文, 专有名词State)
+            # 步骤 4: 进行意译 (依赖于直接翻译, 问题识别, 英文原文, 专有名词)
             loose_translate_button_relay.click(
                 fn=run_loose_translation_step,
-                inputs=[stored_straight_up_translation_text, stored_issue_spotting_result_text, origin_text_input_relay,
-                        stored_proper_nouns_table],  # 输入：存储的直接翻译State, 存储的问题识别State, 英文原文, 存储的专有名词State
-                outputs=stored_final_translation_text  # 输出更新存储最终意译结果的State
-            )
-
-            # State 组件 change 事件：当 State 更新时，自动将 State 的值赋给对应的输出文本框
-            # gradio 会自动处理 State 的 change 事件，只要它在某个 fn 的 outputs 列表中
-            # 当 State 的值发生变化时，其 change 事件会被触发
-            # 我们需要注册 change 事件来更新对应的 Textbox/Markdown
-            stored_proper_nouns_table.change(
-                fn=lambda x: x,  # lambda 函数直接返回输入值
-                inputs=stored_proper_nouns_table,  # change 事件的输入就是自身 State 的新值
-                outputs=proper_nouns_output_relay  # 更新专有名词显示框
-            )
-
-            stored_straight_up_translation_text.change(
-                fn=lambda x: x,
-                inputs=stored_straight_up_translation_text,
-                outputs=straight_up_translation_output_relay  # 更新直接翻译显示框
+                inputs=[straight_up_translation_output_relay, issue_spotting_output_relay, origin_text_input_relay,
+                        proper_nouns_output_relay],  # 输入：直接翻译、问题识别输出框, 英文原文, 专有名词输出框
+                outputs=[loose_translation_output_relay, stored_final_translation_text],  # 输出更新意译显示框和State
+                concurrency_limit=GRADIO_STEP_CONCURRENCY, concurrency_id="llm_steps" # 四个步骤共享并发上限
             )
 
-            stored_issue_spotting_result_text.change(
-                fn=lambda x: x,
-                inputs=stored_issue_spotting_result_text,
-                outputs=issue_spotting_output_relay  # 更新问题识别显示框
+            # 上传文档后把内容填入英文原文输入框
+            document_upload_relay.upload(
+                fn=load_uploaded_document,
+                inputs=document_upload_relay,
+                outputs=origin_text_input_relay
             )
 
-            stored_final_translation_text.change(
-                fn=lambda x: x,
-                inputs=stored_final_translation_text,
-                outputs=loose_translation_output_relay  # 更新意译显示框
+            # 单独运行某个步骤后输出框不再对应按段落切分的结果，清空快照，下一次一键运行不把输出框内容当作修改
+            for step_button in (spot_nouns_button_relay, straight_translate_button_relay, spot_issues_button_relay, loose_translate_button_relay):
+                step_button.click(fn=lambda: None, inputs=None, outputs=pipeline_snapshot, queue=False) # 不进入队列，不会排在 LLM 请求之后
+
+            # 一键运行：按文档结构切分原文，四个步骤以流水线方式并发执行，每完成一个段落就刷新所有输出框和 State
+            # 输入包括四个输出框和上一次的快照：只重新计算原文或中间结果有变化的段落，其余段落复用之前的结果
+            run_all_button_relay.click(
+                fn=run_full_pipeline,
+                inputs=[origin_text_input_relay, proper_nouns_output_relay, straight_up_translation_output_relay,
+                        issue_spotting_output_relay, loose_translation_output_relay, pipeline_snapshot],
+                outputs=[proper_nouns_output_relay, straight_up_translation_output_relay, issue_spotting_output_relay,
+                         loose_translation_output_relay, stored_proper_nouns_table, stored_straight_up_translation_text,
+                         stored_issue_spotting_result_text, stored_final_translation_text, pipeline_snapshot],
+                concurrency_limit=GRADIO_PIPELINE_CONCURRENCY # 每个一键运行占用一个线程，段落在流水线中并发调用 LLM
             )
 
 
@@ -231,5 +302,12 @@ if __name__ == "__main__":
 
 
 
-    iface.launch()
+    preload() # 后端模块按需导入 openai SDK，界面启动时提前导入，第一次点击不需要等待
+    start_metrics_server(METRICS_HOST, METRICS_PORT) # Prometheus 指标在独立端口提供，与 Gradio 应用并行运行
+    # 显式配置队列：单步按钮和一键运行按上面各事件的 concurrency_limit 并发处理，其余事件使用默认并发数；
+    # 排队中的请求超过 GRADIO_MAX_QUEUE_SIZE 时新请求直接提示队列已满，不会无限堆积
+    iface.queue(max_size=GRADIO_MAX_QUEUE_SIZE or None, default_concurrency_limit=GRADIO_DEFAULT_CONCURRENCY)
+    # Gradio 队列同时处理的任务数 (包括异步任务) 不超过 max_threads，按各事件的并发上限设置，避免限制异步步骤的并发；
+    # 线程只在执行同步处理函数时按需创建
+    iface.launch(max_threads=GRADIO_STEP_CONCURRENCY + GRADIO_PIPELINE_CONCURRENCY + GRADIO_DEFAULT_CONCURRENCY)
     logger.info("Gradio application started.")
\ No newline at end of file
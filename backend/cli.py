@@ -0,0 +1,246 @@
+# backend/cli.py
+"""
+命令行批量翻译：不启动 Gradio 界面，把文件、目录或 JSONL 中的文本交给流水线执行四个步骤.
+
+每个段落完成后立即以一行 JSON 追加写入输出文件，输出文件同时作为断点：
+中断后使用相同的参数重新运行，已成功完成且原文未变的段落会被跳过，失败的段落会重试.
+
+--batch 改为离线批量模式：每个步骤的所有请求作为一个 OpenAI Batch API 任务提交 (费用更低，但通常需要数小时)，
+失败的段落在其所在的步骤结束后写出，其余段落在全部步骤完成后写出；每个步骤完成后的中间结果保存在 BATCH_DIR 中，
+中断后重新运行会跳过已完成的步骤、继续等待已提交的任务，不会重复提交.
+
+示例:
+    python -m backend.cli book/ -o book.jsonl --output-dir book_zh/
+    python -m backend.cli chapter1.md chapter2.md -o out.jsonl --concurrency 8
+    python -m backend.cli segments.jsonl -o - > out.jsonl
+    python -m backend.cli book/ -o book.jsonl --batch
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+from backend.config import setup_logging
+from backend.services.ingestion import segment_document, translatable_segments, reassemble, read_document
+from backend.services.pipeline import TranslationPipeline, FINAL_STAGE, configured_stages, segment_limits
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_EXTENSIONS = (".md", ".markdown", ".txt")
+
+class Document:
+    """一个待翻译的文档：一个文件或 JSONL 中的一条记录."""
+    def __init__(self, doc_id, text, output_path=None):
+        """
+        构造函数.
+
+        Args:
+            doc_id (str): 文档标识，段落标识为 "<doc_id>#<块序号>".
+            text (str): 文档内容.
+            output_path (str): 使用 --output-dir 时译文相对输出目录的路径，JSONL 记录为 None.
+        """
+        self.doc_id = doc_id
+        self.output_path = output_path
+        max_tokens, model = segment_limits()
+        self.segments = segment_document(text, max_tokens=max_tokens, model=model)
+        self.pending = {segment.index for segment in translatable_segments(self.segments)}
+        self.translations = {} # 块序号 -> 最终译文
+        self.failed = False
+
+    def segment_id(self, segment):
+        return f"{self.doc_id}#{segment.index}"
+
+def source_hash(text):
+    """段落原文的摘要，原文变化后断点中的结果不再使用."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _read_jsonl_documents(path):
+    """JSONL 中每行一个 {"id": ..., "text": ...} 对象，缺少 id 时使用 "<文件>:<行号>"."""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                logger.error("Skipping invalid JSON at %s:%s: %s", path, line_number, e)
+                continue
+            if not isinstance(record, dict) or not isinstance(record.get("text"), str):
+                logger.error("Skipping record without a 'text' field at %s:%s", path, line_number)
+                continue
+            yield Document(str(record.get("id") or f"{path}:{line_number}"), record["text"])
+
+def iter_documents(paths):
+    """
+    展开命令行中的输入路径.
+
+    目录递归查找 .md / .markdown / .txt 文件 (按路径排序)，.jsonl 文件按记录展开，其余文件按文档读取.
+
+    Yields:
+        Document: 待翻译的文档.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = []
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(DOCUMENT_EXTENSIONS))
+            for file_path in files:
+                yield Document(file_path, read_document(file_path), os.path.relpath(file_path, path))
+        elif path.lower().endswith(".jsonl"):
+            yield from _read_jsonl_documents(path)
+        else:
+            yield Document(path, read_document(path), os.path.basename(path))
+
+def load_checkpoint(path):
+    """
+    读取之前的输出文件，返回已成功完成的段落.
+
+    进程中断时最后一行可能只写了一半，这样的行会被截掉，之后的结果从完整的最后一行之后继续追加.
+
+    Returns:
+        dict: 段落标识 -> 输出行 (只包括没有错误的行).
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    valid_bytes = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                row = json.loads(line)
+            except ValueError:
+                break
+            valid_bytes += len(line)
+            if row.get("error") is None:
+                done[row["id"]] = row
+            else:
+                done.pop(row["id"], None)
+    if valid_bytes < os.path.getsize(path):
+        logger.warning("Truncating incomplete output after byte %s in %s", valid_bytes, path)
+        with open(path, 'r+b') as f:
+            f.truncate(valid_bytes)
+    return done
+
+def _result_row(document, segment, result):
+    """把流水线的片段结果转换为输出行."""
+    return {
+        "id": document.segment_id(segment),
+        "document": document.doc_id,
+        "segment": segment.index,
+        "source": segment.restore(segment.text),
+        "source_hash": source_hash(segment.text),
+        "translation": segment.restore(result.outputs.get(FINAL_STAGE)) if result.ok else None,
+        "outputs": result.outputs,
+        "reused": result.reused,
+        "durations": {stage: round(seconds, 3) for stage, seconds in result.durations.items()},
+        "error": None if result.ok else f"{type(result.error).__name__}: {result.error}",
+    }
+
+def _write_document(document, output_dir):
+    """文档的所有段落都成功完成后，按原文格式重组译文并写入输出目录."""
+    if output_dir is None or document.output_path is None or document.pending or document.failed:
+        return
+    target = os.path.join(output_dir, document.output_path)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write(reassemble(document.segments, document.translations))
+    logger.info("Wrote translated document %s", target)
+
+def run_batch(documents, output, pipeline, checkpoint=None, output_dir=None):
+    """
+    翻译一批文档，每个段落完成后立即写出一行 JSON.
+
+    Args:
+        documents (list[Document]): 待翻译的文档.
+        output (file): 以文本模式打开的输出流.
+        pipeline (TranslationPipeline): 执行四个步骤的流水线 (或离线批量模式的 BatchPipeline).
+        checkpoint (dict): load_checkpoint 的返回值，其中原文未变的段落不再翻译.
+        output_dir (str): 重组后的译文写入的目录，为 None 时不写.
+
+    Returns:
+        dict: total / skipped / ok / failed 段落数.
+    """
+    checkpoint = checkpoint or {}
+    jobs = [] # (文档, 块)
+    summary = {"total": 0, "skipped": 0, "ok": 0, "failed": 0}
+    for document in documents:
+        for segment in translatable_segments(document.segments):
+            summary["total"] += 1
+            row = checkpoint.get(document.segment_id(segment))
+            if row is not None and row.get("source_hash") == source_hash(segment.text):
+                document.translations[segment.index] = row["translation"]
+                document.pending.discard(segment.index)
+                summary["skipped"] += 1
+            else:
+                jobs.append((document, segment))
+        _write_document(document, output_dir)
+    logger.info("Batch started: %s documents, %s segments, %s already done", len(documents), summary["total"], summary["skipped"])
+
+    start = time.perf_counter()
+    for result in pipeline.run_iter([segment.text for _, segment in jobs]):
+        document, segment = jobs[result.index]
+        output.write(json.dumps(_result_row(document, segment, result), ensure_ascii=False) + "\n")
+        output.flush()
+        document.pending.discard(segment.index)
+        if result.ok:
+            summary["ok"] += 1
+            document.translations[segment.index] = result.outputs.get(FINAL_STAGE) # 重组时还原 URL
+        else:
+            summary["failed"] += 1
+            document.failed = True
+        done = summary["ok"] + summary["failed"]
+        if done % 50 == 0 or done == len(jobs):
+            logger.info("Batch progress: %s/%s segments (%s failed, %.1fs)", done, len(jobs), summary["failed"], time.perf_counter() - start)
+        _write_document(document, output_dir)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量执行四步翻译流水线，结果以 JSONL 流式输出，可以断点续跑")
+    parser.add_argument("inputs", nargs="+", help="Markdown / 纯文本文件、目录，或每行一个 {\"id\", \"text\"} 的 .jsonl 文件")
+    parser.add_argument("-o", "--output", default="-", help="输出的 JSONL 文件，同时作为断点 (默认 - 表示标准输出，不支持续跑)")
+    parser.add_argument("--output-dir", default=None, help="把每个文件的译文按原文格式重组后写入该目录")
+    parser.add_argument("--concurrency", type=int, default=None, help="每个步骤同时进行的 API 调用数 (默认使用 PIPELINE_*_CONCURRENCY)")
+    parser.add_argument("--restart", action="store_true", help="忽略已有的输出文件，从头开始")
+    parser.add_argument("--batch", action="store_true", help="使用 Batch API 离线执行，每个步骤的全部请求作为一个批量任务提交")
+    parser.add_argument("--batch-backend", choices=("openai", "local"), default=None, help="批量任务后端 (默认使用 BATCH_BACKEND)，local 为本地文件模拟")
+    parser.add_argument("--poll-interval", type=float, default=None, help="查询批量任务状态的间隔秒数 (默认使用 BATCH_POLL_INTERVAL)")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    documents = list(iter_documents(args.inputs))
+    checkpoint = {}
+    if args.output != "-":
+        if args.restart and os.path.exists(args.output):
+            os.remove(args.output)
+        checkpoint = load_checkpoint(args.output)
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+
+    concurrency = None
+    if args.concurrency:
+        concurrency = {stage.name: args.concurrency for stage in configured_stages()}
+    if args.batch:
+        from backend.services.batch import BatchPipeline
+        pipeline = BatchPipeline(backend=args.batch_backend, poll_interval=args.poll_interval)
+    else:
+        pipeline = TranslationPipeline(concurrency=concurrency)
+    output = sys.stdout if args.output == "-" else open(args.output, 'a', encoding='utf-8')
+    try:
+        summary = run_batch(documents, output, pipeline, checkpoint, args.output_dir)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted, finished segments are saved in %s", args.output)
+        return 130
+    finally:
+        pipeline.shutdown()
+        if output is not sys.stdout:
+            output.close()
+    logger.info("Batch finished: %s segments, %s skipped, %s translated, %s failed", summary["total"], summary["skipped"], summary["ok"], summary["failed"])
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,133 @@
 # backend/config.py
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
 from dotenv import load_dotenv
 
-# 加载 .env 文件中的环境变量
+# 加载 .env 文件中的环境变量 (导入时执行，约 0.1ms；各模块在导入时绑定下面的配置常量，见 README "性能测试")
 load_dotenv()
 
+def _env_bool(name, default):
+    """读取布尔型环境变量 (1/true/yes/on 视为 True)."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# 日志配置
+LOG_DIR = os.getenv("LOG_DIR", "backend/logs") # 日志目录
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper() # 日志级别，DEBUG 时会记录 (截断后的) Prompt 和 LLM 响应
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower() # 日志文件格式：text 或 json (每行一个 JSON 对象)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))) # 单个日志文件的最大字节数，超过后轮转
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5")) # 保留的轮转日志文件数
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000")) # 日志中 Prompt / 响应等长文本的最大字符数
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0")) # 记录长文本内容的调用比例 (0~1)，其余调用只记录长度
+
+LOG_TEXT_FORMAT = '[%(asctime)s] [%(levelname)s] [%(module)s.%(funcName)s] - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为一行 JSON，通过 extra 传入的字段会一并输出."""
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": f"{record.module}.{record.funcName}",
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    把 LogRecord 原样放入队列.
+
+    标准的 QueueHandler.prepare 会在调用线程中格式化消息和异常堆栈，这里改为全部在后台线程中完成，
+    请求线程只需要把记录放入队列. 日志参数按引用传递，调用方不应在记录日志后修改传入的可变对象.
+    """
+    def prepare(self, record):
+        return record
+
+class LogPayload:
+    """
+    日志中的长文本 (Prompt、LLM 响应等).
+
+    只在日志记录真正被输出时才由后台线程截断并转为字符串，DEBUG 关闭时没有任何复制开销.
+    """
+    __slots__ = ("text", "limit", "sampled")
+
+    def __init__(self, text, limit, sampled=True):
+        self.text = text
+        self.limit = limit
+        self.sampled = sampled
+
+    def __str__(self):
+        text = "" if self.text is None else str(self.text)
+        if not self.sampled:
+            return f"<{len(text)} chars, not sampled>"
+        if self.limit <= 0 or len(text) <= self.limit:
+            return text
+        head = self.limit * 2 // 3
+        tail = self.limit - head
+        return f"{text[:head]} ...[{len(text) - self.limit} chars truncated]... {text[-tail:]}"
+
+def log_payload(text, limit=None):
+    """
+    包装需要写入日志的长文本，按 LOG_PAYLOAD_MAX_CHARS 截断、按 LOG_PAYLOAD_SAMPLE_RATE 抽样.
+
+    用法: logger.debug("Raw LLM response: %s", log_payload(llm_result))
+    """
+    sampled = LOG_PAYLOAD_SAMPLE_RATE >= 1 or random.random() < LOG_PAYLOAD_SAMPLE_RATE
+    return LogPayload(text, LOG_PAYLOAD_MAX_CHARS if limit is None else limit, sampled)
+
+_log_listener = None
+
 def setup_logging():
-    """配置日志记录."""
-    log_dir = 'backend/logs'
-    os.makedirs(log_dir, exist_ok=True) # 确保日志目录存在
-    log_filename = os.path.join(log_dir, 'app.log')
-
-    logging.basicConfig(
-        filename=log_filename,
-        level=logging.INFO, # 默认日志级别为 INFO，可以根据需要调整
-        format='[%(asctime)s] [%(levelname)s] [%(module)s.%(funcName)s] - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        encoding='utf-8'
-    )
+    """
+    配置日志记录.
+
+    请求线程中的 logger 只把记录放入内存队列，由后台 QueueListener 线程负责格式化并写入
+    控制台和按大小轮转的日志文件，日志 IO 不会阻塞请求. 重复调用不会重复添加处理器.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+    os.makedirs(LOG_DIR, exist_ok=True) # 确保日志目录存在
+    log_filename = os.path.join(LOG_DIR, 'app.log')
+
+    text_formatter = logging.Formatter(LOG_TEXT_FORMAT, datefmt=LOG_DATE_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(log_filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else text_formatter)
     console_handler = logging.StreamHandler() # 创建控制台处理器
     console_handler.setLevel(logging.INFO) # 控制台日志级别
-    formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] [%(module)s.%(funcName)s] - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    console_handler.setFormatter(formatter)
-    logging.getLogger('').addHandler(console_handler) # 将控制台处理器添加到根logger
+    console_handler.setFormatter(text_formatter)
+
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop) # 退出时写完队列中剩余的日志
+
+    root_logger = logging.getLogger('')
+    root_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    for handler in list(root_logger.handlers): # 移除导入阶段 logging.warning 等自动添加的默认处理器
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(_DeferredQueueHandler(log_queue))
 
     logger = logging.getLogger(__name__)
     logger.info("日志系统已配置.") # 记录日志系统启动信息
+    check_settings()
 
 # 定义 prompt 文件路径
 PROMPT_DIR = 'backend/prompts'
@@ -34,36 +135,187 @@ PROPER_NOUNS_SPOTTING_PROMPT_FILE = os.path.join(PROMPT_DIR, 'proper_nouns_spott
 STRAIGHT_UP_TRANSLATION_PROMPT_FILE = os.path.join(PROMPT_DIR, 'straight_up_translation_prompt.txt')
 ISSUE_SPOTTING_PROMPT_FILE = os.path.join(PROMPT_DIR, 'issue_spotting_prompt.txt')
 LOOSE_TRANSLATION_PROMPT_FILE = os.path.join(PROMPT_DIR, 'loose_translation_prompt.txt')
+REVIEW_AND_REVISE_PROMPT_FILE = os.path.join(PROMPT_DIR, 'review_and_revise_prompt.txt')
+
+# 模板名称 -> 文件路径，模板由 backend.services.prompt_templates 按需加载，文件修改后自动重新加载
+PROMPT_FILES = {
+    "proper_nouns_spotting": PROPER_NOUNS_SPOTTING_PROMPT_FILE,
+    "straight_up_translation": STRAIGHT_UP_TRANSLATION_PROMPT_FILE,
+    "issue_spotting": ISSUE_SPOTTING_PROMPT_FILE,
+    "loose_translation": LOOSE_TRANSLATION_PROMPT_FILE,
+    "review_and_revise": REVIEW_AND_REVISE_PROMPT_FILE,
+}
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "1.0")) # 检查 Prompt 文件是否修改的最小间隔 (秒)
 
-# 加载 prompt 内容到变量
+# 加载 prompt 内容
 def load_prompt(prompt_file):
     """加载 prompt 文件内容."""
     try:
         with open(prompt_file, 'r', encoding='utf-8') as f:
             return f.read()
     except FileNotFoundError:
-        logging.error(f"Prompt file not found: {prompt_file}")
+        logging.error("Prompt file not found: %s", prompt_file)
         return ""
     except Exception as e:
-        logging.error(f"Error reading prompt file: {prompt_file}, error: {e}")
+        logging.error("Error reading prompt file: %s, error: %s", prompt_file, e)
         return ""
 
-PROPER_NOUNS_SPOTTING_PROMPT = load_prompt(PROPER_NOUNS_SPOTTING_PROMPT_FILE)
-STRAIGHT_UP_TRANSLATION_PROMPT = load_prompt(STRAIGHT_UP_TRANSLATION_PROMPT_FILE)
-ISSUE_SPOTTING_PROMPT = load_prompt(ISSUE_SPOTTING_PROMPT_FILE)
-LOOSE_TRANSLATION_PROMPT = load_prompt(LOOSE_TRANSLATION_PROMPT_FILE)
-
 # OpenAI API 配置
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE") # 从环境变量或 .env 文件中读取 OPENAI_API_BASE
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") # 从环境变量或 .env 文件中读取 OPENAI_API_KEY
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo") # 从环境变量或 .env 文件中读取 OPENAI_MODEL, 默认 "gpt-3.5-turbo"
 
-if not OPENAI_API_KEY:
-    logging.warning("OPENAI_API_KEY 环境变量或 .env 文件中未设置，请先设置 OPENAI_API_KEY 才能使用 OpenAI API 功能。")
-if not OPENAI_API_BASE:
-    logging.warning("OPENAI_API_BASE 环境变量或 .env 文件中未设置，将使用默认 OpenAI API Base (https://api.openai.com/v1)。")
-if not OPENAI_MODEL:
-    logging.info(f"OPENAI_MODEL 环境变量或 .env 文件中未设置，将使用默认模型: gpt-3.5-turbo。")
+# HTTP 连接池配置 (进程内所有服务共享同一个连接池，避免每次调用都重新建立 TCP/TLS 连接)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100")) # 每个 API Base 的最大并发连接数
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")) # 连接池中保持 keep-alive 的空闲连接数
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")) # 空闲连接保留时长 (秒)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")) # 建立连接超时 (秒)
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "600")) # 读取响应超时 (秒)，长文本生成可能较慢
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "30")) # 发送请求超时 (秒)
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30")) # 等待连接池空闲连接的超时 (秒)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0")) # OpenAI SDK 内置重试次数，默认关闭，由 rate_limiter 统一负责限流和重试
+
+# LLM 响应缓存配置 (相同模型 + 参数 + Prompt 直接复用之前的结果)
+RESPONSE_CACHE_ENABLED = _env_bool("RESPONSE_CACHE_ENABLED", True) # 是否启用响应缓存
+RESPONSE_CACHE_MEMORY_ITEMS = int(os.getenv("RESPONSE_CACHE_MEMORY_ITEMS", "512")) # 内存 LRU 最大条目数
+RESPONSE_CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB_PATH", "backend/cache/response_cache.sqlite3") # 磁盘缓存文件路径，置空则只使用内存缓存
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))) # 缓存条目存活时间 (秒)，<=0 表示永不过期
+RESPONSE_CACHE_MAX_DISK_MB = float(os.getenv("RESPONSE_CACHE_MAX_DISK_MB", "256")) # 磁盘缓存最大容量 (MB)
+
+# Token 预算配置 (按模型上下文长度切分输入，并根据输入长度限制输出长度)
+def _parse_int_mapping(value):
+    """解析 "name=123,name2=456" 格式的配置."""
+    mapping = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, number = item.rsplit("=", 1)
+            mapping[name.strip()] = int(number)
+    return mapping
+
+MODEL_CONTEXT_LIMITS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4.1": 1047576,
+    "gemini": 1048576,
+    "deepseek": 65536,
+}
+MODEL_CONTEXT_LIMITS.update(_parse_int_mapping(os.getenv("MODEL_CONTEXT_LIMITS"))) # 如 "my-model=32768,other-model=8192"，按模型名前缀匹配
+DEFAULT_CONTEXT_LIMIT = int(os.getenv("DEFAULT_CONTEXT_LIMIT", "8192")) # 未配置模型的上下文长度
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "4096")) # 单次调用的输出上限
+OUTPUT_TOKENS_RATIO = float(os.getenv("OUTPUT_TOKENS_RATIO", "2.0")) # 输出上限 = BASE + RATIO * 输入 token 数
+OUTPUT_TOKENS_BASE = int(os.getenv("OUTPUT_TOKENS_BASE", "256"))
+OUTPUT_TOKENS_MIN = int(os.getenv("OUTPUT_TOKENS_MIN", "256")) # 上下文剩余空间低于该值时视为 Prompt 过大
+MAX_TOKENS_PARAM = os.getenv("MAX_TOKENS_PARAM", "max_tokens") # 输出上限参数名，部分新模型需要使用 max_completion_tokens
+SEGMENT_MAX_TOKENS = int(os.getenv("SEGMENT_MAX_TOKENS", "1500")) # 流水线中单个片段的最大 token 数，超出时继续切分 (同时不超过上下文最短的步骤模型的输入预算)
+TOKEN_ESTIMATE_CHARS_PER_TOKEN = float(os.getenv("TOKEN_ESTIMATE_CHARS_PER_TOKEN", "4.0")) # 未安装 tiktoken 时的估算参数：非中日韩字符每 token 字符数
+TOKEN_ESTIMATE_CJK_TOKENS_PER_CHAR = float(os.getenv("TOKEN_ESTIMATE_CJK_TOKENS_PER_CHAR", "1.0")) # 每个中日韩字符的 token 数
+
+# 客户端限流与重试配置 (进程内所有会话共享每个模型的 RPM / TPM 额度，避免并发请求触发 429)
+def _parse_pair_mapping(value, cast=int):
+    """解析 "name=a:b,name2=a:b" 格式的配置，缺省的数值为 0."""
+    mapping = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, numbers = item.rsplit("=", 1)
+            first, _, second = numbers.partition(":")
+            mapping[name.strip()] = (cast(first or 0), cast(second or 0))
+    return mapping
+
+MODEL_RATE_LIMITS = _parse_pair_mapping(os.getenv("MODEL_RATE_LIMITS")) # 如 "gpt-4o=500:30000,gpt-4o-mini=500:200000"
+DEFAULT_RPM = int(os.getenv("DEFAULT_RPM", "0")) # 未配置模型的每分钟请求数上限，0 表示不限制
+DEFAULT_TPM = int(os.getenv("DEFAULT_TPM", "0")) # 未配置模型的每分钟 token 数上限，0 表示不限制
+RETRY_MAX_RETRIES = int(os.getenv("RETRY_MAX_RETRIES", "4")) # 超时、429、5xx 等临时故障的最大重试次数
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0")) # 指数退避的初始等待时间 (秒)
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60")) # 单次退避的最长等待时间 (秒)
+
+# 模型路由配置 (每个阶段使用的模型、API Base、超时、备用端点和对冲请求，格式见 backend/model_routing.example.json)
+MODEL_ROUTING_PATH = os.getenv("MODEL_ROUTING_PATH", "backend/model_routing.json") # 文件不存在时所有阶段都使用 OPENAI_MODEL / OPENAI_API_BASE
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95")) # 主端点超过最近调用延迟的该分位数仍未返回时，向备用端点发送对冲请求
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0")) # 发送对冲请求前的最短等待时间 (秒)
+HEDGE_INITIAL_DELAY = float(os.getenv("HEDGE_INITIAL_DELAY", "10")) # 延迟样本不足时的等待时间 (秒)
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20")) # 按分位数计算等待时间所需的最少样本数
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200")) # 统计延迟分位数使用的最近调用数
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "32")) # 执行对冲调用的线程数，应不小于同时进行的对冲调用数的两倍
+
+# 术语表配置 (已知术语由术语表在本地回答，跳过 Proper Nouns Spotting 的 API 调用)
+GLOSSARY_ENABLED = _env_bool("GLOSSARY_ENABLED", True) # 是否启用术语表
+GLOSSARY_PATH = os.getenv("GLOSSARY_PATH", "backend/data/glossary.json") # 术语表文件路径
+GLOSSARY_LOCAL_ANSWER = _env_bool("GLOSSARY_LOCAL_ANSWER", False) # 原文中没有未知候选词时是否直接由术语表给出专有名词表，不调用 LLM (候选词只包括大写、缩写和驼峰写法，全小写的术语不会被发现)
+GLOSSARY_PRUNING_ENABLED = _env_bool("GLOSSARY_PRUNING_ENABLED", True) # 下游 Prompt 中的专有名词表是否只保留当前片段中出现的术语
+GLOSSARY_IGNORE_AFTER = int(os.getenv("GLOSSARY_IGNORE_AFTER", "2")) # 候选词连续多少次没有出现在 LLM 返回的表格中后视为非术语，不再触发 API 调用
+GLOSSARY_IGNORE_TTL = float(os.getenv("GLOSSARY_IGNORE_TTL", str(30 * 24 * 3600))) # 非术语标记的有效期 (秒)，过期后重新交给 LLM 判断，<=0 表示永不过期
+GLOSSARY_SAVE_DELAY = float(os.getenv("GLOSSARY_SAVE_DELAY", "2.0")) # 术语表变化后延迟多少秒写回文件 (期间的多次变化合并为一次写入)
+
+# 指标与 trace 配置 (各 LLM 调用和流水线阶段的耗时、token 用量和费用)
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True) # 是否收集指标
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1") # Prometheus 指标服务监听地址
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464")) # 指标服务端口，0 表示不启动
+METRICS_TRACE_PATH = os.getenv("METRICS_TRACE_PATH", "") # JSONL trace 文件路径，置空则不写 trace
+STREAM_INCLUDE_USAGE = _env_bool("STREAM_INCLUDE_USAGE", True) # 流式调用时请求上游在最后返回 token 用量，兼容接口不支持 stream_options 时关闭
+MODEL_PRICING = { # 模型单价 (美元 / 百万 token)，格式为 (输入, 输出)，按模型名前缀匹配
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4.1": (2.0, 8.0),
+}
+MODEL_PRICING.update(_parse_pair_mapping(os.getenv("MODEL_PRICING"), float)) # 如 "my-model=0.5:1.5"
+
+# 增量重新翻译配置 (按输入指纹记录流水线各阶段的输出，重新运行时只为输入变化的片段和下游阶段调用 LLM)
+PIPELINE_MEMO_ENABLED = _env_bool("PIPELINE_MEMO_ENABLED", True) # 是否复用之前的阶段输出
+PIPELINE_MEMO_ITEMS = int(os.getenv("PIPELINE_MEMO_ITEMS", "8192")) # 记录的阶段输出条目数上限 (内存 LRU)
+
+# 翻译记忆配置 (记录每个段落的最终译文，近似重复的段落复用或参考之前的译文)
+TRANSLATION_MEMORY_ENABLED = _env_bool("TRANSLATION_MEMORY_ENABLED", True) # 是否启用翻译记忆
+TRANSLATION_MEMORY_DB_PATH = os.getenv("TRANSLATION_MEMORY_DB_PATH", "backend/data/translation_memory.sqlite3") # 翻译记忆文件路径，置空则只保存在内存中
+TRANSLATION_MEMORY_REUSE_THRESHOLD = float(os.getenv("TRANSLATION_MEMORY_REUSE_THRESHOLD", "1.0")) # 相似度不低于该值时直接复用之前的译文，1.0 表示只复用原文相同 (忽略空白差异) 的段落
+TRANSLATION_MEMORY_REFERENCE_THRESHOLD = float(os.getenv("TRANSLATION_MEMORY_REFERENCE_THRESHOLD", "1.0")) # 相似度不低于该值时把之前的译文交给意译步骤修改，跳过直接翻译和问题识别；默认 1.0 不参考相似段落，设为如 0.6 时开启
+TRANSLATION_MEMORY_MIN_CHARS = int(os.getenv("TRANSLATION_MEMORY_MIN_CHARS", "30")) # 短于该长度的段落只复用相同的原文
+TRANSLATION_MEMORY_NUM_PERM = int(os.getenv("TRANSLATION_MEMORY_NUM_PERM", "64")) # MinHash 签名长度，越长相似度估算越准确
+TRANSLATION_MEMORY_BANDS = int(os.getenv("TRANSLATION_MEMORY_BANDS", "16")) # LSH 分段数，越多越容易找到相似度较低的候选
+
+# 问题识别与意译
+PIPELINE_FUSED_REVIEW = _env_bool("PIPELINE_FUSED_REVIEW", False) # 流水线中用一次调用同时返回问题列表和修改后的译文 (review_and_revise 模板)，代替问题识别和意译两次调用
+REVISION_EARLY_EXIT = _env_bool("REVISION_EARLY_EXIT", True) # 问题列表为空或只说明没有问题 (如 "无") 时跳过意译，直接使用直接翻译的结果
+
+# 流水线各阶段的并发上限 (同一阶段同时进行的 API 调用数)
+PIPELINE_STAGE_CONCURRENCY = {
+    "proper_nouns": int(os.getenv("PIPELINE_PROPER_NOUNS_CONCURRENCY", "4")),
+    "straight_up": int(os.getenv("PIPELINE_STRAIGHT_UP_CONCURRENCY", "4")),
+    "issue_spotting": int(os.getenv("PIPELINE_ISSUE_SPOTTING_CONCURRENCY", "4")),
+    "loose_translation": int(os.getenv("PIPELINE_LOOSE_TRANSLATION_CONCURRENCY", "4")),
+    "review": int(os.getenv("PIPELINE_REVIEW_CONCURRENCY", "4")),
+}
+
+# 离线批量模式 (命令行工具的 --batch，使用 OpenAI Batch API，适合不需要即时结果的大量文本)
+BATCH_BACKEND = os.getenv("BATCH_BACKEND", "openai").lower() # openai: OpenAI Batch API；local: 本地文件模拟 (逐条调用 chat.completions，用于测试)
+BATCH_DIR = os.getenv("BATCH_DIR", "backend/data/batches") # 批量任务的请求文件、提交记录和各层完成后的中间结果目录，中断后重新运行时从未完成的层继续
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "60")) # 查询批量任务状态的间隔 (秒)
+BATCH_COMPLETION_WINDOW = os.getenv("BATCH_COMPLETION_WINDOW", "24h") # 批量任务的完成时限
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000")) # 单个批量任务的最大请求数 (OpenAI 的上限为 50000)，超出时拆分为多个任务
+BATCH_LOCAL_WORKERS = int(os.getenv("BATCH_LOCAL_WORKERS", "8")) # 本地模拟执行请求的线程数
+
+# Gradio 队列配置 (单步按钮的处理函数是异步的，等待 LLM 响应时共享一个事件循环，不占用线程)
+GRADIO_STEP_CONCURRENCY = int(os.getenv("GRADIO_STEP_CONCURRENCY", "100")) # 四个单步按钮合计同时处理的请求数，不宜超过 HTTP_MAX_CONNECTIONS
+GRADIO_PIPELINE_CONCURRENCY = int(os.getenv("GRADIO_PIPELINE_CONCURRENCY", "4")) # 同时进行的一键运行数，每个一键运行占用一个线程并在流水线中并发调用 LLM
+GRADIO_DEFAULT_CONCURRENCY = int(os.getenv("GRADIO_DEFAULT_CONCURRENCY", "8")) # 其他事件 (上传文档、Prompt 编辑) 的并发数
+GRADIO_MAX_QUEUE_SIZE = int(os.getenv("GRADIO_MAX_QUEUE_SIZE", "512")) # 排队中的请求数上限，超出时新请求直接提示队列已满，0 表示不限制
+
+def check_settings():
+    """
+    提示缺少的 OpenAI 配置.
+
+    由 setup_logging 在日志系统配置好之后调用，导入 config 本身不输出日志，只读取配置的模块和工具不会打印无关的警告.
+    """
+    logger = logging.getLogger(__name__)
+    if not OPENAI_API_KEY:
+        logger.warning("OPENAI_API_KEY 环境变量或 .env 文件中未设置，请先设置 OPENAI_API_KEY 才能使用 OpenAI API 功能。")
+    if not OPENAI_API_BASE:
+        logger.warning("OPENAI_API_BASE 环境变量或 .env 文件中未设置，将使用默认 OpenAI API Base (https://api.openai.com/v1)。")
+    if not OPENAI_MODEL:
+        logger.info("OPENAI_MODEL 环境变量或 .env 文件中未设置，将使用默认模型: gpt-3.5-turbo。")
 
 if __name__ == '__main__':
     setup_logging()
@@ -71,10 +323,8 @@ if __name__ == '__main__':
     logger.info("这是一条来自 config.py 的测试日志信息")
 
     # 打印加载的 prompt (测试用)
-    print("PROPER_NOUNS_SPOTTING_PROMPT:\n", PROPER_NOUNS_SPOTTING_PROMPT)
-    print("\nSTRAIGHT_UP_TRANSLATION_PROMPT:\n", STRAIGHT_UP_TRANSLATION_PROMPT)
-    print("\nISSUE_SPOTTING_PROMPT:\n", ISSUE_SPOTTING_PROMPT)
-    print("\nLOOSE_TRANSLATION_PROMPT:\n", LOOSE_TRANSLATION_PROMPT)
+    for prompt_name, prompt_file in PROMPT_FILES.items():
+        print(f"{prompt_name}:\n", load_prompt(prompt_file), "\n")
 
     print("\nOPENAI_API_BASE:", OPENAI_API_BASE) # 打印 OpenAI API 配置 (测试用)
     print("OPENAI_API_KEY:", OPENAI_API_KEY)
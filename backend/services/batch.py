@@ -0,0 +1,503 @@
+# backend/services/batch.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config import BATCH_BACKEND, BATCH_DIR, BATCH_POLL_INTERVAL, BATCH_COMPLETION_WINDOW, BATCH_MAX_REQUESTS, BATCH_LOCAL_WORKERS
+from backend.services.registry import get_service
+from backend.services.metrics import metrics
+from backend.services.response_cache import get_response_cache
+from backend.services.incremental import StageMemo, stage_key
+from backend.services.rate_limiter import is_retryable, to_upstream_error
+from backend.services.errors import ConfigurationError, UpstreamError
+from backend.services.pipeline import TranslationPipeline
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+STAGE_OUTPUTS_FILE = "stage_outputs.jsonl" # 每一层完成后追加写入的阶段输出，中断后重新运行时从下一层继续
+
+class OpenAIBatchBackend:
+    """OpenAI Batch API：上传请求文件、创建批量任务、查询状态并下载结果文件."""
+    name = "openai"
+
+    def __init__(self, client, completion_window=BATCH_COMPLETION_WINDOW):
+        """
+        构造函数.
+
+        Args:
+            client (openai.OpenAI): 该 API Base 的共享客户端.
+            completion_window (str): 批量任务的完成时限.
+        """
+        self.client = client
+        self.completion_window = completion_window
+
+    @property
+    def base_url(self):
+        return str(self.client.base_url)
+
+    def submit(self, path, description):
+        """上传请求文件并创建批量任务，返回任务 id."""
+        with open(path, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+            metadata={"description": description[:512]}
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        """
+        查询批量任务状态.
+
+        Returns:
+            tuple: (状态，如 in_progress / completed / expired, {"total", "completed", "failed"} 请求计数).
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if batch.status == "failed" and batch.errors is not None:
+            logger.error("Batch %s failed: %s", batch_id, batch.errors)
+        return batch.status, {"total": counts.total, "completed": counts.completed, "failed": counts.failed} if counts else {}
+
+    def results(self, batch_id):
+        """依次返回结果文件和错误文件中的每一行 (已解析的 JSON)."""
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+class LocalBatchBackend:
+    """
+    OpenAI Batch API 的本地文件替身，用于测试.
+
+    提交时把请求文件复制到 directory 中，第一次查询状态时逐条 (多线程) 调用 chat.completions，
+    结果按 Batch API 的格式写入 JSONL 文件. 任务状态同样保存在文件中，进程重启后可以继续查询.
+    配合 benchmarks.mock_openai_server 可以不消耗 API 额度地完整运行批量模式.
+    """
+    name = "local"
+
+    def __init__(self, client, directory, workers=BATCH_LOCAL_WORKERS):
+        """
+        构造函数.
+
+        Args:
+            client (openai.OpenAI): 执行请求的客户端.
+            directory (str): 任务文件目录.
+            workers (int): 执行请求的线程数.
+        """
+        self.client = client
+        self.directory = directory
+        self.workers = max(1, workers)
+
+    @property
+    def base_url(self):
+        return str(self.client.base_url)
+
+    def _path(self, batch_id, suffix):
+        return os.path.join(self.directory, f"{batch_id}{suffix}")
+
+    def _load(self, batch_id):
+        with open(self._path(batch_id, ".json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, batch_id, record):
+        path = self._path(batch_id, ".json")
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def submit(self, path, description):
+        os.makedirs(self.directory, exist_ok=True)
+        batch_id = f"batch_local_{uuid.uuid4().hex[:24]}"
+        shutil.copyfile(path, self._path(batch_id, "_input.jsonl"))
+        self._save(batch_id, {"id": batch_id, "status": "in_progress", "description": description, "created_at": int(time.time())})
+        return batch_id
+
+    def status(self, batch_id):
+        record = self._load(batch_id)
+        if record["status"] not in TERMINAL_STATUSES:
+            record = self._process(batch_id, record)
+        return record["status"], record.get("request_counts", {})
+
+    def _process(self, batch_id, record):
+        """执行全部请求并写出结果文件 (先写临时文件再替换，中断后重新执行)."""
+        with open(self._path(batch_id, "_input.jsonl"), 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="local-batch") as executor:
+            outputs = list(executor.map(self._execute, lines))
+        output_path = self._path(batch_id, "_output.jsonl")
+        with open(output_path + ".tmp", 'w', encoding='utf-8') as f:
+            for output in outputs:
+                f.write(json.dumps(output, ensure_ascii=False) + "\n")
+        os.replace(output_path + ".tmp", output_path)
+        failed = sum(1 for output in outputs if output["error"] is not None or output["response"]["status_code"] != 200)
+        record.update(status="completed", completed_at=int(time.time()),
+                      request_counts={"total": len(outputs), "completed": len(outputs) - failed, "failed": failed})
+        self._save(batch_id, record)
+        return record
+
+    def _execute(self, line):
+        """执行一条请求，返回 Batch API 格式的结果行."""
+        import openai # 延迟导入，见 registry
+        output = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": line["custom_id"], "response": None, "error": None}
+        try:
+            response = self.client.chat.completions.create(**line["body"])
+            output["response"] = {"status_code": 200, "body": response.model_dump()}
+        except openai.APIStatusError as e:
+            output["response"] = {"status_code": e.status_code, "body": {"error": {"message": str(e)}}}
+        except openai.OpenAIError as e:
+            output["error"] = {"code": e.__class__.__name__, "message": str(e)}
+        return output
+
+    def results(self, batch_id):
+        with open(self._path(batch_id, "_output.jsonl"), 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+BATCH_BACKENDS = {"openai": OpenAIBatchBackend, "local": LocalBatchBackend}
+
+def parse_batch_line(line):
+    """
+    从 Batch API 的结果行中取出文本结果.
+
+    Returns:
+        tuple: (文本结果, usage 字典或 None).
+
+    Raises:
+        UpstreamError: 该请求失败.
+    """
+    response = line.get("response") or {}
+    status_code = response.get("status_code")
+    if line.get("error") or status_code != 200:
+        error = line.get("error") or (response.get("body") or {}).get("error") or {}
+        raise UpstreamError(f"Batch request {line.get('custom_id')} failed: {error.get('message', error)}", status_code)
+    body = response["body"]
+    return body["choices"][0]["message"]["content"] or "", body.get("usage")
+
+class _BatchItem:
+    """批量任务中的一个请求：某个片段的某个阶段."""
+    def __init__(self, result, stage, service, args, key, cache_key, body, start):
+        self.result = result
+        self.stage = stage
+        self.service = service
+        self.args = args
+        self.key = key
+        self.cache_key = cache_key
+        self.body = body
+        self.start = start
+
+    @property
+    def custom_id(self):
+        return f"{self.stage.name}-{self.result.index}"
+
+class BatchPipeline(TranslationPipeline):
+    """
+    离线批量模式的流水线.
+
+    阶段按依赖关系分层 (wave)，每一层中所有片段需要调用 LLM 的请求写成 Batch API 格式的 JSONL 一起提交，
+    任务完成后把结果按 custom_id 对应回片段，再提交下一层. 复用之前的输出、翻译记忆、响应缓存、术语表和跳过意译
+    与 TranslationPipeline 相同，只有真正需要调用 LLM 的请求进入批量任务.
+
+    每个批量任务提交后在 BATCH_DIR 中留下提交记录 (以请求内容的摘要命名)，中断后使用相同的输入重新运行时，
+    已提交的任务不会重复提交，而是继续等待其结果. 每一层完成后该层的阶段输出追加写入 BATCH_DIR 中的
+    STAGE_OUTPUTS_FILE，重新运行时读入阶段输出记录，已完成的层不再提交；全部片段成功后删除该文件.
+    """
+    def __init__(self, stages=None, backend=None, memo=None, translation_memory=None, poll_interval=None, batch_dir=None):
+        """
+        构造函数.
+
+        Args:
+            stages (tuple): Stage 列表，为 None 时与 TranslationPipeline 相同.
+            backend (str): "openai" 或 "local"，默认使用 BATCH_BACKEND.
+            memo (StageMemo): 见 TranslationPipeline.
+            translation_memory (TranslationMemory): 见 TranslationPipeline.
+            poll_interval (float): 查询任务状态的间隔 (秒)，默认使用 BATCH_POLL_INTERVAL.
+            batch_dir (str): 请求文件和提交记录目录，默认使用 BATCH_DIR.
+        """
+        super().__init__(stages, memo=memo, translation_memory=translation_memory)
+        if self.memo is None: # PIPELINE_MEMO_ENABLED 关闭时仍需要记录阶段输出，才能从中断前完成的层继续
+            self.memo = StageMemo()
+        self._wave_outputs = [] # 当前层新得到的 (指纹, 输出, 校验值)，该层完成后写入 STAGE_OUTPUTS_FILE
+        self.backend_name = backend or BATCH_BACKEND
+        if self.backend_name not in BATCH_BACKENDS:
+            raise ConfigurationError(f"Unknown batch backend: '{self.backend_name}' (expected one of {', '.join(BATCH_BACKENDS)})")
+        self.poll_interval = BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.batch_dir = batch_dir or BATCH_DIR
+        self._backends = {}
+
+    def _waves(self):
+        """按依赖关系分层：每一层的阶段只依赖之前各层的阶段."""
+        done, waves = set(), []
+        while len(done) < len(self.stages):
+            wave = [stage for stage in self.stages if stage.name not in done and all(dep in done for dep in stage.dependencies)]
+            waves.append(wave)
+            done.update(stage.name for stage in wave)
+        return waves
+
+    def _backend(self, route):
+        """每个 API Base 一个批量任务后端."""
+        key = (route.api_base, route.api_key)
+        backend = self._backends.get(key)
+        if backend is None:
+            if self.backend_name == "local":
+                backend = LocalBatchBackend(route.client, os.path.join(self.batch_dir, "local"))
+            else:
+                backend = OpenAIBatchBackend(route.client)
+            self._backends[key] = backend
+        return backend
+
+    def _complete(self, result, stage, key, output, reused, start):
+        elapsed = time.perf_counter() - start
+        result.outputs[stage.name] = output
+        result.durations[stage.name] = elapsed
+        result.keys[stage.name] = key
+        if reused:
+            result.reused[stage.name] = reused
+        metrics.record_stage(stage.name, elapsed, segment=result.index, reused=reused)
+
+    def _fail(self, result, stage, error, start):
+        logger.error("Batch stage '%s' failed for segment %s: %s", stage.name, result.index, error)
+        metrics.record_stage(stage.name, time.perf_counter() - start, error=error, segment=result.index)
+        result.error = error
+
+    def _remember_output(self, stage, key, output, origin_text):
+        validator = stage.validator(origin_text) if stage.validator else None
+        self.memo.set(key, output, validator)
+        self._wave_outputs.append((key, output, validator))
+
+    @property
+    def outputs_path(self):
+        return os.path.join(self.batch_dir, STAGE_OUTPUTS_FILE)
+
+    def _load_outputs(self):
+        """读入之前中断的运行中已完成各层的阶段输出，进程中断时只写了一半的最后一行会被截掉."""
+        path = self.outputs_path
+        if not os.path.exists(path):
+            return
+        loaded = valid_bytes = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                self.memo.set(entry["key"], entry["output"], entry.get("validator"))
+                loaded += 1
+        if valid_bytes < os.path.getsize(path):
+            logger.warning("Truncating incomplete stage outputs after byte %s in %s", valid_bytes, path)
+            with open(path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        logger.info("Loaded %s stage outputs of an interrupted batch run from %s", loaded, path)
+
+    def _save_outputs(self):
+        """把当前层新得到的阶段输出追加写入 STAGE_OUTPUTS_FILE."""
+        entries, self._wave_outputs = self._wave_outputs, []
+        if not entries:
+            return
+        os.makedirs(self.batch_dir, exist_ok=True)
+        with open(self.outputs_path, 'a', encoding='utf-8') as f:
+            for key, output, validator in entries:
+                f.write(json.dumps({"key": key, "output": output, "validator": validator}, ensure_ascii=False) + "\n")
+
+    def _prepare(self, state, result, stage):
+        """
+        确定一个片段的一个阶段的输出：能复用或在本地得到时直接完成，否则返回需要放入批量任务的请求.
+
+        Returns:
+            _BatchItem | None: 需要调用 LLM 的请求.
+        """
+        start = time.perf_counter()
+        service = get_service(stage.service_cls)
+        args = stage.build_args(result.origin_text, result.outputs)
+        key = stage_key(stage.name, service.model, service.template.digest, args)
+        output, reused = self._reuse(state, result.index, stage, key, result.origin_text)
+        if output is None and stage.shortcut is not None:
+            output = stage.shortcut(result.origin_text, result.outputs)
+            reused = "derived" if output is not None else None
+        if output is None:
+            output = service.local_answer(*args)
+        if output is None:
+            constructed_prompt = service.batch_prompt(*args)
+            if constructed_prompt is None:
+                logger.info("Segment %s exceeds the token budget for '%s', running it directly instead of in the batch", result.index, stage.name)
+                output = service.run_prompt(*args)
+            else:
+                service.require_api_key()
+                body, cache_key = service.batch_request(constructed_prompt)
+                cache = get_response_cache()
+                cached = cache.get(cache_key) if cache is not None else None
+                if cached is None:
+                    return _BatchItem(result, stage, service, args, key, cache_key, body, start)
+                metrics.record_llm_call(service.__class__.__name__, service.model, time.perf_counter() - start, cache_hit=True)
+                output = service.postprocess(cached, *args)
+        if reused in (None, "tm", "derived"):
+            self._remember_output(stage, key, output, result.origin_text)
+        self._complete(result, stage, key, output, reused, start)
+        return None
+
+    def _submit_batch(self, backend, items, label):
+        """
+        写出请求文件并提交批量任务.
+
+        相同内容的请求文件之前已经提交过时 (中断后重新运行) 直接返回之前的任务 id.
+
+        Returns:
+            tuple: (任务 id, 提交记录文件路径).
+        """
+        lines = [{"custom_id": item.custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": item.body} for item in items]
+        content = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+        os.makedirs(self.batch_dir, exist_ok=True)
+        path = os.path.join(self.batch_dir, f"{label}-{digest}.jsonl")
+        manifest_path = os.path.join(self.batch_dir, f"{label}-{digest}.batch.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("backend") == backend.name and manifest.get("base_url") == backend.base_url:
+                logger.info("Resuming batch %s for %s (%s requests)", manifest["batch_id"], label, len(lines))
+                return manifest["batch_id"], manifest_path
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        batch_id = backend.submit(path, label)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({"batch_id": batch_id, "backend": backend.name, "base_url": backend.base_url, "requests": len(lines), "created_at": int(time.time())}, f, indent=2)
+        logger.info("Submitted batch %s for %s (%s requests, %s)", batch_id, label, len(lines), backend.name)
+        return batch_id, manifest_path
+
+    def _wait(self, backend, batch_ids):
+        """轮询直到所有任务结束，返回任务 id -> 最终状态. 查询时的临时故障只记录日志，下次继续查询."""
+        import openai
+        remaining, statuses = list(batch_ids), {}
+        while remaining:
+            for batch_id in list(remaining):
+                try:
+                    status, counts = backend.status(batch_id)
+                except openai.OpenAIError as e:
+                    if not is_retryable(e):
+                        raise to_upstream_error(e, 1) from e
+                    logger.warning("Error polling batch %s: %s", batch_id, e)
+                    continue
+                if status in TERMINAL_STATUSES:
+                    logger.info("Batch %s %s: %s", batch_id, status, counts)
+                    statuses[batch_id] = status
+                    remaining.remove(batch_id)
+                else:
+                    logger.info("Batch %s %s: %s", batch_id, status, counts)
+            if remaining:
+                time.sleep(self.poll_interval)
+        return statuses
+
+    def _run_batches(self, backend, items, label):
+        """提交一组请求 (超过 BATCH_MAX_REQUESTS 时拆分)，等待完成并把结果写回各片段."""
+        import openai
+        by_id = {item.custom_id: item for item in items}
+        try:
+            submitted = [self._submit_batch(backend, items[offset:offset + BATCH_MAX_REQUESTS], label) for offset in range(0, len(items), BATCH_MAX_REQUESTS)]
+            batch_ids = [batch_id for batch_id, _ in submitted]
+            statuses = self._wait(backend, batch_ids)
+            lines = [line for batch_id in batch_ids for line in backend.results(batch_id)]
+        except (openai.OpenAIError, UpstreamError, OSError) as e:
+            error = e if isinstance(e, UpstreamError) else UpstreamError(f"Batch {label} failed: {e}", getattr(e, "status_code", None))
+            for item in items:
+                self._fail(item.result, item.stage, error, item.start)
+            return
+        cache = get_response_cache()
+        for line in lines:
+            item = by_id.pop(line.get("custom_id"), None)
+            if item is None:
+                continue
+            try:
+                llm_result, usage = parse_batch_line(line)
+                output = item.service.postprocess(llm_result, *item.args)
+            except Exception as e:
+                metrics.record_llm_call(item.service.__class__.__name__, item.service.model, time.perf_counter() - item.start, error=e)
+                self._fail(item.result, item.stage, e, item.start)
+                continue
+            usage = usage or {}
+            metrics.record_llm_call(
+                item.service.__class__.__name__, item.service.model, time.perf_counter() - item.start,
+                prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0)
+            )
+            if cache is not None:
+                cache.set(item.cache_key, llm_result)
+            self._remember_output(item.stage, item.key, output, item.result.origin_text)
+            self._complete(item.result, item.stage, item.key, output, None, item.start)
+        final = ", ".join(sorted(set(statuses.values())))
+        for item in by_id.values(): # 任务过期或取消时未完成的请求
+            self._fail(item.result, item.stage, UpstreamError(f"Batch request {item.custom_id} has no result (batch {final})"), item.start)
+        if any(item.result.error is not None for item in items):
+            for _, manifest_path in submitted: # 有请求失败时删除提交记录，重新运行时重新提交而不是再次取回失败的结果
+                os.remove(manifest_path)
+
+    def _run_wave(self, state, wave, label):
+        """执行一层阶段：先完成能复用或在本地得到的输出，其余请求按 API Base 分组提交."""
+        groups = {} # (api_base, api_key) -> (后端, 请求列表)
+        for stage in wave:
+            for result in state.results:
+                if result.error is not None:
+                    continue
+                try:
+                    item = self._prepare(state, result, stage)
+                except Exception as e:
+                    self._fail(result, stage, e, time.perf_counter())
+                    continue
+                if item is not None:
+                    route = item.service.routing.primary
+                    groups.setdefault((route.api_base, route.api_key), (self._backend(route), []))[1].append(item)
+        for backend, items in groups.values():
+            self._run_batches(backend, items, label)
+
+    def run_iter(self, segments, overrides=None):
+        """
+        以批量任务运行流水线. 参数与 TranslationPipeline.run_iter 相同.
+
+        某一层失败的片段在该层结束后立即返回 (不再进入下一层)，其余片段在所有层完成后按片段顺序返回.
+
+        Yields:
+            SegmentResult: 片段结果.
+        """
+        segments = list(segments)
+        if not segments:
+            return
+        self._load_outputs()
+        state = self.start_run(segments, overrides)
+        waves = self._waves()
+        logger.info("Batch pipeline started: %s segments, %s waves (%s backend)", len(segments), len(waves), self.backend_name)
+        start = time.perf_counter()
+        failed = set() # 已经返回的失败片段
+        try:
+            for number, wave in enumerate(waves, 1):
+                label = f"wave{number}-{'+'.join(stage.name for stage in wave)}"
+                wave_start = time.perf_counter()
+                self._run_wave(state, wave, label)
+                self._save_outputs()
+                logger.info("Batch %s finished in %.1fs (%s segments failed so far)", label, time.perf_counter() - wave_start, sum(1 for r in state.results if r.error is not None))
+                for result in state.results:
+                    if result.error is not None and result.index not in failed:
+                        failed.add(result.index)
+                        yield result
+            for result in state.results:
+                if result.ok:
+                    self._remember(result)
+                    yield result
+        finally:
+            self._wave_outputs = []
+            self.finish_run(state)
+        if not failed and os.path.exists(self.outputs_path):
+            os.remove(self.outputs_path)
+        logger.info("Batch pipeline finished: %s segments in %.1fs", len(segments), time.perf_counter() - start)
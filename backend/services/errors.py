@@ -0,0 +1,34 @@
+# backend/services/errors.py
+
+class TranslationServiceError(Exception):
+    """翻译服务错误的基类，调用方捕获此类型即可处理所有可预期的失败."""
+
+class ConfigurationError(TranslationServiceError):
+    """配置缺失或无效 (如未设置 OPENAI_API_KEY)."""
+
+class PromptTooLargeError(TranslationServiceError, ValueError):
+    """Prompt 超出模型上下文长度，无法留出输出空间."""
+
+class PipelineCancelledError(TranslationServiceError):
+    """流水线已关闭 (shutdown)，片段未完成所有阶段."""
+
+class UpstreamError(TranslationServiceError):
+    """上游 API 调用失败 (不可重试的错误，或重试次数用尽)."""
+    def __init__(self, message, status_code=None, attempts=1):
+        """
+        构造函数.
+
+        Args:
+            message (str): 错误信息.
+            status_code (int): HTTP 状态码，连接错误等没有状态码时为 None.
+            attempts (int): 已尝试的次数.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.attempts = attempts
+
+class RateLimitedError(UpstreamError):
+    """上游持续返回 429，重试次数用尽."""
+
+class UpstreamTimeoutError(UpstreamError):
+    """上游请求超时或连接失败，重试次数用尽."""
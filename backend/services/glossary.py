@@ -0,0 +1,546 @@
+# backend/services/glossary.py
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from backend.config import GLOSSARY_ENABLED, GLOSSARY_PATH, GLOSSARY_PRUNING_ENABLED, GLOSSARY_IGNORE_AFTER, GLOSSARY_IGNORE_TTL, GLOSSARY_SAVE_DELAY
+from backend.config import GLOSSARY_LOCAL_ANSWER
+from backend.services.token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+TABLE_HEADER = "| 英文 | 中文 |\n| --- | --- |"
+TOKEN_RE = re.compile(r"[A-Za-z][A-Za-z0-9]*(?:[-+#.][A-Za-z0-9+#]+)*") # 英文单词 (允许 GPT-4, C++, Node.js 这类写法)
+SENTENCE_END_CHARS = ".!?:;\n\"'“(（-*>#|"
+CANDIDATE_STOPWORDS = {"i", "i'm", "a", "an", "the", "ok", "okay"}
+
+def parse_term_table(markdown):
+    """
+    解析 Proper Nouns Spotting 返回的 Markdown 表格.
+
+    Args:
+        markdown (str): Markdown 表格文本，允许表格前后有其他文字.
+
+    Returns:
+        list[tuple]: (英文, 中文) 列表，跳过表头和分隔行.
+    """
+    entries = []
+    for line in markdown.splitlines():
+        line = line.strip()
+        if not line.startswith("|"):
+            continue
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        if len(cells) < 2 or not cells[0]:
+            continue
+        if set(cells[0]) <= set("-: "): # 分隔行
+            continue
+        if cells[0] in ("英文", "English") and cells[1] in ("中文", "Chinese"): # 表头
+            continue
+        entries.append((cells[0], cells[1]))
+    return entries
+
+def format_term_table(entries):
+    """把 (英文, 中文) 列表格式化为与 Prompt 示例一致的 Markdown 表格."""
+    lines = [TABLE_HEADER]
+    for source, target in entries:
+        lines.append(f"| {source} | {target} |")
+    return "\n".join(lines)
+
+def _lower_same_length(text):
+    """小写化文本，并保证结果与原文逐字符对齐 (个别字符小写后长度变化时保留原字符)."""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+def _is_word_char(c):
+    return c.isascii() and c.isalnum()
+
+class AhoCorasickMatcher:
+    """
+    Aho-Corasick 多模式匹配器 (不区分大小写，按英文单词边界匹配).
+
+    构建后对任意文本的匹配只需扫描一遍，耗时与文本长度和匹配数成正比，与模式数量无关.
+    """
+    def __init__(self, patterns):
+        """
+        构造函数.
+
+        Args:
+            patterns (list[str]): 需要匹配的模式，匹配结果中用模式在列表中的下标表示.
+        """
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for index, pattern in enumerate(self.patterns):
+            self._add(_lower_same_length(pattern), index)
+        self._build()
+
+    def _add(self, pattern, index):
+        if not pattern:
+            return
+        node = 0
+        for c in pattern:
+            next_node = self._goto[node].get(c)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][c] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(index)
+
+    def _build(self):
+        """广度优先计算失败指针，并合并输出集合."""
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for c, child in self._goto[node].items():
+                pending.append(child)
+                fail = self._fail[node]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(c, 0) if self._goto[fail].get(c, 0) != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find_all(self, text):
+        """
+        查找文本中所有满足单词边界的匹配.
+
+        Returns:
+            list[tuple]: (start, end, pattern_index) 列表，按结束位置排序.
+        """
+        matches = []
+        lowered = _lower_same_length(text)
+        node = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for position, c in enumerate(lowered):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for index in output[node]:
+                start = position - len(self.patterns[index]) + 1
+                end = position + 1
+                # 模式首尾是字母数字时，要求匹配位置前后不能紧跟字母数字 (避免 Token 匹配到 Tokenizer)
+                if _is_word_char(lowered[start]) and start > 0 and _is_word_char(lowered[start - 1]):
+                    continue
+                if _is_word_char(lowered[end - 1]) and end < len(lowered) and _is_word_char(lowered[end]):
+                    continue
+                matches.append((start, end, index))
+        return matches
+
+class TermTable:
+    """
+    解析后的专有名词表格，按英文术语建立 Aho-Corasick 索引.
+
+    下游 Prompt 只需要当前片段中真正出现的术语，prune 可以在一次扫描中找出这些条目.
+    """
+    def __init__(self, entries):
+        """
+        构造函数.
+
+        Args:
+            entries (list[tuple]): (英文, 中文) 列表.
+        """
+        self.entries = list(entries)
+        self._matcher = AhoCorasickMatcher([source for source, _ in self.entries])
+
+    @classmethod
+    def from_markdown(cls, markdown):
+        """从 Markdown 表格构建 TermTable (相同表格的解析结果会被缓存)."""
+        return _parse_term_table_cached(markdown)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def prune(self, *texts):
+        """
+        返回在任一文本中出现过的条目，保持原表格中的顺序.
+
+        Args:
+            *texts (str): 需要检查的文本 (如原文、直接翻译结果).
+
+        Returns:
+            list[tuple]: (英文, 中文) 列表.
+        """
+        hit = set()
+        for text in texts:
+            if text:
+                hit.update(index for _, _, index in self._matcher.find_all(text))
+        return [entry for index, entry in enumerate(self.entries) if index in hit]
+
+@lru_cache(maxsize=64)
+def _parse_term_table_cached(markdown):
+    # 同一张表格会被同一文档的所有片段和所有阶段重复使用，缓存解析和索引结果
+    return TermTable(parse_term_table(markdown))
+
+class PruningStats:
+    """累计的术语表裁剪效果统计 (token 数只在 DEBUG 日志开启时统计)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rows_total = 0
+        self.rows_kept = 0
+        self.chars_total = 0
+        self.chars_kept = 0
+        self.tokens_total = 0
+        self.tokens_kept = 0
+
+    def record(self, rows_total, rows_kept, chars_total, chars_kept, tokens_total, tokens_kept):
+        with self._lock:
+            self.calls += 1
+            self.rows_total += rows_total
+            self.rows_kept += rows_kept
+            self.chars_total += chars_total
+            self.chars_kept += chars_kept
+            self.tokens_total += tokens_total
+            self.tokens_kept += tokens_kept
+
+    def snapshot(self):
+        """返回统计数据字典."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "rows_total": self.rows_total,
+                "rows_kept": self.rows_kept,
+                "chars_total": self.chars_total,
+                "chars_saved": self.chars_total - self.chars_kept,
+                "tokens_total": self.tokens_total,
+                "tokens_saved": self.tokens_total - self.tokens_kept,
+            }
+
+pruning_stats = PruningStats()
+
+def prune_term_table(table_markdown, *texts):
+    """
+    裁剪专有名词表格，只保留在给定文本中出现过的术语.
+
+    表格无法解析 (如用户手动输入的非表格内容) 或裁剪功能关闭时原样返回.
+
+    Args:
+        table_markdown (str): 完整的专有名词 Markdown 表格.
+        *texts (str): 当前片段的原文、直接翻译结果等.
+
+    Returns:
+        str: 裁剪后的 Markdown 表格.
+    """
+    if not GLOSSARY_PRUNING_ENABLED or not table_markdown:
+        return table_markdown
+    table = TermTable.from_markdown(table_markdown)
+    if not table.entries:
+        return table_markdown
+    kept = table.prune(*texts)
+    pruned = format_term_table(kept)
+    if len(pruned) >= len(table_markdown): # 裁剪没有带来收益时保留原表格的格式
+        pruned = table_markdown
+    tokens_total = tokens_kept = 0
+    if logger.isEnabledFor(logging.DEBUG): # 每次构建 Prompt 都会调用，token 数只在调试时计算
+        tokens_total, tokens_kept = count_tokens(table_markdown), count_tokens(pruned)
+        logger.debug("Proper nouns table pruned: kept %s/%s rows, ~%s prompt tokens saved", len(kept), len(table), tokens_total - tokens_kept)
+    pruning_stats.record(len(table), len(kept), len(table_markdown), len(pruned), tokens_total, tokens_kept)
+    return pruned
+
+def _candidate_terms(text):
+    """
+    用启发式规则找出文本中可能是专有名词或技术术语的英文单词.
+
+    包括：全大写缩写 (LLM)、驼峰或带数字的写法 (ChatGPT, GPT-4)、句中首字母大写的单词 (Transformer).
+    句首的首字母大写单词不计入.
+
+    Returns:
+        list[tuple]: (start, end, word) 列表.
+    """
+    candidates = []
+    for match in TOKEN_RE.finditer(text):
+        word = match.group(0)
+        if word.lower() in CANDIDATE_STOPWORDS:
+            continue
+        letters = [c for c in word if c.isalpha()]
+        is_acronym = len(letters) >= 2 and all(c.isupper() for c in letters)
+        is_mixed = any(c.isupper() for c in word[1:]) or (any(c.isdigit() for c in word) and len(letters) >= 1)
+        is_capitalized = word[0].isupper()
+        if not (is_acronym or is_mixed or is_capitalized):
+            continue
+        if not (is_acronym or is_mixed):
+            preceding = text[:match.start()].rstrip(" \t")
+            if not preceding or preceding[-1] in SENTENCE_END_CHARS or preceding[-1].isdigit():
+                continue # 句首大写，不一定是专有名词
+        candidates.append((match.start(), match.end(), word))
+    return candidates
+
+class Glossary:
+    """
+    持久化的术语表 (英文 -> 中文)，使已知术语在各段落中的译法保持一致.
+
+    开启 local_answer 时，原文中只有已知术语的段落直接由术语表给出结果，跳过 Proper Nouns Spotting 调用.
+    未知术语只能通过启发式的候选词 (见 _candidate_terms) 发现，全小写的术语 (如 diffusion models) 不在其中，
+    因此默认关闭，始终由 LLM 识别，术语表只用于统一译法.
+    除了术语本身，还记录 LLM 没有识别为术语的候选词 (ignored)：一个候选词连续 ignore_after 次没有出现在
+    LLM 返回的表格中才视为非术语，不再触发 LLM 调用，因此一次不完整的回答不会让它永久失效；
+    非术语标记在 ignore_ttl 秒后过期，重新交给 LLM 判断.
+
+    变化后延迟 save_delay 秒写回文件，期间的多次变化合并为一次写入.
+    """
+    def __init__(self, path=None, ignore_after=GLOSSARY_IGNORE_AFTER, ignore_ttl=GLOSSARY_IGNORE_TTL, save_delay=GLOSSARY_SAVE_DELAY,
+                 local_answer=GLOSSARY_LOCAL_ANSWER):
+        """
+        构造函数.
+
+        Args:
+            path (str): JSON 文件路径，为空时只保存在内存中.
+            ignore_after (int): 候选词连续多少次没有被 LLM 识别为术语后视为非术语.
+            ignore_ttl (float): 非术语标记的有效期 (秒)，<=0 表示永不过期.
+            save_delay (float): 变化后延迟写回文件的秒数，<=0 表示立即写回.
+            local_answer (bool): 原文中没有未知候选词时是否由 try_answer 直接给出结果.
+        """
+        self.path = path
+        self.ignore_after = max(1, ignore_after)
+        self.ignore_ttl = ignore_ttl
+        self.save_delay = save_delay
+        self.local_answer = local_answer
+        self._terms = {} # 小写英文 -> (英文, 中文)
+        self._ignored = {} # 小写候选词 -> (连续未被识别为术语的次数, 最近一次的时间)
+        self._matcher = None
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock() # 串行化文件写入，写文件时不持有 _lock
+        self._save_timer = None
+        self._dirty = False
+        self._stats = {"local_hits": 0, "llm_calls": 0, "learned_terms": 0}
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for source, target in data.get("terms", []):
+                self._terms[source.lower()] = (source, target)
+            ignored = data.get("ignored", {})
+            if isinstance(ignored, list): # 旧格式只有单词列表，按只被忽略过一次处理
+                ignored = {word: [1, time.time()] for word in ignored}
+            self._ignored = {word.lower(): (int(misses), float(updated_at)) for word, (misses, updated_at) in ignored.items()}
+            logger.info("Glossary loaded from %s: %s terms, %s ignored words", self.path, len(self._terms), len(self._ignored))
+        except Exception as e:
+            logger.error("Error loading glossary %s: %s", self.path, e, exc_info=True)
+
+    def save(self):
+        """
+        立即写回 JSON 文件 (先写临时文件再替换，避免写入中途崩溃损坏文件).
+
+        只在持有 _lock 时复制数据，序列化和写文件不阻塞查询和 learn.
+        """
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                self._dirty = False
+                data = {
+                    "terms": sorted(self._terms.values(), key=lambda e: e[0].lower()),
+                    "ignored": {word: list(entry) for word, entry in sorted(self._ignored.items())},
+                }
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.error("Error saving glossary %s: %s", self.path, e, exc_info=True)
+
+    def _schedule_save(self):
+        """标记术语表已变化，save_delay 秒后写回文件 (已经安排了写入时不重复安排)."""
+        if not self.path:
+            return
+        if self.save_delay <= 0:
+            self.save()
+            return
+        with self._lock:
+            self._dirty = True
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """把尚未写回的变化立即写入文件 (进程退出时自动调用)."""
+        with self._lock:
+            timer, self._save_timer = self._save_timer, None
+            dirty = self._dirty
+        if timer is not None:
+            timer.cancel()
+        if dirty:
+            self.save()
+
+    def _is_ignored(self, key, now):
+        entry = self._ignored.get(key)
+        if entry is None or entry[0] < self.ignore_after:
+            return False
+        return self.ignore_ttl <= 0 or now - entry[1] <= self.ignore_ttl
+
+    def __len__(self):
+        return len(self._terms)
+
+    def _get_matcher(self):
+        with self._lock:
+            if self._matcher is None:
+                self._matcher = AhoCorasickMatcher([source for source, _ in self._terms.values()])
+            return self._matcher
+
+    def lookup(self, text):
+        """
+        查找文本中出现的已知术语.
+
+        Returns:
+            list[tuple]: 按首次出现顺序排列、去重后的 (英文, 中文) 列表.
+        """
+        matcher = self._get_matcher()
+        seen, entries = set(), []
+        for _, _, index in sorted(matcher.find_all(text)):
+            source = matcher.patterns[index]
+            if source.lower() not in seen:
+                seen.add(source.lower())
+                entries.append(self._terms[source.lower()])
+        return entries
+
+    def unknown_candidates(self, text):
+        """
+        返回文本中既不在术语表中、也未被标记为非术语的候选词.
+
+        Returns:
+            list[str]: 去重后的候选词.
+        """
+        covered = [(start, end) for start, end, _ in self._get_matcher().find_all(text)]
+        unknown, seen, now = [], set(), time.time()
+        for start, end, word in _candidate_terms(text):
+            if any(s <= start and end <= e for s, e in covered):
+                continue
+            key = word.lower()
+            if key in self._terms or key in seen or self._is_ignored(key, now):
+                continue
+            seen.add(key)
+            unknown.append(word)
+        return unknown
+
+    def fingerprint(self, text):
+        """
+        术语表中与该文本相关的部分 (出现的已知术语及译法、未知候选词) 的指纹.
+
+        只有这部分变化才会影响该文本的 Proper Nouns Spotting 结果，流水线用它判断之前的结果是否仍然有效.
+
+        Returns:
+            str: 指纹文本.
+        """
+        return json.dumps([self.lookup(text), self.unknown_candidates(text)], ensure_ascii=False)
+
+    def try_answer(self, text):
+        """
+        如果开启了 local_answer 且文本中没有未知的候选词，直接用术语表生成结果表格.
+
+        Returns:
+            str | None: Markdown 表格；未开启 local_answer 或存在未知候选词时返回 None，需要调用 LLM.
+        """
+        if not self.local_answer:
+            with self._lock:
+                self._stats["llm_calls"] += 1
+            return None
+        unknown = self.unknown_candidates(text)
+        if unknown:
+            logger.info("Glossary miss: %s unknown candidate terms, e.g. %s", len(unknown), unknown[:5])
+            with self._lock:
+                self._stats["llm_calls"] += 1
+            return None
+        with self._lock:
+            self._stats["local_hits"] += 1
+        return format_term_table(self.lookup(text))
+
+    def learn(self, text, table_markdown):
+        """
+        把 LLM 返回的术语表合并进术语表 (已有术语保持不变)，并记录 LLM 未识别为术语的候选词
+        (连续 ignore_after 次未被识别后视为非术语).
+
+        Args:
+            text (str): 发给 LLM 的原文.
+            table_markdown (str): LLM 返回的 Markdown 表格.
+
+        Returns:
+            list[tuple]: 合并后该原文对应的 (英文, 中文) 列表，已知术语使用术语表中的译法.
+        """
+        entries = parse_term_table(table_markdown)
+        if not entries and "|" not in table_markdown: # 不是表格 (LLM 没有按要求返回)，不做任何推断
+            return []
+        candidates = self.unknown_candidates(text)
+        learned, now = 0, time.time()
+        with self._lock:
+            for source, target in entries:
+                key = source.lower()
+                if key not in self._terms and target:
+                    self._terms[key] = (source, target)
+                    self._ignored.pop(key, None)
+                    learned += 1
+            returned_words = {word.lower() for source, _ in entries for word in TOKEN_RE.findall(source)}
+            for word in candidates:
+                key = word.lower()
+                if key in self._terms:
+                    continue
+                if key in returned_words: # LLM 认为是术语的一部分，重新计数
+                    self._ignored.pop(key, None)
+                    continue
+                misses, updated_at = self._ignored.get(key, (0, now))
+                if self.ignore_ttl > 0 and now - updated_at > self.ignore_ttl: # 过期的标记从头计数
+                    misses = 0
+                self._ignored[key] = (misses + 1, now)
+            if learned:
+                self._matcher = None
+            self._stats["learned_terms"] += learned
+        if learned:
+            logger.info("Glossary learned %s new terms (%s total)", learned, len(self._terms))
+        if learned or candidates:
+            self._schedule_save()
+
+        merged, seen = [], set()
+        for source, target in entries:
+            known = self._terms.get(source.lower(), (source, target))
+            if known[0].lower() not in seen:
+                seen.add(known[0].lower())
+                merged.append(known)
+        for entry in self.lookup(text):
+            if entry[0].lower() not in seen:
+                seen.add(entry[0].lower())
+                merged.append(entry)
+        return merged
+
+    def stats(self):
+        """返回 local_hits / llm_calls / learned_terms 计数和术语数量."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["terms"] = len(self._terms)
+        return stats
+
+_glossary = None
+_glossary_lock = threading.Lock()
+
+def get_glossary():
+    """
+    获取进程级共享的术语表 (按 backend.config 中的配置创建).
+
+    Returns:
+        Glossary | None: 术语表实例，GLOSSARY_ENABLED 关闭时返回 None.
+    """
+    global _glossary
+    if not GLOSSARY_ENABLED:
+        return None
+    if _glossary is None:
+        with _glossary_lock:
+            if _glossary is None:
+                _glossary = Glossary(GLOSSARY_PATH)
+                atexit.register(_glossary.flush)
+    return _glossary
@@ -0,0 +1,259 @@
+# backend/services/incremental.py
+import difflib
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from backend.config import PIPELINE_MEMO_ENABLED, PIPELINE_MEMO_ITEMS
+from backend.services.ingestion import translatable_segments
+
+logger = logging.getLogger(__name__)
+
+def stage_key(stage, model, template_digest, args):
+    """
+    计算流水线阶段的输入指纹.
+
+    阶段的输出只取决于阶段名称、模型、Prompt 模板和传给 run_prompt 的参数 (原文和上游阶段的输出)，
+    任何一项变化都会得到新的 key，上游结果不变时下游阶段直接复用之前的输出.
+
+    Returns:
+        str: sha256 十六进制摘要.
+    """
+    payload = json.dumps([stage, model, template_digest, list(args)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class StageMemo:
+    """
+    按输入指纹记录流水线各阶段输出的内存 LRU.
+
+    条目可以附带一个校验值 (如术语表中与该片段相关的部分)，读取时校验值不一致视为未命中.
+    key 是输入内容的摘要，因此可以在多个会话之间共享.
+    """
+    def __init__(self, max_items=8192):
+        self.max_items = max_items
+        self._entries = OrderedDict() # key -> (输出, 校验值)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    def get(self, key, validator=None):
+        """
+        读取阶段输出.
+
+        Args:
+            key (str): stage_key 返回的指纹.
+            validator (str): 当前的校验值，为 None 表示不校验.
+
+        Returns:
+            str | None: 之前的输出，未命中或校验值不一致时为 None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if validator is not None and entry[1] != validator:
+                self._stats["stale"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key, output, validator=None):
+        with self._lock:
+            self._entries[key] = (output, validator)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["items"] = len(self._entries)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_stage_memo = None
+_stage_memo_lock = threading.Lock()
+
+def get_stage_memo():
+    """
+    获取进程级共享的阶段输出记录.
+
+    Returns:
+        StageMemo | None: PIPELINE_MEMO_ENABLED 关闭时返回 None.
+    """
+    global _stage_memo
+    if not PIPELINE_MEMO_ENABLED:
+        return None
+    if _stage_memo is None:
+        with _stage_memo_lock:
+            if _stage_memo is None:
+                _stage_memo = StageMemo(PIPELINE_MEMO_ITEMS)
+    return _stage_memo
+
+def _map_boundary(opcodes, boundary, prefer_left):
+    """
+    把旧文本中的位置映射到新文本.
+
+    位置正好落在插入处时，prefer_left 为 True 表示插入的文本归左侧的片段 (映射到插入之后).
+    """
+    candidates = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 < boundary < i2:
+            return j1 + boundary - i1 if tag == "equal" else j1 + min(boundary - i1, j2 - j1)
+        if i1 == boundary:
+            candidates.append(j1)
+        if i2 == boundary:
+            candidates.append(j2)
+    return max(candidates) if prefer_left else min(candidates)
+
+def split_edited_text(pieces, edited, editable):
+    """
+    把编辑后的文本按原来的分段切回各片段.
+
+    先去掉新旧文本的公共前缀和公共后缀，只对中间发生变化的部分做 diff，长文档中的局部修改也能很快完成.
+    片段之间的插入优先归属可编辑的片段.
+
+    Args:
+        pieces (list[str]): 拼接成原文本的各片段.
+        edited (str): 编辑后的文本.
+        editable (list[bool]): 各片段是否可编辑.
+
+    Returns:
+        list[str]: 编辑后各片段的文本，依次拼接等于 edited.
+    """
+    old = "".join(pieces)
+    limit = min(len(old), len(edited))
+    prefix = 0
+    while prefix < limit and old[prefix] == edited[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[len(old) - 1 - suffix] == edited[len(edited) - 1 - suffix]:
+        suffix += 1
+    matcher = difflib.SequenceMatcher(None, old[prefix:len(old) - suffix], edited[prefix:len(edited) - suffix], autojunk=False)
+    opcodes = [("equal", 0, prefix, 0, prefix)]
+    opcodes += [(tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix) for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+    opcodes.append(("equal", len(old) - suffix, len(old), len(edited) - suffix, len(edited)))
+
+    result, position, start = [], 0, 0
+    for i, piece in enumerate(pieces):
+        position += len(piece)
+        if i == len(pieces) - 1:
+            end = len(edited)
+        else:
+            prefer_left = editable[i] and not editable[i + 1]
+            end = max(start, _map_boundary(opcodes, position, prefer_left))
+        result.append(edited[start:end])
+        start = end
+    return result
+
+class PipelineSnapshot:
+    """
+    一次 "一键运行" 的结果快照：切分后的原文块、各片段的结果和用户修改过的阶段输出.
+
+    输出框中的文本由快照渲染，用户修改输出框后再次运行时，用快照把修改后的文本切回各片段，
+    按该阶段当时的输入指纹记为覆盖值 (override) 交给流水线. 输入不变时流水线直接使用覆盖值，
+    下游阶段的输入随之变化而重新计算；原文或上游输出变化后覆盖值自然失效.
+    """
+    JOINED_SEPARATOR = "\n\n"
+
+    def __init__(self, segments, results, overrides=None):
+        """
+        构造函数.
+
+        Args:
+            segments (list[Segment]): segment_document 返回的结构块.
+            results (list[SegmentResult | None]): 各需要翻译的块的结果，尚未完成的为 None.
+            overrides (dict): 阶段输入指纹 -> 用户修改后的输出.
+        """
+        self.segments = segments
+        self.results = results
+        self.overrides = dict(overrides or {})
+
+    def _output(self, position, stage):
+        result = self.results[position]
+        if result is None or not result.ok:
+            return None
+        return result.outputs.get(stage)
+
+    def pieces(self, stage, structured):
+        """
+        渲染某个阶段输出时的各部分.
+
+        Args:
+            stage (str): 阶段名称.
+            structured (bool): True 表示按原文结构重组 (译文)，False 表示按片段顺序用空行拼接 (术语表、问题列表).
+
+        Returns:
+            list[tuple]: (片段在需要翻译的块中的序号或 None, 文本)，序号为 None 的部分不可编辑.
+        """
+        pieces = []
+        if structured:
+            positions = {segment.index: i for i, segment in enumerate(translatable_segments(self.segments))}
+            for segment in self.segments:
+                position = positions.get(segment.index)
+                output = self._output(position, stage) if position is not None else None
+                if output is None:
+                    pieces.append((None, segment.original))
+                else:
+                    pieces.extend([(None, segment.prefix), (position, segment.restore(output.strip("\r\n"))), (None, segment.suffix)])
+            return pieces
+        for position, result in enumerate(self.results):
+            if result is None:
+                continue
+            if pieces:
+                pieces.append((None, self.JOINED_SEPARATOR))
+            output = self._output(position, stage)
+            pieces.append((position, output) if output is not None else (None, f"Error: {result.error}" if not result.ok else ""))
+        return pieces
+
+    def render(self, stage, structured):
+        """渲染某个阶段的输出框文本."""
+        return "".join(text for _, text in self.pieces(stage, structured))
+
+    def collect_overrides(self, stage, structured, edited):
+        """
+        把用户在输出框中修改后的文本切回各片段，记录与当前结果不同的片段.
+
+        Args:
+            stage (str): 阶段名称.
+            structured (bool): 与 render 相同.
+            edited (str): 输出框中的当前文本.
+
+        Returns:
+            int: 被修改的片段数.
+        """
+        pieces = self.pieces(stage, structured)
+        rendered = "".join(text for _, text in pieces)
+        if edited is None or edited == rendered:
+            return 0
+        new_texts = split_edited_text([text for _, text in pieces], edited, [position is not None for position, _ in pieces])
+        changed = 0
+        for (position, text), new_text in zip(pieces, new_texts):
+            if new_text == text:
+                continue
+            if position is None:
+                logger.info("Ignoring edit of non-translated text in '%s' output: %r", stage, new_text[:50])
+                continue
+            key = self.results[position].keys.get(stage)
+            if key is None:
+                continue
+            if structured: # 译文中显示的是还原后的 URL，按流水线的输出重新替换为占位符
+                self.overrides[key] = translatable_segments(self.segments)[position].mask(new_text)
+            else:
+                self.overrides[key] = new_text.strip("\r\n")
+            changed += 1
+        return changed
+
+    def prune_overrides(self):
+        """丢弃本次运行中没有任何阶段使用的覆盖值 (原文或上游输出已经变化)."""
+        used = {key for result in self.results if result is not None for key in result.keys.values()}
+        self.overrides = {key: output for key, output in self.overrides.items() if key in used}
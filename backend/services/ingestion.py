@@ -0,0 +1,246 @@
+# backend/services/ingestion.py
+import logging
+import re
+
+from backend.services.token_budget import count_tokens, split_text_to_budget
+
+logger = logging.getLogger(__name__)
+
+FENCE_RE = re.compile(r"^\s{0,3}(`{3,}|~{3,})") # ``` 或 ~~~ 代码块围栏
+HEADING_RE = re.compile(r"^(\s{0,3}#{1,6}\s+)(.*)$") # Markdown 标题
+TABLE_LINE_RE = re.compile(r"^\s*\|.*\|\s*$") # Markdown 表格行
+URL_LINE_RE = re.compile(r"^\s*(<?https?://\S+>?|\[[^\]]*\]:\s*\S+.*)\s*$") # 单独一行的 URL 或链接定义
+IMAGE_LINE_RE = re.compile(r"^\s*!\[[^\]]*\]\([^)]*\)\s*$") # 单独一行的图片
+INDENTED_CODE_RE = re.compile(r"^( {4}|\t)")
+HTML_COMMENT_RE = re.compile(r"^\s*<!--.*-->\s*$")
+# 段落中的 URL：<自动链接>、链接和图片的目标 (含一层括号和可选的标题)、裸 URL (不含末尾的标点)
+INLINE_URL_RE = re.compile(
+    r"<https?://[^>\s]+>"
+    r"|(?<=\]\()(?:[^()\s]|\([^()\s]*\))+(?:\s+\"[^\"]*\")?(?=\))"
+    r"|https?://[^\s<>()\[\]]*[^\s<>()\[\].,;:!?'\"]"
+)
+URL_PLACEHOLDER = "<URL{}>" # 交给 LLM 的文本中代替 URL 的占位符
+URL_PLACEHOLDER_RE = re.compile(r"[<＜]URL(\d+)[>＞]") # 还原时兼容 LLM 改成的全角尖括号
+
+class Segment:
+    """文档中的一个结构块，translatable 为 False 的块原样保留."""
+    def __init__(self, index, kind, text, translatable, prefix="", suffix="", urls=None):
+        """
+        构造函数.
+
+        Args:
+            index (int): 块在文档中的序号.
+            kind (str): 块类型 (paragraph / heading / code / table / url / image / blank).
+            text (str): 需要翻译的文本 (不含 prefix 和 suffix)，其中的 URL 已替换为占位符.
+            translatable (bool): 是否需要翻译.
+            prefix (str): 重组时放在译文前的原始标记，如标题的 "## ".
+            suffix (str): 重组时放在译文后的原始换行.
+            urls (dict): 占位符 -> 原始 URL (见 mask_urls).
+        """
+        self.index = index
+        self.kind = kind
+        self.text = text
+        self.translatable = translatable
+        self.prefix = prefix
+        self.suffix = suffix
+        self.urls = urls or {}
+
+    @property
+    def original(self):
+        """块的原始文本 (重组时未翻译的块使用)."""
+        return self.prefix + self.restore(self.text) + self.suffix
+
+    def restore(self, text):
+        """把文本 (原文或译文) 中该块的 URL 占位符还原为原始 URL."""
+        return restore_urls(text, self.urls)
+
+    def mask(self, text):
+        """把文本 (如用户修改后的译文) 中该块的原始 URL 重新替换为占位符."""
+        for placeholder, url in sorted(self.urls.items(), key=lambda item: -len(item[1])):
+            text = text.replace(url, placeholder)
+        return text
+
+    def __repr__(self):
+        return f"Segment(index={self.index}, kind={self.kind!r}, translatable={self.translatable}, text={self.text[:30]!r})"
+
+def _split_trailing_newline(text):
+    """把文本末尾的换行分离出来，返回 (正文, 换行)."""
+    stripped = text.rstrip("\r\n")
+    return stripped, text[len(stripped):]
+
+def mask_urls(text):
+    """
+    把段落中的 URL (自动链接、链接和图片的目标、裸 URL) 替换为 <URL1>、<URL2> 这样的占位符，
+    LLM 只看到占位符，不会改写或翻译链接.
+
+    Returns:
+        tuple: (替换后的文本, 占位符 -> 原始 URL).
+    """
+    urls = {}
+    def replace(match):
+        placeholder = URL_PLACEHOLDER.format(len(urls) + 1)
+        urls[placeholder] = match.group(0)
+        return placeholder
+    return INLINE_URL_RE.sub(replace, text), urls
+
+def restore_urls(text, urls):
+    """把 mask_urls 的占位符还原为原始 URL，不认识的占位符原样保留."""
+    if not urls or not text:
+        return text
+    return URL_PLACEHOLDER_RE.sub(lambda m: urls.get(URL_PLACEHOLDER.format(m.group(1)), m.group(0)), text)
+
+def segment_document(text, max_tokens=None, model=None):
+    """
+    把 Markdown / 纯文本文档切分为段落级的结构块.
+
+    代码块、表格、单独成行的 URL 和图片、HTML 注释以及空行会被标记为不需要翻译，
+    重组时原样输出；标题只翻译标题文字，保留 # 标记. 段落和标题中的 URL 替换为占位符 (见 mask_urls)，重组时还原.
+    超过 max_tokens 的段落会继续按句子切分为多个片段.
+
+    Args:
+        text (str): 文档内容.
+        max_tokens (int): 单个片段的最大 token 数，为空时不限制.
+        model (str): 用于计数的模型名.
+
+    Returns:
+        list[Segment]: 按原文顺序排列的结构块，所有块的 original 拼接后等于原文.
+    """
+    lines = text.splitlines(keepends=True)
+    blocks = [] # (kind, lines, translatable)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        content = line.rstrip("\r\n")
+
+        fence = FENCE_RE.match(content)
+        if fence:
+            marker = fence.group(1)
+            block = [line]
+            i += 1
+            while i < len(lines):
+                block.append(lines[i])
+                i += 1
+                if lines[i - 1].strip().startswith(marker[0] * len(marker)):
+                    break
+            blocks.append(("code", block, False))
+            continue
+
+        if not content.strip():
+            block = []
+            while i < len(lines) and not lines[i].strip():
+                block.append(lines[i])
+                i += 1
+            blocks.append(("blank", block, False))
+            continue
+
+        # 缩进代码块只在空行之后 (或文档开头) 出现，避免误判段落中的续行缩进
+        if INDENTED_CODE_RE.match(content) and (not blocks or blocks[-1][0] in ("blank", "code")):
+            block = []
+            while i < len(lines) and (INDENTED_CODE_RE.match(lines[i]) or not lines[i].strip()):
+                block.append(lines[i])
+                i += 1
+            # 代码块末尾的空行归还给后面的 blank 块
+            trailing_blank = []
+            while block and not block[-1].strip():
+                trailing_blank.insert(0, block.pop())
+            blocks.append(("code", block, False))
+            if trailing_blank:
+                blocks.append(("blank", trailing_blank, False))
+            continue
+
+        if TABLE_LINE_RE.match(content):
+            block = []
+            while i < len(lines) and TABLE_LINE_RE.match(lines[i].rstrip("\r\n")):
+                block.append(lines[i])
+                i += 1
+            blocks.append(("table", block, False))
+            continue
+
+        if HEADING_RE.match(content):
+            blocks.append(("heading", [line], True))
+            i += 1
+            continue
+
+        if URL_LINE_RE.match(content) or IMAGE_LINE_RE.match(content) or HTML_COMMENT_RE.match(content):
+            kind = "image" if IMAGE_LINE_RE.match(content) else "url"
+            blocks.append((kind, [line], False))
+            i += 1
+            continue
+
+        # 普通段落：连续的非空行，遇到其他结构块的起始行时结束
+        block = []
+        while i < len(lines):
+            current = lines[i].rstrip("\r\n")
+            if not current.strip() or FENCE_RE.match(current) or HEADING_RE.match(current) or TABLE_LINE_RE.match(current):
+                break
+            if block and (URL_LINE_RE.match(current) or IMAGE_LINE_RE.match(current)):
+                break
+            block.append(lines[i])
+            i += 1
+        blocks.append(("paragraph", block, True))
+
+    segments = []
+    for kind, block, translatable in blocks:
+        raw = "".join(block)
+        if not translatable:
+            segments.append(Segment(len(segments), kind, raw, False))
+            continue
+        body, suffix = _split_trailing_newline(raw)
+        prefix = ""
+        if kind == "heading":
+            match = HEADING_RE.match(body)
+            prefix, body = match.group(1), match.group(2)
+        if not re.search(r"[A-Za-z]", INLINE_URL_RE.sub("", body)): # 除 URL 外没有任何字母的段落 (如分隔线、纯数字) 不需要翻译
+            segments.append(Segment(len(segments), kind, body, False, prefix, suffix))
+            continue
+        body, urls = mask_urls(body)
+        if max_tokens and kind == "paragraph" and count_tokens(body, model) > max_tokens:
+            # 超长段落按句子切分，每个片段保留与下一片段之间的原始空白
+            pieces = split_text_to_budget(body, max_tokens, model)
+            for piece_index, piece in enumerate(pieces):
+                piece_body = piece.rstrip()
+                piece_suffix = piece[len(piece_body):] + (suffix if piece_index == len(pieces) - 1 else "")
+                piece_urls = {placeholder: url for placeholder, url in urls.items() if placeholder in piece_body}
+                segments.append(Segment(len(segments), kind, piece_body, True, "", piece_suffix, piece_urls))
+            continue
+        segments.append(Segment(len(segments), kind, body, True, prefix, suffix, urls))
+
+    logger.info("Document segmented into %s blocks, %s translatable", len(segments), sum(1 for s in segments if s.translatable))
+    return segments
+
+def translatable_segments(segments):
+    """返回需要翻译的块."""
+    return [segment for segment in segments if segment.translatable]
+
+def reassemble(segments, translations):
+    """
+    按原文顺序和格式重组译文，译文中的 URL 占位符还原为原始 URL.
+
+    Args:
+        segments (list[Segment]): segment_document 返回的结构块.
+        translations (dict): 块序号 -> 译文，缺失的块使用原文.
+
+    Returns:
+        str: 重组后的文档.
+    """
+    parts = []
+    for segment in segments:
+        translation = translations.get(segment.index) if segment.translatable else None
+        if translation is None:
+            parts.append(segment.original)
+        else:
+            parts.append(segment.prefix + segment.restore(translation.strip("\r\n")) + segment.suffix)
+    return "".join(parts)
+
+def read_document(file_path):
+    """
+    读取上传的文档 (UTF-8，兼容带 BOM 的文件).
+
+    Args:
+        file_path (str): 文件路径.
+
+    Returns:
+        str: 文档内容.
+    """
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        return f.read()
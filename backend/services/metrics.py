@@ -0,0 +1,376 @@
+# backend/services/metrics.py
+import json
+import logging
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from backend.config import METRICS_ENABLED, METRICS_TRACE_PATH, MODEL_PRICING
+from backend.services.rate_limiter import rate_limiter_stats
+from backend.services.response_cache import get_response_cache
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "translator"
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0) # 秒
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+# 指标名 -> (类型, 说明)
+METRIC_HELP = {
+    "llm_request_duration_seconds": ("histogram", "Wall time of LLM calls, including rate limiting and retries"),
+    "llm_time_to_first_token_seconds": ("histogram", "Time until the first streamed token arrives"),
+    "llm_prompt_tokens": ("histogram", "Prompt tokens per LLM call"),
+    "llm_completion_tokens": ("histogram", "Completion tokens per LLM call"),
+    "llm_requests_total": ("counter", "LLM calls by outcome (ok / error / cache_hit)"),
+    "llm_tokens_total": ("counter", "Tokens sent to and received from the LLM"),
+    "llm_cost_usd_total": ("counter", "Estimated LLM cost in USD according to MODEL_PRICING"),
+    "llm_retries_total": ("counter", "Retries of transient upstream failures"),
+    "llm_route_events_total": ("counter", "Fallbacks to backup routes and hedged requests (hedge / hedge_won)"),
+    "pipeline_stage_duration_seconds": ("histogram", "Wall time of pipeline stages per segment"),
+    "pipeline_stage_total": ("counter", "Pipeline stage executions by outcome (ok / error / memo / override)"),
+    "rate_limiter_waiting": ("gauge", "Requests currently queued in the client-side rate limiter"),
+    "rate_limiter_wait_seconds_total": ("counter", "Total time requests spent queued in the rate limiter"),
+    "rate_limiter_throttled_total": ("counter", "Upstream 429 responses that paused the rate limiter"),
+    "response_cache_hit_rate": ("gauge", "Response cache hit rate since start"),
+    "response_cache_memory_items": ("gauge", "Entries in the in-memory response cache"),
+}
+
+def model_pricing(model):
+    """
+    返回模型的单价 (美元 / 百万 token)，按最长前缀匹配 MODEL_PRICING.
+
+    Returns:
+        tuple: (输入单价, 输出单价)，未配置的模型返回 (0, 0).
+    """
+    if model in MODEL_PRICING:
+        return MODEL_PRICING[model]
+    best = None
+    for name in MODEL_PRICING:
+        if model and model.startswith(name) and (best is None or len(name) > len(best)):
+            best = name
+    return MODEL_PRICING[best] if best else (0.0, 0.0)
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """按 MODEL_PRICING 估算一次调用的费用 (美元)."""
+    input_price, output_price = model_pricing(model)
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+class Histogram:
+    """累积分桶直方图 (Prometheus 语义)."""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, q):
+        """按桶边界线性插值估算分位数."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen, lower = 0, 0.0
+        for i, bound in enumerate(self.buckets):
+            if seen + self.counts[i] >= target:
+                fraction = (target - seen) / self.counts[i] if self.counts[i] else 0.0
+                return lower + (bound - lower) * fraction
+            seen += self.counts[i]
+            lower = bound
+        return self.buckets[-1] if self.buckets else 0.0
+
+def _escape_label_value(value):
+    """按 Prometheus 文本格式转义标签值中的反斜杠、双引号和换行 (模型名、错误类型可能包含这些字符)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    """
+    进程内的指标收集器.
+
+    记录每次 LLM 调用和每个流水线阶段的耗时、首 token 时间、token 用量、缓存命中与重试次数，
+    按 Service 类、模型、阶段聚合为直方图和计数器，可以渲染为 Prometheus 文本格式；
+    配置了 trace_path 时，每个事件同时以一行 JSON 追加写入 trace 文件.
+    """
+    def __init__(self, trace_path=None):
+        """
+        构造函数.
+
+        Args:
+            trace_path (str): JSONL trace 文件路径，为空表示不写 trace.
+        """
+        self._histograms = {} # 指标名 -> {labels: Histogram}
+        self._counters = {} # 指标名 -> {labels: 数值}
+        self._lock = threading.Lock()
+        self._trace = None
+        self._trace_lock = threading.Lock()
+        if trace_path:
+            try:
+                os.makedirs(os.path.dirname(trace_path) or ".", exist_ok=True)
+                self._trace = open(trace_path, 'a', encoding='utf-8', buffering=1) # 行缓冲，进程异常退出时不丢失已完成的事件
+            except OSError as e:
+                logger.error("Cannot open metrics trace file '%s': %s", trace_path, e)
+
+    def _observe(self, name, labels, value, buckets):
+        histogram = self._histograms.setdefault(name, {}).get(labels)
+        if histogram is None:
+            histogram = self._histograms[name][labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def _inc(self, name, labels, value=1):
+        counters = self._counters.setdefault(name, {})
+        counters[labels] = counters.get(labels, 0) + value
+
+    def _write_trace(self, event):
+        if self._trace is None:
+            return
+        event["ts"] = time.time()
+        line = json.dumps(event, ensure_ascii=False)
+        with self._trace_lock:
+            self._trace.write(line + "\n")
+
+    def record_llm_call(self, service, model, duration, ttft=None, prompt_tokens=0, completion_tokens=0, cache_hit=False, retries=0, error=None):
+        """
+        记录一次 LLM 调用.
+
+        Args:
+            service (str): Service 类名.
+            model (str): 模型名.
+            duration (float): 总耗时 (秒)，包含限流排队和重试.
+            ttft (float): 流式调用的首 token 时间 (秒)，非流式调用为 None.
+            prompt_tokens (int): Prompt token 数 (缓存命中时为 0).
+            completion_tokens (int): 输出 token 数 (缓存命中时为 0).
+            cache_hit (bool): 是否命中响应缓存.
+            retries (int): 重试次数.
+            error (Exception): 调用失败时的异常.
+        """
+        labels = (("service", service), ("model", model))
+        outcome = "error" if error is not None else ("cache_hit" if cache_hit else "ok")
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            self._inc("llm_requests_total", labels + (("outcome", outcome),))
+            self._observe("llm_request_duration_seconds", labels, duration, DURATION_BUCKETS)
+            if ttft is not None:
+                self._observe("llm_time_to_first_token_seconds", labels, ttft, DURATION_BUCKETS)
+            if not cache_hit and error is None:
+                self._observe("llm_prompt_tokens", labels, prompt_tokens, TOKEN_BUCKETS)
+                self._observe("llm_completion_tokens", labels, completion_tokens, TOKEN_BUCKETS)
+            self._inc("llm_tokens_total", labels + (("kind", "prompt"),), prompt_tokens)
+            self._inc("llm_tokens_total", labels + (("kind", "completion"),), completion_tokens)
+            self._inc("llm_cost_usd_total", labels, cost)
+            if retries:
+                self._inc("llm_retries_total", labels, retries)
+        self._write_trace({
+            "type": "llm_call", "service": service, "model": model, "outcome": outcome,
+            "duration": round(duration, 4), "ttft": None if ttft is None else round(ttft, 4),
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "cost_usd": round(cost, 8), "retries": retries, "error": None if error is None else str(error),
+        })
+
+    def record_route_event(self, service, model, event):
+        """
+        记录一次路由事件.
+
+        Args:
+            service (str): Service 类名.
+            model (str): 事件涉及的备用端点的模型名.
+            event (str): "fallback" (改用备用端点)、"hedge" (发送对冲请求) 或 "hedge_won" (对冲请求先返回).
+        """
+        with self._lock:
+            self._inc("llm_route_events_total", (("service", service), ("model", model), ("event", event)))
+        self._write_trace({"type": "route", "service": service, "model": model, "event": event})
+
+    def record_stage(self, stage, duration, error=None, segment=None, reused=None):
+        """
+        记录流水线中一个片段的一个阶段.
+
+        Args:
+            stage (str): 阶段名称.
+            duration (float): 耗时 (秒).
+            error (Exception): 阶段失败时的异常.
+            segment (int): 片段序号，只写入 trace.
+            reused (str): 复用了之前的输出时为 "memo"、"override"、"tm" (翻译记忆) 或 "derived" (由上游输出直接得到)，不计入耗时直方图.
+        """
+        labels = (("stage", stage),)
+        outcome = "error" if error is not None else (reused or "ok")
+        with self._lock:
+            if not reused:
+                self._observe("pipeline_stage_duration_seconds", labels, duration, DURATION_BUCKETS)
+            self._inc("pipeline_stage_total", labels + (("outcome", outcome),))
+        self._write_trace({
+            "type": "stage", "stage": stage, "segment": segment, "duration": round(duration, 4),
+            "outcome": outcome, "error": None if error is None else str(error),
+        })
+
+    def summary(self):
+        """
+        按 Service 和阶段汇总耗时与费用，便于找出占用时间和费用最多的环节.
+
+        Returns:
+            dict: {"llm": {service: {...}}, "stages": {stage: {...}}}，包含调用次数、平均 / p50 / p95 耗时、token 数和费用.
+        """
+        with self._lock:
+            llm, stages = {}, {}
+            for labels, histogram in self._histograms.get("llm_request_duration_seconds", {}).items():
+                service = dict(labels)["service"]
+                llm[service] = {
+                    "calls": histogram.count,
+                    "mean_seconds": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50_seconds": histogram.percentile(0.5),
+                    "p95_seconds": histogram.percentile(0.95),
+                    "prompt_tokens": self._counters.get("llm_tokens_total", {}).get(labels + (("kind", "prompt"),), 0),
+                    "completion_tokens": self._counters.get("llm_tokens_total", {}).get(labels + (("kind", "completion"),), 0),
+                    "cost_usd": self._counters.get("llm_cost_usd_total", {}).get(labels, 0.0),
+                }
+            for labels, histogram in self._histograms.get("pipeline_stage_duration_seconds", {}).items():
+                stages[dict(labels)["stage"]] = {
+                    "runs": histogram.count,
+                    "total_seconds": histogram.sum,
+                    "p50_seconds": histogram.percentile(0.5),
+                    "p95_seconds": histogram.percentile(0.95),
+                }
+        return {"llm": llm, "stages": stages}
+
+    def _gauges(self):
+        """采集限流器和响应缓存的实时状态."""
+        gauges, counters = {}, {}
+        for model, stats in rate_limiter_stats().items():
+            labels = (("model", model),)
+            gauges.setdefault("rate_limiter_waiting", {})[labels] = stats["waiting"]
+            counters.setdefault("rate_limiter_wait_seconds_total", {})[labels] = stats["wait_seconds"]
+            counters.setdefault("rate_limiter_throttled_total", {})[labels] = stats["throttled"]
+        cache = get_response_cache()
+        if cache is not None:
+            stats = cache.stats()
+            gauges["response_cache_hit_rate"] = {(): stats["hit_rate"]}
+            gauges["response_cache_memory_items"] = {(): stats["memory_items"]}
+        return gauges, counters
+
+    def render_prometheus(self):
+        """
+        渲染 Prometheus 文本格式 (text/plain; version=0.0.4).
+
+        Returns:
+            str: 指标文本.
+        """
+        gauges, live_counters = self._gauges()
+        lines = []
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            counters.update(live_counters)
+            for name, (kind, help_text) in METRIC_HELP.items():
+                full_name = f"{METRIC_PREFIX}_{name}"
+                if kind == "histogram":
+                    series = self._histograms.get(name)
+                    if not series:
+                        continue
+                    lines.append(f"# HELP {full_name} {help_text}")
+                    lines.append(f"# TYPE {full_name} histogram")
+                    for labels, histogram in series.items():
+                        cumulative = 0
+                        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                            cumulative += count
+                            lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', _format_number(bound)),))} {cumulative}")
+                        lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_number(histogram.sum)}")
+                        lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+                    continue
+                series = (gauges if kind == "gauge" else counters).get(name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for labels, value in series.items():
+                    lines.append(f"{full_name}{_format_labels(labels)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """关闭 trace 文件."""
+        with self._trace_lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+class _NullMetrics:
+    """METRICS_ENABLED 关闭时使用的空实现."""
+    def record_llm_call(self, *args, **kwargs):
+        pass
+
+    def record_route_event(self, *args, **kwargs):
+        pass
+
+    def record_stage(self, *args, **kwargs):
+        pass
+
+    def summary(self):
+        return {"llm": {}, "stages": {}}
+
+    def render_prometheus(self):
+        return ""
+
+    def close(self):
+        pass
+
+metrics = Metrics(METRICS_TRACE_PATH) if METRICS_ENABLED else _NullMetrics()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics 返回 Prometheus 文本，/metrics.json 返回按 Service 和阶段汇总的 JSON."""
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = metrics.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(metrics.summary(), ensure_ascii=False, indent=2).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # 抓取请求频繁，不写入访问日志
+        pass
+
+def start_metrics_server(host, port):
+    """
+    在后台线程中启动指标 HTTP 服务.
+
+    Args:
+        host (str): 监听地址.
+        port (int): 监听端口，<=0 表示不启动.
+
+    Returns:
+        ThreadingHTTPServer | None: 服务实例，未启动或端口被占用时返回 None.
+    """
+    if port <= 0 or not METRICS_ENABLED:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error("Cannot start metrics server on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
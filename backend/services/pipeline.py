@@ -0,0 +1,458 @@
+# backend/services/pipeline.py
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config import PIPELINE_STAGE_CONCURRENCY, PIPELINE_FUSED_REVIEW, TRANSLATION_MEMORY_ENABLED, TRANSLATION_MEMORY_REUSE_THRESHOLD, TRANSLATION_MEMORY_REFERENCE_THRESHOLD
+from backend.config import SEGMENT_MAX_TOKENS
+from backend.services.registry import get_service
+from backend.services.errors import PipelineCancelledError
+from backend.services.metrics import metrics
+from backend.services.glossary import get_glossary, format_term_table
+from backend.services.incremental import stage_key, get_stage_memo
+from backend.services.token_budget import context_limit, input_token_budget
+from backend.services.translation_service import ProperNounsSpottingService, StraightUpTranslationService, IssueSpottingService, LooseTranslationService
+from backend.services.translation_service import ReviewAndReviseService, parse_review
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    """流水线中的一个阶段：使用哪个 Service、依赖哪些阶段、如何组装 run_prompt 的参数."""
+    def __init__(self, name, service_cls, dependencies, build_args, validator=None, shortcut=None):
+        """
+        构造函数.
+
+        Args:
+            name (str): 阶段名称，同时作为结果字典的 key.
+            service_cls (type): 执行该阶段的 BaseTranslationService 子类.
+            dependencies (tuple): 依赖的阶段名称.
+            build_args (callable): build_args(origin_text, results) -> tuple，返回传给 run_prompt 的位置参数.
+            validator (callable): validator(origin_text) -> str，参数以外影响输出的外部状态 (如术语表) 的指纹，
+                与之前记录的不一致时重新计算.
+            shortcut (callable): shortcut(origin_text, results) -> str | None，能由上游输出直接得到该阶段的输出时返回该输出，
+                不调用 Service；返回 None 时照常调用 run_prompt.
+        """
+        self.name = name
+        self.service_cls = service_cls
+        self.dependencies = tuple(dependencies)
+        self.build_args = build_args
+        self.validator = validator
+        self.shortcut = shortcut
+
+def _glossary_validator(origin_text):
+    """术语表中与该片段相关的部分 (已知术语及译法、未知候选词) 的指纹."""
+    glossary = get_glossary()
+    return glossary.fingerprint(origin_text) if glossary is not None else ""
+
+# 四轮接力翻译的阶段依赖关系
+DEFAULT_STAGES = (
+    Stage("proper_nouns", ProperNounsSpottingService, (),
+          lambda origin_text, r: (origin_text,), validator=_glossary_validator),
+    Stage("straight_up", StraightUpTranslationService, ("proper_nouns",),
+          lambda origin_text, r: (origin_text, r["proper_nouns"])),
+    Stage("issue_spotting", IssueSpottingService, ("straight_up", "proper_nouns"),
+          lambda origin_text, r: (r["straight_up"], origin_text, r["proper_nouns"])),
+    Stage("loose_translation", LooseTranslationService, ("straight_up", "issue_spotting", "proper_nouns"),
+          lambda origin_text, r: (r["straight_up"], r["issue_spotting"], origin_text, r["proper_nouns"])),
+)
+FINAL_STAGE = "loose_translation" # 输出即最终译文的阶段，结果写入翻译记忆
+REVIEW_STAGE = "review" # 合并模式中同时给出问题列表和修改后译文的阶段
+
+def _fused_issues(origin_text, r):
+    """合并调用返回的问题列表，输出为空时单独调用问题识别."""
+    return parse_review(r[REVIEW_STAGE])[0]
+
+def _fused_revision(origin_text, r):
+    """
+    合并调用返回的修改后译文.
+
+    问题列表与合并调用给出的不同 (用户修改了问题列表或问题列表来自翻译记忆) 或没有译文部分时返回 None，
+    由意译步骤按当前的问题列表调用 (问题列表为空时直接使用直接翻译的结果，见 LooseTranslationService.skip_revision).
+    """
+    issues, revision = parse_review(r[REVIEW_STAGE])
+    if revision is None or issues != r["issue_spotting"]:
+        return None
+    return revision
+
+# 合并模式 (PIPELINE_FUSED_REVIEW)：问题识别和意译由一次 review 调用完成，两个阶段的输出从 review 的结果中拆分，
+# 阶段名称和输出与四轮接力相同. 拆分失败或问题列表被修改时退回单独调用对应的 Service.
+FUSED_STAGES = DEFAULT_STAGES[:2] + (
+    Stage(REVIEW_STAGE, ReviewAndReviseService, ("straight_up", "proper_nouns"),
+          lambda origin_text, r: (r["straight_up"], origin_text, r["proper_nouns"])),
+    Stage("issue_spotting", IssueSpottingService, ("straight_up", "proper_nouns", REVIEW_STAGE),
+          lambda origin_text, r: (r["straight_up"], origin_text, r["proper_nouns"]), shortcut=_fused_issues),
+    Stage("loose_translation", LooseTranslationService, ("straight_up", "issue_spotting", "proper_nouns", REVIEW_STAGE),
+          lambda origin_text, r: (r["straight_up"], r["issue_spotting"], origin_text, r["proper_nouns"]), shortcut=_fused_revision),
+)
+
+def configured_stages():
+    """按 PIPELINE_FUSED_REVIEW 返回 DEFAULT_STAGES 或 FUSED_STAGES."""
+    return FUSED_STAGES if PIPELINE_FUSED_REVIEW else DEFAULT_STAGES
+
+def segment_limits(stages=None):
+    """
+    文档切分为流水线片段时使用的 token 上限和计数模型.
+
+    按各阶段路由的主端点模型中上下文最短的一个计算：上限为 SEGMENT_MAX_TOKENS 与该阶段 (原文加 Prompt 模板) 输入预算中较小的值，
+    较短上下文的模型不会收到需要再次分块的片段.
+
+    Args:
+        stages (tuple): Stage 列表，为 None 时使用 configured_stages().
+
+    Returns:
+        tuple: (max_tokens, model).
+    """
+    services = [get_service(stage.service_cls) for stage in (stages if stages is not None else configured_stages())]
+    service = min(services, key=lambda s: context_limit(s.model))
+    budget = input_token_budget(service.model, service.template.token_count(service.model))
+    return min(SEGMENT_MAX_TOKENS, budget), service.model
+
+def memory_presets(match, origin_text):
+    """
+    根据翻译记忆的匹配结果确定可以跳过的阶段及其输出.
+
+    相似度达到 TRANSLATION_MEMORY_REUSE_THRESHOLD 时所有阶段都直接使用之前的译文 (专有名词表只列出术语表中已知的术语)；
+    否则把之前的译文作为直接翻译、把两段原文的差异作为问题列表，只运行专有名词识别和意译.
+    合并模式中的 review 阶段同样跳过 (输出为空)，意译按翻译记忆给出的问题列表单独调用.
+
+    Returns:
+        dict: 阶段名称 -> 输出.
+    """
+    from backend.services.translation_memory import reference_note, REUSE_NOTE
+    if match.similarity >= TRANSLATION_MEMORY_REUSE_THRESHOLD:
+        glossary = get_glossary()
+        return {
+            "proper_nouns": format_term_table(glossary.lookup(origin_text)) if glossary is not None else "",
+            "straight_up": match.translation,
+            "issue_spotting": REUSE_NOTE,
+            REVIEW_STAGE: "",
+            FINAL_STAGE: match.translation,
+        }
+    return {"straight_up": match.translation, "issue_spotting": reference_note(match, origin_text), REVIEW_STAGE: ""}
+
+class SegmentResult:
+    """一个文本片段在流水线中的执行结果."""
+    def __init__(self, index, origin_text):
+        self.index = index
+        self.origin_text = origin_text
+        self.outputs = {} # 阶段名称 -> 输出文本
+        self.durations = {} # 阶段名称 -> 耗时 (秒)
+        self.keys = {} # 阶段名称 -> 输入指纹 (见 incremental.stage_key)
+        self.reused = {} # 阶段名称 -> "memo" (复用之前的输出)、"override" (使用用户修改后的输出)、"tm" (来自翻译记忆)
+                         # 或 "derived" (由上游输出直接得到，见 Stage.shortcut)
+        self.error = None # 执行失败时的异常
+
+    @property
+    def ok(self):
+        return self.error is None
+
+class _RunState:
+    """一次 run 调用的内部状态 (每个片段的剩余依赖数和结果)."""
+    def __init__(self, segments, stages, overrides):
+        self.overrides = overrides
+        self.results = [SegmentResult(i, text) for i, text in enumerate(segments)]
+        self.presets = [None for _ in segments] # 翻译记忆给出的阶段输出 (见 memory_presets)
+        self.remaining_deps = [{stage.name: len(stage.dependencies) for stage in stages} for _ in segments]
+        self.remaining_stages = [len(stages) for _ in segments]
+        self.reported = [False for _ in segments]
+        self.lock = threading.Lock()
+        self.completed = queue.Queue()
+
+    def report(self, result):
+        """把片段结果交给 run_iter (每个片段只交付一次)."""
+        with self.lock:
+            if self.reported[result.index]:
+                return
+            self.reported[result.index] = True
+        self.completed.put(result)
+
+    def fail(self, result, error):
+        """把片段标记为失败并交付 (已交付或已有错误的片段不变)."""
+        with self.lock:
+            if result.error is None:
+                result.error = error
+        self.report(result)
+
+    def cancel(self, error):
+        """把所有尚未交付的片段标记为失败并交付，run_iter 不再等待正在执行或被取消的阶段."""
+        for result in self.results:
+            self.fail(result, error)
+
+class TranslationPipeline:
+    """
+    按 DAG 执行翻译阶段的流水线.
+
+    每个片段独立地沿着阶段依赖关系推进，一个阶段完成后立即调度依赖它的阶段，
+    因此片段 N+1 可以在片段 N 进行意译时做专有名词识别，总耗时接近关键路径而不是所有调用耗时之和.
+    每个阶段有独立的线程池，线程池大小即该阶段的并发上限.
+
+    每个阶段执行前按输入 (原文、上游输出、模型和 Prompt 模板) 计算指纹，指纹之前出现过时直接复用记录的输出，
+    因此修改原文中的一句话或某个中间结果后重新运行，只有受影响的片段和下游阶段会调用 LLM.
+
+    启用翻译记忆时，每个片段开始前先查找之前翻译过的相似段落：原文相同时直接复用之前的最终译文，
+    相似时把之前的译文交给意译步骤按原文差异修改，跳过直接翻译和问题识别.
+
+    开启 PIPELINE_FUSED_REVIEW 时问题识别和意译合并为一次调用 (见 FUSED_STAGES)；问题列表为空时意译步骤不调用 LLM.
+    """
+    def __init__(self, stages=None, concurrency=None, memo=None, translation_memory=None):
+        """
+        构造函数.
+
+        Args:
+            stages (tuple): Stage 列表，为 None 时按 PIPELINE_FUSED_REVIEW 使用 DEFAULT_STAGES 或 FUSED_STAGES.
+            concurrency (dict): 阶段名称 -> 并发上限，未指定的阶段使用 PIPELINE_STAGE_CONCURRENCY 中的配置.
+            memo (StageMemo): 阶段输出记录，为 None 时使用进程级共享的记录 (PIPELINE_MEMO_ENABLED 关闭时不复用).
+            translation_memory (TranslationMemory): 翻译记忆，为 None 时使用进程级共享的翻译记忆
+                (TRANSLATION_MEMORY_ENABLED 关闭或阶段中没有 FINAL_STAGE 时不使用).
+        """
+        self.stages = tuple(stages if stages is not None else configured_stages())
+        self.memo = memo if memo is not None else get_stage_memo()
+        self._stage_by_name = {stage.name: stage for stage in self.stages}
+        if translation_memory is None and TRANSLATION_MEMORY_ENABLED:
+            from backend.services.translation_memory import get_translation_memory # 依赖 numpy，只在启用翻译记忆时导入
+            translation_memory = get_translation_memory()
+        self.translation_memory = translation_memory
+        if FINAL_STAGE not in self._stage_by_name:
+            self.translation_memory = None
+        self._validate()
+        self._dependents = {stage.name: [s for s in self.stages if stage.name in s.dependencies] for stage in self.stages}
+        limits = dict(PIPELINE_STAGE_CONCURRENCY)
+        limits.update(concurrency or {})
+        self._executors = {
+            stage.name: ThreadPoolExecutor(max_workers=max(1, limits.get(stage.name, 4)), thread_name_prefix=f"pipeline-{stage.name}")
+            for stage in self.stages
+        }
+        self._runs = set() # 正在进行的 run_iter 的 _RunState，shutdown 时取消
+        self._runs_lock = threading.Lock()
+        self._closed = False
+
+    def _validate(self):
+        """检查依赖是否存在且无环."""
+        visiting, done = set(), set()
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline stages contain a dependency cycle at '{name}'")
+            if name not in self._stage_by_name:
+                raise ValueError(f"Unknown pipeline stage dependency: '{name}'")
+            visiting.add(name)
+            for dep in self._stage_by_name[name].dependencies:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+        for stage in self.stages:
+            visit(stage.name)
+
+    def _submit(self, state, index, stage):
+        try:
+            self._executors[stage.name].submit(self._execute, state, index, stage)
+        except RuntimeError as e: # 线程池已关闭
+            state.fail(state.results[index], PipelineCancelledError(f"Pipeline is shut down, stage '{stage.name}' was not run: {e}"))
+
+    def _reuse(self, state, index, stage, key, origin_text):
+        """
+        查找可以直接使用的阶段输出：用户修改后的输出优先，其次是之前记录的输出，最后是翻译记忆给出的输出.
+
+        翻译记忆跳过的阶段已经有修改后的或之前记录的输出时，该片段不再使用翻译记忆，
+        以免下游阶段混用两种来源的结果.
+
+        Returns:
+            tuple: (输出, "override" / "memo" / "tm")，没有可用的输出时为 (None, None).
+        """
+        output, reused = state.overrides.get(key), "override"
+        if output is None and self.memo is not None:
+            output, reused = self.memo.get(key, stage.validator(origin_text) if stage.validator else None), "memo"
+        presets = state.presets[index]
+        if output is not None:
+            if presets and stage.name in presets:
+                with state.lock:
+                    state.presets[index] = None
+            return output, reused
+        if presets and stage.name in presets:
+            return presets[stage.name], "tm"
+        return None, None
+
+    def memory_context(self, source):
+        """
+        翻译记忆条目的上下文：各阶段的模型和 Prompt 模板指纹，以及术语表中该原文出现的已知术语及译法.
+
+        修改 Prompt、模型路由或术语译法后上下文随之变化，之前的译文不再被复用或参考.
+        """
+        stages = []
+        for stage in self.stages:
+            service = get_service(stage.service_cls)
+            stages.append([stage.name, service.model, service.template.digest])
+        glossary = get_glossary()
+        terms = glossary.lookup(source) if glossary is not None else []
+        payload = json.dumps([stages, terms], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, result):
+        """把片段的最终译文写入翻译记忆 (来自翻译记忆的除外)."""
+        if self.translation_memory is None or result.reused.get(FINAL_STAGE) == "tm":
+            return
+        try:
+            self.translation_memory.add(result.origin_text, result.outputs[FINAL_STAGE], self.memory_context(result.origin_text))
+        except Exception as e:
+            logger.warning("Error saving segment %s to translation memory: %s", result.index, e)
+
+    def _execute(self, state, index, stage):
+        """执行某个片段的某个阶段，完成后调度下游阶段."""
+        result = state.results[index]
+        if result.error is not None:
+            return
+        start = time.perf_counter()
+        try:
+            service = get_service(stage.service_cls)
+            args = stage.build_args(result.origin_text, result.outputs)
+            key = stage_key(stage.name, service.model, service.template.digest, args)
+            output, reused = self._reuse(state, index, stage, key, result.origin_text)
+            if output is None and stage.shortcut is not None:
+                output = stage.shortcut(result.origin_text, result.outputs)
+                reused = "derived" if output is not None else None
+            if output is None:
+                output = service.run_prompt(*args)
+            if reused in (None, "tm", "derived") and self.memo is not None: # 翻译记忆给出的输出也记录下来，重新运行时结果不变
+                self.memo.set(key, output, stage.validator(result.origin_text) if stage.validator else None)
+        except Exception as e:
+            logger.error("Pipeline stage '%s' failed for segment %s: %s", stage.name, index, e, exc_info=True)
+            metrics.record_stage(stage.name, time.perf_counter() - start, error=e, segment=index)
+            state.fail(result, e)
+            return
+        elapsed = time.perf_counter() - start
+        if reused:
+            logger.debug("Pipeline stage '%s' reused %s output for segment %s", stage.name, reused, index)
+        else:
+            logger.info("Pipeline stage '%s' finished for segment %s in %.2fs", stage.name, index, elapsed)
+        metrics.record_stage(stage.name, elapsed, segment=index, reused=reused)
+
+        try: # 调度下游阶段失败时同样交付该片段，run_iter 不会一直等待
+            ready = []
+            with state.lock:
+                result.outputs[stage.name] = output
+                result.durations[stage.name] = elapsed
+                result.keys[stage.name] = key
+                if reused:
+                    result.reused[stage.name] = reused
+                state.remaining_stages[index] -= 1
+                finished = state.remaining_stages[index] == 0
+                for dependent in self._dependents[stage.name]:
+                    state.remaining_deps[index][dependent.name] -= 1
+                    if state.remaining_deps[index][dependent.name] == 0:
+                        ready.append(dependent)
+            for dependent in ready:
+                self._submit(state, index, dependent)
+            if finished:
+                self._remember(result)
+                state.report(result)
+        except Exception as e:
+            logger.error("Pipeline failed to schedule after stage '%s' for segment %s: %s", stage.name, index, e, exc_info=True)
+            state.fail(result, e)
+
+    def _lookup_memory(self, index, origin_text):
+        """在翻译记忆中查找相似的段落，返回可以跳过的阶段及其输出."""
+        if self.translation_memory is None:
+            return None
+        try:
+            match = self.translation_memory.lookup(origin_text, TRANSLATION_MEMORY_REFERENCE_THRESHOLD, self.memory_context)
+        except Exception as e:
+            logger.warning("Translation memory lookup failed for segment %s: %s", index, e)
+            return None
+        if match is None:
+            return None
+        logger.info("Translation memory match for segment %s (similarity %.2f)", index, match.similarity)
+        return memory_presets(match, origin_text)
+
+    def run_iter(self, segments, overrides=None):
+        """
+        运行流水线，每个片段完成 (或失败) 后立即返回它的结果.
+
+        Args:
+            segments (list[str]): 待翻译的文本片段.
+            overrides (dict): 阶段输入指纹 -> 输出，输入指纹匹配的阶段直接使用给定的输出 (用户修改过的中间结果).
+
+        Yields:
+            SegmentResult: 按完成顺序返回的片段结果.
+        """
+        segments = list(segments)
+        if not segments:
+            return
+        state = self.start_run(segments, overrides)
+        logger.info("Pipeline started: %s segments, %s stages", len(segments), len(self.stages))
+        start = time.perf_counter()
+        try:
+            for index in range(len(segments)):
+                for stage in self.stages:
+                    if not stage.dependencies:
+                        self._submit(state, index, stage)
+            reused = computed = 0
+            for _ in range(len(segments)):
+                result = state.completed.get() # shutdown 会交付所有未完成的片段，这里不会一直阻塞
+                reused += len(result.reused)
+                computed += len(result.outputs) - len(result.reused)
+                yield result
+        finally:
+            self.finish_run(state)
+        logger.info("Pipeline finished: %s segments in %.2fs (%s stage runs computed, %s reused)", len(segments), time.perf_counter() - start, computed, reused)
+
+    def start_run(self, segments, overrides=None):
+        """
+        创建一次运行的状态并查找各片段的翻译记忆. 运行结束后需要调用 finish_run.
+
+        Args:
+            segments (list[str]): 待翻译的文本片段.
+            overrides (dict): 见 run_iter.
+
+        Returns:
+            _RunState: 运行状态，shutdown 时其中未交付的片段以 PipelineCancelledError 交付.
+        """
+        state = _RunState(segments, self.stages, overrides or {})
+        for index, text in enumerate(segments):
+            state.presets[index] = self._lookup_memory(index, text)
+        with self._runs_lock:
+            self._runs.add(state)
+            closed = self._closed
+        if closed:
+            state.cancel(PipelineCancelledError("Pipeline is shut down"))
+        return state
+
+    def finish_run(self, state):
+        with self._runs_lock:
+            self._runs.discard(state)
+
+    def run(self, segments, overrides=None):
+        """
+        运行流水线并等待全部片段完成.
+
+        Returns:
+            list[SegmentResult]: 按片段原始顺序排列的结果.
+        """
+        results = list(self.run_iter(segments, overrides))
+        return sorted(results, key=lambda r: r.index)
+
+    def shutdown(self):
+        """关闭各阶段的线程池，尚未开始的阶段不再执行，正在进行的运行中未完成的片段以 PipelineCancelledError 交付."""
+        with self._runs_lock:
+            self._closed = True
+            runs = list(self._runs)
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        for state in runs:
+            state.cancel(PipelineCancelledError("Pipeline was shut down before the segment finished"))
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    """获取进程级共享的流水线，阶段并发上限对所有会话生效."""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = TranslationPipeline()
+    return _pipeline
@@ -0,0 +1,192 @@
+# backend/services/prompt_templates.py
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+from backend.config import PROMPT_FILES, PROMPT_RELOAD_INTERVAL
+from backend.services.token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}") # {{variable}}
+
+class CompiledTemplate:
+    """
+    预先解析过的 Prompt 模板.
+
+    模板在编译时被切分为交替的静态文本和变量名，渲染时一次拼接完成，
+    不再对整个模板反复执行 str.replace (每次都要扫描并复制模板和已插入的文本).
+    """
+    def __init__(self, source, name=""):
+        """
+        构造函数.
+
+        Args:
+            source (str): 模板原文，变量写作 {{name}}.
+            name (str): 模板名称，用于日志.
+        """
+        self.source = source
+        self.name = name
+        self._literals = [] # 长度比 _fields 多 1：literal0 field0 literal1 field1 ... literalN
+        self._fields = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(source):
+            self._literals.append(source[position:match.start()])
+            self._fields.append((match.group(1), match.group(0)))
+            position = match.end()
+        self._literals.append(source[position:])
+        self._token_counts = {} # 模型 -> 模板静态部分的 token 数
+        self._digest = None
+
+    @property
+    def variables(self):
+        """模板中出现的变量名 (按首次出现的顺序)."""
+        return tuple(dict.fromkeys(name for name, _ in self._fields))
+
+    @property
+    def static_prefix(self):
+        """第一个变量之前的静态文本，对相同模板的所有请求都相同，可以命中服务端的 Prompt 前缀缓存."""
+        return self._literals[0]
+
+    @property
+    def digest(self):
+        """模板原文的 sha256 摘要，模板修改后流水线中记录的阶段输出随之失效."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.source.encode("utf-8")).hexdigest()
+        return self._digest
+
+    def render(self, **values):
+        """
+        一次拼接渲染模板.
+
+        未传入的变量保留原始的 {{name}} 文本 (与逐个 str.replace 的行为一致).
+
+        Returns:
+            str: 渲染后的 Prompt.
+        """
+        parts = [self._literals[0]]
+        for (name, raw), literal in zip(self._fields, self._literals[1:]):
+            value = values.get(name)
+            parts.append(raw if value is None else value)
+            parts.append(literal)
+        return "".join(parts)
+
+    def token_count(self, model=None):
+        """模板静态部分 (不含变量) 的 token 数，按模型缓存."""
+        count = self._token_counts.get(model)
+        if count is None:
+            count = self._token_counts[model] = count_tokens("".join(self._literals), model)
+        return count
+
+class _Entry:
+    """注册表中一个模板文件的状态."""
+    def __init__(self, path):
+        self.path = path
+        self.template = CompiledTemplate("", os.path.basename(path))
+        self.mtime = None
+        self.checked_at = 0.0
+
+class PromptTemplateRegistry:
+    """
+    Prompt 模板注册表.
+
+    每个模板文件只在首次使用或文件修改后解析一次；获取模板时按 mtime 检查文件是否变化 (每个文件至多每
+    reload_interval 秒 stat 一次)，因此在 Prompt 编辑器中保存或直接编辑文件后，下一次调用即可使用新模板，无需重启.
+    """
+    def __init__(self, files, reload_interval=1.0):
+        """
+        构造函数.
+
+        Args:
+            files (dict): 模板名称 -> 文件路径.
+            reload_interval (float): 检查文件 mtime 的最小间隔 (秒)，0 表示每次获取都检查.
+        """
+        self.reload_interval = reload_interval
+        self._entries = {name: _Entry(path) for name, path in files.items()}
+        self._lock = threading.Lock()
+
+    def names(self):
+        """所有模板名称."""
+        return list(self._entries)
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f"Unknown prompt template: '{name}'")
+        return entry
+
+    def _reload_if_changed(self, name, entry):
+        """文件 mtime 变化时重新读取并编译模板 (调用方需要持有锁)."""
+        try:
+            mtime = os.stat(entry.path).st_mtime_ns
+        except OSError as e:
+            if entry.mtime is None:
+                logger.error("Prompt file not found: %s (%s)", entry.path, e)
+                entry.mtime = -1
+            return
+        if mtime == entry.mtime:
+            return
+        try:
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                source = f.read()
+        except OSError as e:
+            logger.error("Error reading prompt file: %s, error: %s", entry.path, e)
+            return
+        reloaded = entry.mtime is not None
+        entry.template = CompiledTemplate(source, name)
+        entry.mtime = mtime
+        static_tokens = entry.template.token_count()
+        prefix_tokens = count_tokens(entry.template.static_prefix)
+        logger.info("Prompt template '%s' %s: variables %s, static prefix %s/%s tokens", name, 'reloaded' if reloaded else 'loaded', entry.template.variables, prefix_tokens, static_tokens)
+
+    def get(self, name):
+        """
+        获取编译好的模板，文件变化时自动重新加载.
+
+        Args:
+            name (str): 模板名称.
+
+        Returns:
+            CompiledTemplate: 编译好的模板.
+        """
+        entry = self._entry(name)
+        now = time.monotonic()
+        if entry.mtime is not None and now - entry.checked_at < self.reload_interval:
+            return entry.template
+        with self._lock:
+            self._reload_if_changed(name, entry)
+            entry.checked_at = now
+            return entry.template
+
+    def source(self, name):
+        """模板原文 (Prompt 编辑器显示用)."""
+        return self.get(name).source
+
+    def save(self, name, source):
+        """
+        写入模板文件并立即生效.
+
+        先写临时文件再替换，避免并发读取到写了一半的文件.
+
+        Args:
+            name (str): 模板名称.
+            source (str): 新的模板内容.
+        """
+        entry = self._entry(name)
+        with self._lock:
+            tmp_path = entry.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(source)
+            os.replace(tmp_path, entry.path)
+            entry.mtime = 0 # 强制重新加载
+            self._reload_if_changed(name, entry)
+            entry.checked_at = time.monotonic()
+
+prompt_templates = PromptTemplateRegistry(PROMPT_FILES, PROMPT_RELOAD_INTERVAL)
+
+def get_template(name):
+    """获取进程级注册表中的模板 (见 PromptTemplateRegistry.get)."""
+    return prompt_templates.get(name)
@@ -0,0 +1,309 @@
+# backend/services/rate_limiter.py
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+
+from backend.config import MODEL_RATE_LIMITS, DEFAULT_RPM, DEFAULT_TPM, RETRY_MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from backend.services.errors import UpstreamError, RateLimitedError, UpstreamTimeoutError
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    令牌桶.
+
+    采用预约方式：取令牌时直接扣减 (允许为负)，返回需要等待的秒数，
+    因此并发的请求按到达顺序排队，不会因为轮询抢占而饿死.
+    """
+    def __init__(self, per_minute):
+        """
+        构造函数.
+
+        Args:
+            per_minute (float): 每分钟补充的令牌数 (同时也是桶的容量)，<=0 表示不限制.
+        """
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount, now):
+        """
+        预约 amount 个令牌 (调用方需要持有锁).
+
+        Returns:
+            float: 需要等待的秒数，0 表示立即可用.
+        """
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        self._tokens -= min(amount, self.capacity) # 超过容量的单次请求按容量计算，避免永远无法满足
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self, amount, now):
+        """归还多预约的令牌 (如实际 token 用量小于预估)."""
+        if self.unlimited:
+            return
+        self._refill(now)
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+class RateLimiter:
+    """单个模型的客户端限流器，同时限制每分钟请求数 (RPM) 和每分钟 token 数 (TPM)."""
+    def __init__(self, model, rpm, tpm):
+        self.model = model
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._blocked_until = 0.0 # 上游返回 Retry-After 时，所有请求暂停到该时间
+        self._lock = threading.Lock()
+        self._stats = {"waiting": 0, "max_waiting": 0, "acquired": 0, "throttled": 0, "retries": 0, "wait_seconds": 0.0}
+
+    def _reserve(self, tokens):
+        """预约一次请求的额度，返回需要等待的秒数."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._requests.reserve(1, now), self._tokens.reserve(tokens, now), self._blocked_until - now, 0.0)
+            self._stats["acquired"] += 1
+            if wait > 0:
+                self._stats["waiting"] += 1
+                self._stats["max_waiting"] = max(self._stats["max_waiting"], self._stats["waiting"])
+        if wait > 0:
+            logger.info("Rate limiter for %s: waiting %.2fs before sending request", self.model, wait)
+        return wait
+
+    def _waited(self, wait):
+        with self._lock:
+            self._stats["waiting"] -= 1
+            self._stats["wait_seconds"] += wait
+
+    def acquire(self, tokens):
+        """
+        阻塞直到允许发送一个预计消耗 tokens 个 token 的请求.
+
+        Args:
+            tokens (int): 预计的 token 用量 (prompt + max_tokens).
+
+        Returns:
+            float: 实际等待的秒数.
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+            self._waited(wait)
+        return wait
+
+    async def acquire_async(self, tokens):
+        """acquire 的异步版本：排队期间让出事件循环，不占用线程."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._waited(wait)
+        return wait
+
+    def refund(self, tokens):
+        """请求完成后归还多预估的 token."""
+        if tokens > 0:
+            with self._lock:
+                self._tokens.refund(tokens, time.monotonic())
+
+    def block_for(self, seconds):
+        """上游要求退避时 (429 + Retry-After)，暂停该模型的所有请求."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._stats["throttled"] += 1
+
+    def record_retry(self):
+        with self._lock:
+            self._stats["retries"] += 1
+
+    def stats(self):
+        """
+        返回限流统计.
+
+        Returns:
+            dict: waiting (当前排队数) / max_waiting / acquired / throttled (收到 429 次数) / retries / wait_seconds.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(model):
+    """获取模型对应的共享限流器，限额来自 MODEL_RATE_LIMITS，未配置时使用 DEFAULT_RPM / DEFAULT_TPM."""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(model)
+            if limiter is None:
+                rpm, tpm = MODEL_RATE_LIMITS.get(model, (DEFAULT_RPM, DEFAULT_TPM))
+                limiter = RateLimiter(model, rpm, tpm)
+                _limiters[model] = limiter
+    return limiter
+
+def rate_limiter_stats():
+    """返回所有模型的限流统计，key 为模型名."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {model: limiter.stats() for model, limiter in limiters.items()}
+
+def retry_after_seconds(error):
+    """
+    从上游错误的响应头中读取 Retry-After (支持 retry-after-ms、秒数和 HTTP 日期格式).
+
+    Returns:
+        float | None: 建议等待的秒数，响应头中没有时返回 None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error):
+    """判断上游错误是否为可重试的临时故障 (超时、连接失败、429、5xx)."""
+    import openai # 延迟导入，见 registry
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    计算第 attempt 次重试前的等待时间：带完全抖动的指数退避，且不少于上游给出的 Retry-After.
+
+    Args:
+        attempt (int): 重试序号，从 0 开始.
+        retry_after (float): 上游给出的 Retry-After 秒数.
+
+    Returns:
+        float: 等待秒数.
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+    return delay
+
+def to_upstream_error(error, attempts):
+    """把 openai 异常转换为对应的 UpstreamError 子类."""
+    import openai
+    status_code = getattr(error, "status_code", None)
+    message = f"OpenAI API call failed after {attempts} attempt(s): {error}"
+    if status_code == 429:
+        return RateLimitedError(message, status_code, attempts)
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return UpstreamTimeoutError(message, status_code, attempts)
+    return UpstreamError(message, status_code, attempts)
+
+def _retry_delay(error, attempt, max_retries, limiter, description):
+    """
+    判断一次失败的请求是否重试.
+
+    Returns:
+        float: 重试前需要等待的秒数.
+
+    Raises:
+        UpstreamError: 不可重试的错误或重试次数用尽.
+    """
+    if not is_retryable(error) or attempt >= max_retries:
+        raise to_upstream_error(error, attempt + 1) from error
+    retry_after = retry_after_seconds(error)
+    if getattr(error, "status_code", None) == 429:
+        limiter.block_for(retry_after if retry_after is not None else backoff_delay(attempt))
+    delay = backoff_delay(attempt, retry_after)
+    limiter.record_retry()
+    logger.warning("%s transient OpenAI API error (%s), retry %s/%s in %.2fs", description, error.__class__.__name__, attempt + 1, max_retries, delay)
+    return delay
+
+def call_with_retry(request, limiter, estimated_tokens, description="", max_retries=None, call_info=None):
+    """
+    经过限流器发送请求，临时故障时按指数退避重试.
+
+    Args:
+        request (callable): 无参函数，发送一次请求并返回结果.
+        limiter (RateLimiter): 该模型的限流器.
+        estimated_tokens (int): 预计的 token 用量.
+        description (str): 日志中用于标识调用方.
+        max_retries (int): 最大重试次数，默认使用 RETRY_MAX_RETRIES.
+        call_info (dict): 如果传入，写入 retries (重试次数) 和 rate_limit_wait (限流排队秒数)，供指标统计使用.
+
+    Returns:
+        request() 的返回值.
+
+    Raises:
+        UpstreamError: 不可重试的错误或重试次数用尽.
+    """
+    import openai
+    max_retries = RETRY_MAX_RETRIES if max_retries is None else max_retries
+    call_info = {} if call_info is None else call_info
+    call_info.setdefault("rate_limit_wait", 0.0)
+    attempt = 0
+    while True:
+        call_info["retries"] = attempt
+        call_info["rate_limit_wait"] += limiter.acquire(estimated_tokens)
+        try:
+            return request()
+        except openai.OpenAIError as e:
+            delay = _retry_delay(e, attempt, max_retries, limiter, description)
+        time.sleep(delay)
+        attempt += 1
+
+async def call_with_retry_async(request, limiter, estimated_tokens, description="", max_retries=None, call_info=None):
+    """
+    call_with_retry 的异步版本，限流排队和退避等待期间让出事件循环.
+
+    Args:
+        request (callable): 无参函数，返回发送一次请求的 awaitable.
+        其余参数与 call_with_retry 相同.
+
+    Returns:
+        await request() 的结果.
+
+    Raises:
+        UpstreamError: 不可重试的错误或重试次数用尽.
+    """
+    import openai
+    max_retries = RETRY_MAX_RETRIES if max_retries is None else max_retries
+    call_info = {} if call_info is None else call_info
+    call_info.setdefault("rate_limit_wait", 0.0)
+    attempt = 0
+    while True:
+        call_info["retries"] = attempt
+        call_info["rate_limit_wait"] += await limiter.acquire_async(estimated_tokens)
+        try:
+            return await request()
+        except openai.OpenAIError as e:
+            delay = _retry_delay(e, attempt, max_retries, limiter, description)
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,177 @@
+# backend/services/registry.py
+import asyncio
+import atexit
+import logging
+import threading
+
+from backend.config import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY
+from backend.config import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT, HTTP_POOL_TIMEOUT, OPENAI_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+# openai SDK (及其依赖的 pydantic、httpx) 的导入耗时约 0.4s，在首次创建客户端时才导入，
+# 只使用部分模块 (如命令行工具的 --help、只读取配置的 worker) 时不需要付出这部分启动时间
+
+def _httpx():
+    """新版 openai SDK 基于 httpx2，旧版基于 httpx."""
+    try:
+        import httpx2 as httpx
+    except ImportError:
+        import httpx
+    return httpx
+
+def _http_options():
+    """同步和异步 httpx 客户端共用的连接池和超时配置."""
+    httpx = _httpx()
+    return {
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        "timeout": httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+            write=HTTP_WRITE_TIMEOUT,
+            pool=HTTP_POOL_TIMEOUT
+        ),
+        "follow_redirects": True,
+    }
+
+class ServiceRegistry:
+    """进程级的服务注册表，持有共享的 OpenAI 客户端 (同步和异步连接池) 和 Service 实例."""
+    def __init__(self):
+        self._clients = {} # (api_base, api_key) -> openai.OpenAI
+        self._async_clients = {} # (api_base, api_key, 事件循环) -> openai.AsyncOpenAI
+        self._services = {} # Service 类 -> Service 实例
+        self._lock = threading.RLock() # 保证多线程 (Gradio worker) 下只创建一次
+
+    def get_client(self, api_base=None, api_key=None):
+        """
+        获取指定 API Base 对应的共享 OpenAI 客户端，首次调用时创建.
+
+        Args:
+            api_base (str): API Base URL，为空时使用 OpenAI 官方地址.
+            api_key (str): API Key.
+
+        Returns:
+            openai.OpenAI: 复用 keep-alive 连接池的客户端.
+        """
+        base_url = api_base or DEFAULT_API_BASE
+        key = (base_url, api_key)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                logger.info("Creating shared OpenAI client for %s (max_connections=%s, keepalive=%s)", base_url, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS)
+                import openai
+                http_client = _httpx().Client(**_http_options())
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=http_client,
+                    max_retries=OPENAI_MAX_RETRIES
+                )
+                self._clients[key] = client
+            return client
+
+    def get_async_client(self, api_base=None, api_key=None):
+        """
+        获取指定 API Base 对应的共享异步 OpenAI 客户端，首次调用时创建.
+
+        httpx.AsyncClient 的连接绑定在创建它的事件循环上，因此每个事件循环各有一个客户端 (Gradio 只有一个事件循环).
+        必须在事件循环中调用.
+
+        Args:
+            api_base (str): API Base URL，为空时使用 OpenAI 官方地址.
+            api_key (str): API Key.
+
+        Returns:
+            openai.AsyncOpenAI: 复用 keep-alive 连接池的异步客户端，连接池配置与同步客户端相同.
+        """
+        base_url = api_base or DEFAULT_API_BASE
+        loop = asyncio.get_running_loop()
+        key = (base_url, api_key, loop)
+        client = self._async_clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is None:
+                logger.info("Creating shared async OpenAI client for %s (max_connections=%s, keepalive=%s)", base_url, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS)
+                for stale in [k for k in self._async_clients if k[2].is_closed()]: # asyncio.run 等场景下事件循环结束后丢弃其客户端
+                    del self._async_clients[stale]
+                import openai
+                client = openai.AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=_httpx().AsyncClient(**_http_options()),
+                    max_retries=OPENAI_MAX_RETRIES
+                )
+                self._async_clients[key] = client
+            return client
+
+    def get_service(self, service_cls):
+        """
+        获取 Service 的共享实例，首次调用时创建.
+
+        Service 实例本身不保存请求相关的状态，可以在多个会话和线程之间安全复用.
+
+        Args:
+            service_cls (type): BaseTranslationService 的子类.
+
+        Returns:
+            BaseTranslationService: 该类的共享实例.
+        """
+        service = self._services.get(service_cls)
+        if service is not None:
+            return service
+        with self._lock:
+            service = self._services.get(service_cls)
+            if service is None:
+                service = service_cls()
+                self._services[service_cls] = service
+            return service
+
+    def reset_services(self):
+        """丢弃已缓存的 Service 实例 (客户端连接池保留)，下次获取时重新创建."""
+        with self._lock:
+            self._services.clear()
+
+    def close(self):
+        """关闭所有客户端，释放连接池中的连接."""
+        with self._lock:
+            for client in self._clients.values():
+                try:
+                    client.close()
+                except Exception as e:
+                    logger.warning("Error closing OpenAI client: %s", e)
+            self._clients.clear()
+            # 异步客户端只能在其事件循环中关闭，进程退出时事件循环通常已经结束，连接随进程一起释放
+            self._async_clients.clear()
+            self._services.clear()
+
+# 进程级单例
+registry = ServiceRegistry()
+atexit.register(registry.close)
+
+def preload():
+    """提前导入 openai SDK，交互式应用在启动时调用，第一次请求不需要等待导入."""
+    import openai
+    _httpx()
+
+def get_client(api_base=None, api_key=None):
+    """获取共享 OpenAI 客户端 (见 ServiceRegistry.get_client)."""
+    return registry.get_client(api_base, api_key)
+
+def get_async_client(api_base=None, api_key=None):
+    """获取共享异步 OpenAI 客户端 (见 ServiceRegistry.get_async_client)."""
+    return registry.get_async_client(api_base, api_key)
+
+def get_service(service_cls):
+    """获取共享 Service 实例 (见 ServiceRegistry.get_service)."""
+    return registry.get_service(service_cls)
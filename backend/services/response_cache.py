@@ -0,0 +1,364 @@
+# backend/services/response_cache.py
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from backend.config import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MEMORY_ITEMS, RESPONSE_CACHE_DB_PATH
+from backend.config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_DISK_MB
+
+logger = logging.getLogger(__name__)
+
+class _InFlight:
+    """正在进行中的上游请求，相同 key 的并发请求等待它的结果 (singleflight)."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class ResponseCache:
+    """
+    LLM 响应缓存，按 (模型, 参数, Prompt) 的哈希寻址.
+
+    两级存储：
+        - 内存 LRU：容量有限，命中时无 IO.
+        - SQLite 磁盘：跨进程重启持久化，按 TTL 过期并在超过容量上限时淘汰最久未访问的条目.
+    并发的相同请求只会触发一次上游调用，其余请求共享结果.
+    """
+    _EVICT_EVERY = 64 # 每写入多少次检查一次磁盘容量
+    _TOUCH_INTERVAL = 3600 # 磁盘命中时 accessed_at 早于该秒数之前才更新 (只用于容量淘汰，不需要精确)
+    _TOUCH_BATCH = 256 # 积累多少条待更新的 accessed_at 后合并为一次写事务
+
+    def __init__(self, memory_items=512, db_path=None, ttl=7 * 24 * 3600, max_disk_bytes=256 * 1024 * 1024):
+        """
+        构造函数.
+
+        Args:
+            memory_items (int): 内存 LRU 的最大条目数，0 表示禁用内存层.
+            db_path (str): SQLite 文件路径，为空表示禁用磁盘层.
+            ttl (float): 条目存活时间 (秒)，<=0 表示永不过期.
+            max_disk_bytes (int): 磁盘层缓存内容的最大总字节数.
+        """
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict() # key -> (value, created_at)
+        self._memory_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._inflight_async = {} # (事件循环, key) -> asyncio.Future，事件循环中的 singleflight
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "evictions": 0}
+        self._stats_lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._pending_touches = {} # key -> 访问时间，磁盘命中时不立即写入，随下一次写事务批量更新
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+                self._db.commit()
+                logger.info("Response cache disk tier opened at %s", db_path)
+            except Exception as e:
+                logger.error("Error opening response cache database %s: %s", db_path, e, exc_info=True)
+                self._db = None
+
+    @staticmethod
+    def make_key(model, params, prompt, api_base=None):
+        """
+        计算缓存 key.
+
+        Args:
+            model (str): 模型名.
+            params (dict): 影响输出的调用参数 (如 temperature, max_tokens).
+            prompt (str): 构建好的完整 Prompt.
+            api_base (str): 请求发往的 API Base (同名模型在不同服务商处的输出可能不同).
+
+        Returns:
+            str: sha256 十六进制摘要.
+        """
+        payload = json.dumps({"model": model, "api_base": api_base, "params": params or {}, "prompt": prompt}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    def _expired(self, created_at, now):
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key):
+        """
+        查询缓存，先查内存再查磁盘，磁盘命中会回填内存.
+
+        Returns:
+            str | None: 缓存的响应文本，未命中返回 None.
+        """
+        return self._get(key)
+
+    def _get(self, key, count_miss=True):
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._expired(entry[1], now):
+                    del self._memory[key]
+                else:
+                    self._memory.move_to_end(key)
+                    self._count("memory_hits")
+                    return entry[0]
+
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute("SELECT value, created_at, accessed_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self._expired(row[1], now):
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                    row = None
+                elif row is not None and now - row[2] > self._TOUCH_INTERVAL:
+                    self._pending_touches[key] = now
+                    if len(self._pending_touches) >= self._TOUCH_BATCH:
+                        self._flush_touches()
+                        self._db.commit()
+            if row is not None:
+                self._put_memory(key, row[0], row[1])
+                self._count("disk_hits")
+                return row[0]
+
+        if count_miss:
+            self._count("misses")
+        return None
+
+    def _put_memory(self, key, value, created_at):
+        if self.memory_items <= 0:
+            return
+        with self._memory_lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _flush_touches(self):
+        """把积累的 accessed_at 更新写入当前事务 (调用方需持有 _db_lock 并负责提交)."""
+        if not self._pending_touches:
+            return
+        self._db.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                             [(accessed_at, key) for key, accessed_at in self._pending_touches.items()])
+        self._pending_touches.clear()
+
+    def set(self, key, value):
+        """写入缓存 (内存和磁盘两级)."""
+        now = time.time()
+        self._put_memory(key, value, now)
+        self._count("stores")
+        if self._db is None:
+            return
+        size = len(value.encode("utf-8"))
+        with self._db_lock:
+            self._flush_touches()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._db.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self._EVICT_EVERY:
+                self._writes_since_evict = 0
+                self._evict_disk(now)
+
+    def _evict_disk(self, now):
+        """删除过期条目，并在超出容量时按最久未访问淘汰 (调用方需持有 _db_lock)."""
+        removed = 0
+        if self.ttl > 0:
+            removed += self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while total > self.max_disk_bytes:
+            rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+                if total <= self.max_disk_bytes:
+                    break
+        self._db.commit()
+        if removed:
+            self._count("evictions", removed)
+            logger.info("Response cache evicted %s entries from disk", removed)
+
+    def get_or_compute(self, key, compute, store=None):
+        """
+        查询缓存，未命中时调用 compute() 获取结果并写入缓存.
+
+        相同 key 的并发调用只会执行一次 compute()，其他调用等待并共享结果；
+        compute() 抛出的异常会传递给所有等待者，且不会被缓存.
+
+        Args:
+            key (str): 缓存 key (见 make_key).
+            compute (callable): 无参函数，返回响应文本.
+            store (callable): store(结果) -> bool，返回 False 时结果只交给等待者，不写入缓存
+                (如由备用端点给出、与 key 对应的请求不同的结果). 为 None 时总是写入.
+
+        Returns:
+            str: 响应文本.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._inflight_lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                self._inflight[key] = flight
+
+        if not leader:
+            self._count("coalesced")
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            value = self._get(key, count_miss=False) # 上一个 leader 可能在本次未命中之后、成为 leader 之前刚刚写入
+            if value is not None:
+                flight.result = value
+                return value
+            flight.result = compute()
+            if store is None or store(flight.result):
+                self.set(key, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_compute(self, key, compute, store=None):
+        """
+        get_or_compute 的异步版本，磁盘读写在线程池中执行，等待期间不阻塞事件循环.
+
+        同一事件循环中相同 key 的并发调用只会执行一次 compute()；执行 compute() 的调用被取消时，
+        等待者中的第一个接替它重新执行.
+
+        Args:
+            key (str): 缓存 key (见 make_key).
+            compute (callable): 无参函数，返回 awaitable，其结果为响应文本.
+            store (callable): 见 get_or_compute.
+
+        Returns:
+            str: 响应文本.
+        """
+        value = await asyncio.to_thread(self.get, key)
+        if value is not None:
+            return value
+
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        flight = self._inflight_async.get(flight_key)
+        while flight is not None:
+            self._count("coalesced")
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled(): # 等待者自身被取消
+                    raise
+            flight = self._inflight_async.get(flight_key)
+
+        flight = loop.create_future()
+        self._inflight_async[flight_key] = flight
+        try:
+            result = await asyncio.to_thread(self._get, key, False) # 见 get_or_compute
+            if result is not None:
+                flight.set_result(result)
+                return result
+            result = await compute()
+            if store is None or store(result):
+                await asyncio.to_thread(self.set, key, result)
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception() # 没有等待者时不打印 "exception was never retrieved"
+            raise
+        finally:
+            self._inflight_async.pop(flight_key, None)
+
+    def stats(self):
+        """
+        返回命中统计.
+
+        Returns:
+            dict: memory_hits / disk_hits / misses / coalesced / stores / evictions 计数，以及 hit_rate 和 memory_items.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["memory_items"] = len(self._memory)
+        return stats
+
+    def clear(self):
+        """清空内存和磁盘缓存."""
+        with self._memory_lock:
+            self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._pending_touches.clear()
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def close(self):
+        """关闭磁盘数据库连接."""
+        if self._db is not None:
+            with self._db_lock:
+                self._flush_touches()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    获取进程级共享的响应缓存 (按 backend.config 中的配置创建).
+
+    Returns:
+        ResponseCache | None: 缓存实例，RESPONSE_CACHE_ENABLED 关闭时返回 None.
+    """
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    memory_items=RESPONSE_CACHE_MEMORY_ITEMS,
+                    db_path=RESPONSE_CACHE_DB_PATH,
+                    ttl=RESPONSE_CACHE_TTL,
+                    max_disk_bytes=int(RESPONSE_CACHE_MAX_DISK_MB * 1024 * 1024)
+                )
+                atexit.register(_response_cache.close) # 写入积累的 accessed_at 更新
+    return _response_cache
@@ -0,0 +1,400 @@
+# backend/services/routing.py
+import asyncio
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from backend.config import OPENAI_API_BASE, OPENAI_API_KEY, OPENAI_MODEL, MODEL_ROUTING_PATH
+from backend.config import HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_INITIAL_DELAY, HEDGE_MIN_SAMPLES, HEDGE_WINDOW, HEDGE_MAX_WORKERS
+from backend.services.errors import ConfigurationError, UpstreamError
+from backend.services.metrics import metrics
+from backend.services.rate_limiter import get_rate_limiter
+from backend.services.registry import get_client, get_async_client, DEFAULT_API_BASE
+
+logger = logging.getLogger(__name__)
+
+class LatencyWindow:
+    """最近 N 次成功调用的延迟，用于估算对冲请求的等待时间."""
+    def __init__(self, size):
+        self._samples = deque(maxlen=max(1, size))
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        """最近样本的分位数 (最近秩法)，没有样本时返回 None."""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Route:
+    """一个上游端点：模型、API Base、API Key、单次请求超时和重试次数."""
+    def __init__(self, model, api_base=None, api_key=None, timeout=None, max_retries=None):
+        """
+        构造函数.
+
+        Args:
+            model (str): 模型名.
+            api_base (str): API Base URL，为空时使用 OpenAI 官方地址.
+            api_key (str): API Key.
+            timeout (float): 单次请求超时 (秒)，为空时使用 HTTP_READ_TIMEOUT 等连接池配置.
+            max_retries (int): 临时故障的重试次数，为空时使用 RETRY_MAX_RETRIES.
+        """
+        self.model = model
+        self.api_base = api_base
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.latency = {"complete": LatencyWindow(HEDGE_WINDOW), "first_token": LatencyWindow(HEDGE_WINDOW)} # 非流式总耗时 / 流式首 token 时间
+
+    @property
+    def name(self):
+        return f"{self.model}@{self.api_base or DEFAULT_API_BASE}"
+
+    @property
+    def client(self):
+        """该端点的共享客户端 (连接池按 API Base 复用)."""
+        return get_client(self.api_base, self.api_key)
+
+    @property
+    def async_client(self):
+        """该端点在当前事件循环中的共享异步客户端."""
+        return get_async_client(self.api_base, self.api_key)
+
+    @property
+    def rate_limiter(self):
+        """该模型的共享 RPM / TPM 限流器."""
+        return get_rate_limiter(self.model)
+
+    def request_options(self):
+        """传给 chat.completions.create 的额外参数."""
+        return {"timeout": self.timeout} if self.timeout else {}
+
+class HedgePolicy:
+    """
+    对冲请求策略.
+
+    主端点在其最近调用延迟的 percentile 分位数内还没有返回时，向备用端点发送相同的请求，先返回的结果胜出.
+    样本数不足 min_samples 时等待 initial_delay.
+    """
+    def __init__(self, percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY, initial_delay=HEDGE_INITIAL_DELAY, min_samples=HEDGE_MIN_SAMPLES):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+
+    def delay(self, window):
+        """发送对冲请求前的等待时间 (秒)."""
+        if len(window) < self.min_samples:
+            return max(self.min_delay, self.initial_delay)
+        return max(self.min_delay, window.percentile(self.percentile))
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+def _executor():
+    """对冲调用使用的共享线程池，首次使用时创建."""
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+    return _hedge_executor
+
+def _discard_later(future, discard):
+    """对冲中落败的调用完成后丢弃其结果 (如关闭流式响应)."""
+    def callback(done):
+        if discard is not None and not done.cancelled() and done.exception() is None:
+            try:
+                discard(done.result())
+            except Exception as e:
+                logger.warning("Error discarding hedged result: %s", e)
+    future.add_done_callback(callback)
+
+class StageRouting:
+    """一个阶段 (Prompt 模板) 的路由：按顺序尝试的端点，以及可选的对冲策略."""
+    def __init__(self, stage, routes, hedge=None):
+        """
+        构造函数.
+
+        Args:
+            stage (str): 阶段名称 (Prompt 模板名称).
+            routes (list[Route]): 端点列表，第一个为主端点，其余依次作为备用端点.
+            hedge (HedgePolicy): 对冲策略，为 None 或只有一个端点时不发送对冲请求.
+        """
+        if not routes:
+            raise ConfigurationError(f"No route configured for stage '{stage}'")
+        self.stage = stage
+        self.routes = list(routes)
+        self.hedge = hedge if len(self.routes) > 1 else None
+
+    @property
+    def primary(self):
+        return self.routes[0]
+
+    def describe(self):
+        text = " -> ".join(route.name for route in self.routes)
+        return f"{text} (hedged)" if self.hedge is not None else text
+
+    @staticmethod
+    def _timed(attempt, route, kind):
+        start = time.perf_counter()
+        result = attempt(route)
+        route.latency[kind].observe(time.perf_counter() - start)
+        return result
+
+    def call(self, attempt, kind="complete", description="", discard=None):
+        """
+        在该阶段的端点上执行一次调用.
+
+        端点返回 UpstreamError (不可重试的错误或重试次数用尽) 时依次改用备用端点；配置了对冲策略时，
+        主端点超过对冲等待时间仍未返回，会同时向第一个备用端点发送请求，先成功的结果胜出.
+
+        Args:
+            attempt (callable): attempt(route) -> 结果，在给定端点上执行请求 (含限流和重试).
+            kind (str): 记录延迟的类别，"complete" (非流式总耗时) 或 "first_token" (流式首 token 时间).
+            description (str): 调用方名称，用于日志和指标.
+            discard (callable): discard(结果)，对冲中落败但成功完成的调用结果会传给它 (如关闭流).
+
+        Returns:
+            胜出端点上 attempt 的返回值.
+
+        Raises:
+            UpstreamError: 所有端点都失败，抛出最后一个错误.
+        """
+        routes = self.routes
+        if self.hedge is not None:
+            result, used, error = self._call_hedged(attempt, kind, description, discard)
+            if used == 0:
+                return result
+            routes = routes[used:]
+            if not routes:
+                raise error
+            logger.warning("%s: route %s failed (%s), falling back to %s", description, self.routes[used - 1].name, error, routes[0].name)
+            metrics.record_route_event(description, routes[0].model, "fallback")
+        for i, route in enumerate(routes):
+            try:
+                return self._timed(attempt, route, kind)
+            except UpstreamError as e:
+                if i == len(routes) - 1:
+                    raise
+                logger.warning("%s: route %s failed (%s), falling back to %s", description, route.name, e, routes[i + 1].name)
+                metrics.record_route_event(description, routes[i + 1].model, "fallback")
+
+    def _call_hedged(self, attempt, kind, description, discard):
+        """
+        在主端点和第一个备用端点之间对冲.
+
+        Returns:
+            tuple: (结果, 0, None) 表示成功；(None, n, 错误) 表示前 n 个端点都已失败.
+        """
+        primary, secondary = self.routes[0], self.routes[1]
+        delay = self.hedge.delay(primary.latency[kind])
+        futures = {_executor().submit(self._timed, attempt, primary, kind): primary}
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            logger.info("%s: %s has not answered after %.2fs, sending hedged request to %s", description, primary.name, delay, secondary.name)
+            metrics.record_route_event(description, secondary.model, "hedge")
+            futures[_executor().submit(self._timed, attempt, secondary, kind)] = secondary
+
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = None
+            for future in done:
+                try:
+                    result = future.result()
+                except UpstreamError as e:
+                    error = error or e
+                    continue
+                except Exception:
+                    for other in pending:
+                        _discard_later(other, discard)
+                    raise
+                if winner is None:
+                    winner, winner_result = future, result
+                elif discard is not None:
+                    discard(result) # 两个请求同时完成，丢弃后一个
+            if winner is not None:
+                if futures[winner] is not primary:
+                    metrics.record_route_event(description, secondary.model, "hedge_won")
+                for other in pending:
+                    _discard_later(other, discard)
+                return winner_result, 0, None
+            if len(futures) == 1: # 主端点在对冲之前就失败了，交给后续的回退逻辑
+                return None, 1, error
+        return None, 2, error
+
+    @staticmethod
+    async def _timed_async(attempt, route, kind):
+        start = time.perf_counter()
+        result = await attempt(route)
+        route.latency[kind].observe(time.perf_counter() - start)
+        return result
+
+    async def call_async(self, attempt, kind="complete", description="", discard=None):
+        """
+        call 的异步版本，回退和对冲规则相同.
+
+        对冲中落败的调用直接取消 (关闭其连接)，不需要等待它完成.
+
+        Args:
+            attempt (callable): attempt(route) -> awaitable，在给定端点上执行请求 (含限流和重试).
+            discard (callable): discard(结果)，可以返回 awaitable；两个调用同时完成时用于丢弃后一个结果.
+            其余参数与 call 相同.
+
+        Raises:
+            UpstreamError: 所有端点都失败，抛出最后一个错误.
+        """
+        routes = self.routes
+        if self.hedge is not None:
+            result, used, error = await self._call_hedged_async(attempt, kind, description, discard)
+            if used == 0:
+                return result
+            routes = routes[used:]
+            if not routes:
+                raise error
+            logger.warning("%s: route %s failed (%s), falling back to %s", description, self.routes[used - 1].name, error, routes[0].name)
+            metrics.record_route_event(description, routes[0].model, "fallback")
+        for i, route in enumerate(routes):
+            try:
+                return await self._timed_async(attempt, route, kind)
+            except UpstreamError as e:
+                if i == len(routes) - 1:
+                    raise
+                logger.warning("%s: route %s failed (%s), falling back to %s", description, route.name, e, routes[i + 1].name)
+                metrics.record_route_event(description, routes[i + 1].model, "fallback")
+
+    async def _call_hedged_async(self, attempt, kind, description, discard):
+        """_call_hedged 的异步版本，返回值相同."""
+        primary, secondary = self.routes[0], self.routes[1]
+        delay = self.hedge.delay(primary.latency[kind])
+        tasks = {asyncio.ensure_future(self._timed_async(attempt, primary, kind)): primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                logger.info("%s: %s has not answered after %.2fs, sending hedged request to %s", description, primary.name, delay, secondary.name)
+                metrics.record_route_event(description, secondary.model, "hedge")
+                tasks[asyncio.ensure_future(self._timed_async(attempt, secondary, kind))] = secondary
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                for task in done:
+                    try:
+                        result = task.result()
+                    except UpstreamError as e:
+                        error = error or e
+                        continue
+                    if winner is None:
+                        winner, winner_result = task, result
+                    elif discard is not None:
+                        await _maybe_await(discard(result)) # 两个请求同时完成，丢弃后一个
+                if winner is not None:
+                    if tasks[winner] is not primary:
+                        metrics.record_route_event(description, secondary.model, "hedge_won")
+                    return winner_result, 0, None
+                if len(tasks) == 1: # 主端点在对冲之前就失败了，交给后续的回退逻辑
+                    return None, 1, error
+            return None, 2, error
+        finally:
+            for task in tasks: # 落败、出错或调用方被取消时，取消仍在进行的请求
+                task.cancel()
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        await value
+
+def _build_route(spec):
+    """按配置文件中的一项构建 Route，API Key 从 api_key_env 指定的环境变量读取."""
+    api_key = OPENAI_API_KEY
+    if spec.get("api_key_env"):
+        api_key = os.getenv(spec["api_key_env"])
+        if not api_key:
+            raise ConfigurationError(f"Environment variable '{spec['api_key_env']}' for route '{spec.get('model', OPENAI_MODEL)}' is not set")
+    return Route(
+        spec.get("model") or OPENAI_MODEL,
+        spec.get("api_base") or OPENAI_API_BASE,
+        api_key,
+        spec.get("timeout"),
+        spec.get("max_retries"),
+    )
+
+def _build_hedge(spec):
+    """hedge 可以是 true / false，或覆盖 percentile、min_delay、initial_delay、min_samples 的对象."""
+    if not spec:
+        return None
+    if spec is True:
+        return HedgePolicy()
+    return HedgePolicy(
+        spec.get("percentile", HEDGE_PERCENTILE), spec.get("min_delay", HEDGE_MIN_DELAY),
+        spec.get("initial_delay", HEDGE_INITIAL_DELAY), spec.get("min_samples", HEDGE_MIN_SAMPLES)
+    )
+
+def load_routing_config(path):
+    """
+    读取路由配置文件 (JSON)，格式见 backend/model_routing.example.json.
+
+    Returns:
+        dict: 阶段名称 (或 "default") -> 配置，文件不存在或无法解析时为空.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("Cannot load model routing config '%s': %s", path, e)
+        return {}
+    if not isinstance(config, dict):
+        logger.error("Model routing config '%s' must be a JSON object", path)
+        return {}
+    logger.info("Loaded model routing config from %s (stages: %s)", path, ", ".join(config))
+    return config
+
+_routing_config = None
+_stage_routings = {}
+_routing_lock = threading.Lock()
+
+def get_stage_routing(stage):
+    """
+    获取阶段的路由，首次调用时创建.
+
+    配置文件中没有该阶段时使用 "default" 项；两者都没有时只有一个端点 (OPENAI_MODEL / OPENAI_API_BASE)，行为与不配置路由时相同.
+
+    Args:
+        stage (str): 阶段名称 (Prompt 模板名称).
+
+    Returns:
+        StageRouting: 该阶段的路由.
+
+    Raises:
+        ConfigurationError: 路由配置无效 (如 api_key_env 指定的环境变量未设置).
+    """
+    global _routing_config
+    routing = _stage_routings.get(stage)
+    if routing is not None:
+        return routing
+    with _routing_lock:
+        routing = _stage_routings.get(stage)
+        if routing is None:
+            if _routing_config is None:
+                _routing_config = load_routing_config(MODEL_ROUTING_PATH)
+            spec = _routing_config.get(stage) or _routing_config.get("default") or {}
+            routes = [_build_route(item) for item in spec.get("routes", [])] or [_build_route({})]
+            routing = StageRouting(stage, routes, _build_hedge(spec.get("hedge")))
+            _stage_routings[stage] = routing
+        return routing
@@ -0,0 +1,249 @@
+# backend/services/token_budget.py
+import logging
+import re
+import threading
+
+from backend.config import MODEL_CONTEXT_LIMITS, DEFAULT_CONTEXT_LIMIT, MAX_OUTPUT_TOKENS, OUTPUT_TOKENS_RATIO, OUTPUT_TOKENS_BASE
+from backend.config import OUTPUT_TOKENS_MIN, TOKEN_ESTIMATE_CHARS_PER_TOKEN, TOKEN_ESTIMATE_CJK_TOKENS_PER_CHAR
+from backend.services.errors import PromptTooLargeError
+
+logger = logging.getLogger(__name__)
+
+_tiktoken = None # 首次计数时导入 tiktoken (可选依赖，未安装时使用估算器)，False 表示未安装
+_tiktoken_lock = threading.Lock()
+
+def _load_tiktoken():
+    """返回 tiktoken 模块，未安装时返回 None."""
+    global _tiktoken
+    if _tiktoken is None:
+        with _tiktoken_lock:
+            if _tiktoken is None:
+                try:
+                    import tiktoken
+                    _tiktoken = tiktoken
+                except ImportError:
+                    _tiktoken = False
+    return _tiktoken or None
+
+CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]") # 中日韩字符及全角标点
+PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?;。！？；])\s+|(?<=[。！？；])")
+WHITESPACE_RE = re.compile(r"\s+")
+CONTEXT_SAFETY_MARGIN = 64 # 消息格式等额外开销预留的 token 数
+
+class TokenCounter:
+    """
+    Token 计数器.
+
+    安装了 tiktoken 时使用模型对应的分词器精确计数；否则按字符类型估算
+    (中日韩字符约每字 1 token，其余约每 4 字符 1 token)，并用 API 返回的 usage 对估算值持续校准.
+    """
+    _CALIBRATION_WEIGHT = 0.2 # 校准系数的指数滑动平均权重
+    _CALIBRATION_RANGE = (0.5, 2.0) # 校准系数的上下限，避免个别异常的 usage 数据使估算严重失真
+
+    def __init__(self):
+        self._encodings = {}
+        self._calibration = {} # 模型 -> 实际 token / 估算 token
+        self._lock = threading.Lock()
+
+    def _encoding(self, model):
+        tiktoken = _load_tiktoken()
+        if tiktoken is None:
+            return None
+        encoding = self._encodings.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+            except KeyError: # 非 OpenAI 模型，使用通用编码
+                encoding = tiktoken.get_encoding("cl100k_base")
+            self._encodings[model] = encoding
+        return encoding
+
+    @staticmethod
+    def estimate(text):
+        """不依赖分词器的 token 估算值."""
+        if not text:
+            return 0
+        cjk = len(CJK_RE.findall(text))
+        other = len(text) - cjk
+        return int(cjk * TOKEN_ESTIMATE_CJK_TOKENS_PER_CHAR + other / TOKEN_ESTIMATE_CHARS_PER_TOKEN) + 1
+
+    def count(self, text, model=None):
+        """
+        计算文本的 token 数.
+
+        Args:
+            text (str): 文本.
+            model (str): 模型名，用于选择分词器和校准系数.
+
+        Returns:
+            int: token 数.
+        """
+        if not text:
+            return 0
+        encoding = self._encoding(model)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return max(1, int(self.estimate(text) * self._calibration.get(model, 1.0)))
+
+    def observe(self, model, prompt_text, actual_prompt_tokens):
+        """
+        用 API 返回的实际 prompt token 数校准估算器 (使用 tiktoken 时无需校准).
+
+        Args:
+            model (str): 模型名.
+            prompt_text (str): 发送的 Prompt.
+            actual_prompt_tokens (int): response.usage.prompt_tokens.
+        """
+        if _load_tiktoken() is not None or not actual_prompt_tokens:
+            return
+        estimated = self.estimate(prompt_text)
+        if estimated <= 0:
+            return
+        low, high = self._CALIBRATION_RANGE
+        ratio = min(high, max(low, actual_prompt_tokens / estimated))
+        with self._lock:
+            previous = self._calibration.get(model)
+            self._calibration[model] = ratio if previous is None else previous + self._CALIBRATION_WEIGHT * (ratio - previous)
+
+token_counter = TokenCounter()
+
+def count_tokens(text, model=None):
+    """计算文本的 token 数 (见 TokenCounter.count)."""
+    return token_counter.count(text, model)
+
+def context_limit(model):
+    """
+    返回模型的上下文长度.
+
+    模型名带版本后缀时按最长前缀匹配 (如 gpt-4o-2024-08-06 使用 gpt-4o 的配置)，未配置的模型使用 DEFAULT_CONTEXT_LIMIT.
+    """
+    if model in MODEL_CONTEXT_LIMITS:
+        return MODEL_CONTEXT_LIMITS[model]
+    best = None
+    for name in MODEL_CONTEXT_LIMITS:
+        if model and model.startswith(name) and (best is None or len(name) > len(best)):
+            best = name
+    return MODEL_CONTEXT_LIMITS[best] if best else DEFAULT_CONTEXT_LIMIT
+
+def max_output_tokens(prompt_tokens, input_tokens, model):
+    """
+    根据输入长度计算输出上限，限制单次生成的最坏耗时.
+
+    输出上限 = OUTPUT_TOKENS_BASE + OUTPUT_TOKENS_RATIO * 输入 token 数，
+    且不超过 MAX_OUTPUT_TOKENS 和上下文剩余空间.
+
+    Args:
+        prompt_tokens (int): 完整 Prompt 的 token 数.
+        input_tokens (int): Prompt 中可变输入部分 (原文、译文等) 的 token 数.
+        model (str): 模型名.
+
+    Returns:
+        int: max_tokens.
+
+    Raises:
+        PromptTooLargeError: 上下文剩余空间不足 OUTPUT_TOKENS_MIN.
+    """
+    remaining = context_limit(model) - prompt_tokens - CONTEXT_SAFETY_MARGIN
+    if remaining < OUTPUT_TOKENS_MIN:
+        raise PromptTooLargeError(f"Prompt has {prompt_tokens} tokens, exceeding the context limit of {context_limit(model)} for model {model}")
+    wanted = OUTPUT_TOKENS_BASE + int(OUTPUT_TOKENS_RATIO * input_tokens)
+    return max(OUTPUT_TOKENS_MIN, min(wanted, MAX_OUTPUT_TOKENS, remaining))
+
+def input_token_budget(model, fixed_tokens):
+    """
+    计算可变输入最多能有多少 token，保证 Prompt 加上按输入长度预留的输出仍在上下文之内.
+
+    Args:
+        model (str): 模型名.
+        fixed_tokens (int): Prompt 模板等固定部分的 token 数.
+
+    Returns:
+        int: 输入 token 预算 (至少为 1).
+    """
+    available = context_limit(model) - fixed_tokens - CONTEXT_SAFETY_MARGIN - OUTPUT_TOKENS_BASE
+    return max(1, int(available / (1 + OUTPUT_TOKENS_RATIO)))
+
+def _split_keep_separators(text, pattern):
+    """按分隔符切分文本，分隔符保留在前一段末尾，所有片段拼接后等于原文."""
+    pieces, position = [], 0
+    for match in pattern.finditer(text):
+        if match.end() <= position:
+            continue
+        pieces.append(text[position:match.end()])
+        position = match.end()
+    if position < len(text):
+        pieces.append(text[position:])
+    return [piece for piece in pieces if piece]
+
+def split_text_to_budget(text, max_tokens, model=None):
+    """
+    把文本切分为不超过 max_tokens 的片段，依次尝试按段落、句子、空白切分，最后按字符硬切.
+
+    Args:
+        text (str): 文本.
+        max_tokens (int): 每个片段的 token 上限.
+        model (str): 模型名.
+
+    Returns:
+        list[str]: 片段列表，拼接后等于原文.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return [text]
+    for pattern in (PARAGRAPH_BREAK_RE, SENTENCE_BREAK_RE, WHITESPACE_RE):
+        pieces = _split_keep_separators(text, pattern)
+        if len(pieces) > 1:
+            break
+    else:
+        # 没有任何可用的切分点，按估算的每 token 字符数硬切
+        step = max(1, int(len(text) * max_tokens / max(1, count_tokens(text, model))))
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+
+    chunks, current, current_tokens = [], "", 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece, model)
+        if piece_tokens > max_tokens:
+            if current:
+                chunks.append(current)
+                current, current_tokens = "", 0
+            chunks.extend(split_text_to_budget(piece, max_tokens, model))
+            continue
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current += piece
+        current_tokens += piece_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def split_aligned_to_budget(source, target, max_tokens, model=None):
+    """
+    按对齐的段落同时切分原文和译文，每组原文段落加译文段落不超过 max_tokens.
+
+    译文的段落 (以空行分隔) 与原文一一对应时才能对齐；单个段落对超出预算时单独成组，不再细分.
+
+    Args:
+        source (str): 原文.
+        target (str): 译文.
+        max_tokens (int): 每组原文加译文的 token 上限.
+        model (str): 模型名.
+
+    Returns:
+        list[tuple] | None: (原文片段, 译文片段) 列表，各自拼接后等于原文和译文；段落数不同时返回 None.
+    """
+    source_pieces = _split_keep_separators(source, PARAGRAPH_BREAK_RE)
+    target_pieces = _split_keep_separators(target, PARAGRAPH_BREAK_RE)
+    if len(source_pieces) != len(target_pieces):
+        return None
+    chunks, current, current_tokens = [], None, 0
+    for source_piece, target_piece in zip(source_pieces, target_pieces):
+        piece_tokens = count_tokens(source_piece, model) + count_tokens(target_piece, model)
+        if current is not None and current_tokens + piece_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = None, 0
+        current = (current[0] + source_piece, current[1] + target_piece) if current is not None else (source_piece, target_piece)
+        current_tokens += piece_tokens
+    if current is not None:
+        chunks.append(current)
+    return chunks
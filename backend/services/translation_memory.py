@@ -0,0 +1,473 @@
+# backend/services/translation_memory.py
+import difflib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from backend.config import TRANSLATION_MEMORY_ENABLED, TRANSLATION_MEMORY_DB_PATH, TRANSLATION_MEMORY_MIN_CHARS
+from backend.config import TRANSLATION_MEMORY_NUM_PERM, TRANSLATION_MEMORY_BANDS
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text):
+    """合并连续空白并去掉首尾空白，只有空白不同的原文视为相同."""
+    return " ".join(text.split())
+
+class MinHashLSH:
+    """
+    基于 MinHash 和分段 LSH 的近似重复索引.
+
+    文本按 UTF-8 字节切成 shingle_size 字节的 shingle，用 num_perm 个哈希函数计算 MinHash 签名，
+    两个签名相同位置取值相等的比例是 shingle 集合 Jaccard 相似度的无偏估计.
+    签名切成 bands 段，每段哈希成一个 key；任一段 key 相同的条目成为候选，
+    Jaccard 相似度为 s 的条目成为候选的概率为 1 - (1 - s^rows)^bands.
+
+    每段的 key 保存在按 key 排序的数组中，查询是 bands 次二分查找，不随条目数线性增长；
+    新增条目的 key 先追加到未排序的尾部 (查询时向量化比较)，积累到 MERGE_EVERY 条后归并进有序数组.
+    """
+    MERGE_EVERY = 4096
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=5, seed=1):
+        """
+        构造函数.
+
+        Args:
+            num_perm (int): MinHash 签名长度，必须能被 bands 整除.
+            bands (int): LSH 分段数.
+            shingle_size (int): shingle 的字节数.
+            seed (int): 哈希函数的随机种子，持久化的签名只能与相同参数的索引一起使用.
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1) # 随机奇数
+        self._b = rng.integers(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64)
+        self._band_multipliers = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self._powers = np.array([256 ** i for i in range(shingle_size)], dtype=np.uint64)
+
+        self._size = 0
+        self._signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self._sorted = 0 # 前 _sorted 个条目已归并进有序数组
+        self._sorted_keys = np.zeros((bands, 0), dtype=np.uint64)
+        self._sorted_positions = np.zeros((bands, 0), dtype=np.int32)
+        self._tail_keys = np.zeros((0, bands), dtype=np.uint64) # 尚未归并的条目的 key
+
+    @property
+    def params(self):
+        """决定签名取值的参数，用于判断持久化的签名是否仍然有效."""
+        return {"num_perm": self.num_perm, "bands": self.bands, "shingle_size": self.shingle_size, "seed": self.seed}
+
+    def shingles(self, text):
+        """
+        文本的 shingle 集合.
+
+        每个 shingle 按字节直接编码为整数 (shingle_size <= 8 时没有冲突)，比短于 shingle_size 的文本整体作为一个 shingle.
+
+        Returns:
+            np.ndarray: 去重并排序后的 uint64 数组.
+        """
+        data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+        if len(data) < self.shingle_size:
+            return np.array([int((data * self._powers[:len(data)]).sum())], dtype=np.uint64)
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.shingle_size)
+        return np.unique((windows * self._powers).sum(axis=1))
+
+    def signature(self, text=None, shingles=None):
+        """
+        计算 MinHash 签名.
+
+        使用 num_perm 个 multiply-add-shift 哈希函数 ((a * x + b) mod 2^64 的高 32 位)，分别取最小值.
+
+        Returns:
+            np.ndarray: 长度为 num_perm 的 uint32 数组.
+        """
+        if shingles is None:
+            shingles = self.shingles(text)
+        hashed = (self._a * shingles + self._b) >> np.uint64(32)
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def _keys(self, signatures):
+        """签名 (n, num_perm) -> 每段的 key (n, bands)."""
+        banded = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        return (banded * self._band_multipliers).sum(axis=2)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, signatures):
+        """
+        添加条目.
+
+        Args:
+            signatures (np.ndarray): 一个签名或 (n, num_perm) 的签名数组.
+
+        Returns:
+            int: 第一个新条目的位置 (条目按添加顺序编号).
+        """
+        signatures = np.atleast_2d(np.asarray(signatures, dtype=np.uint32))
+        start = self._size
+        if start + len(signatures) > len(self._signatures):
+            capacity = max(1024, len(self._signatures) * 3 // 2, start + len(signatures))
+            self._signatures = np.resize(self._signatures, (capacity, self.num_perm))
+        self._signatures[start:start + len(signatures)] = signatures
+        self._tail_keys = np.concatenate([self._tail_keys, self._keys(signatures)])
+        self._size += len(signatures)
+        if len(self._tail_keys) >= self.MERGE_EVERY:
+            self._merge()
+        return start
+
+    @property
+    def nbytes(self):
+        """索引占用的内存 (字节)，包括签名数组预留的容量."""
+        return sum(array.nbytes for array in (self._signatures, self._sorted_keys, self._sorted_positions, self._tail_keys))
+
+    def _merge(self):
+        """把未排序尾部的条目归并进各段的有序数组."""
+        positions = np.arange(self._sorted, self._size, dtype=np.int32)
+        keys = self._tail_keys.T
+        order = np.argsort(keys, axis=1, kind="stable")
+        sorted_keys, sorted_positions = [], []
+        for band in range(self.bands):
+            new_keys = keys[band][order[band]]
+            insert_at = np.searchsorted(self._sorted_keys[band], new_keys)
+            sorted_keys.append(np.insert(self._sorted_keys[band], insert_at, new_keys))
+            sorted_positions.append(np.insert(self._sorted_positions[band], insert_at, positions[order[band]]))
+        self._sorted_keys = np.array(sorted_keys)
+        self._sorted_positions = np.array(sorted_positions)
+        self._sorted = self._size
+        self._tail_keys = np.zeros((0, self.bands), dtype=np.uint64)
+
+    def query(self, signature, min_estimate=0.0, limit=None):
+        """
+        查找近似重复的条目.
+
+        Args:
+            signature (np.ndarray): 查询文本的签名.
+            min_estimate (float): 签名估算的相似度下限.
+            limit (int): 最多返回的条目数.
+
+        Returns:
+            list[tuple]: (位置, 估算的 Jaccard 相似度)，按相似度从高到低排列.
+        """
+        query_keys = self._keys(np.atleast_2d(signature))[0]
+        found = []
+        if self._sorted:
+            lower = [np.searchsorted(self._sorted_keys[band], query_keys[band], side="left") for band in range(self.bands)]
+            upper = [np.searchsorted(self._sorted_keys[band], query_keys[band], side="right") for band in range(self.bands)]
+            found.extend(self._sorted_positions[band, lower[band]:upper[band]] for band in range(self.bands) if upper[band] > lower[band])
+        if len(self._tail_keys):
+            tail = np.nonzero((self._tail_keys == query_keys).any(axis=1))[0]
+            found.append(tail + self._sorted)
+        if not found:
+            return []
+        candidates = np.unique(np.concatenate(found))
+        estimates = (self._signatures[candidates] == signature).mean(axis=1)
+        order = np.argsort(-estimates, kind="stable")
+        order = order[estimates[order] >= min_estimate][:limit]
+        return [(int(candidates[i]), float(estimates[i])) for i in order]
+
+    def scan(self, signature, min_estimate=0.0, limit=None):
+        """不使用 LSH 分段，直接比较全部签名 (线性扫描，用于对比和测试召回率)."""
+        estimates = (self._signatures[:self._size] == signature).mean(axis=1)
+        order = np.argsort(-estimates, kind="stable")
+        order = order[estimates[order] >= min_estimate][:limit]
+        return [(int(i), float(estimates[i])) for i in order]
+
+def jaccard(left, right):
+    """两个去重后的 shingle 数组的 Jaccard 相似度."""
+    if not len(left) and not len(right):
+        return 1.0
+    common = len(np.intersect1d(left, right, assume_unique=True))
+    return common / (len(left) + len(right) - common)
+
+class MemoryMatch:
+    """翻译记忆的一次匹配结果."""
+    def __init__(self, source, translation, similarity):
+        self.source = source
+        self.translation = translation
+        self.similarity = similarity # 1.0 表示原文相同 (忽略空白差异)，否则为 shingle 集合的 Jaccard 相似度
+
+    @property
+    def exact(self):
+        return self.similarity >= 1.0
+
+class TranslationMemory:
+    """
+    持久化的翻译记忆：原文段落 -> 最终译文.
+
+    条目保存在 SQLite 中 (包括 MinHash 签名，重启后无需重新计算)，启动时把签名载入内存中的 MinHashLSH 索引.
+    查询先按规范化原文的哈希查找完全相同的段落，再用 LSH 查找近似重复的候选，并用精确的 Jaccard 相似度确认.
+    每个条目同时记录产生译文时的上下文 (如模型和 Prompt 的指纹)，与查询时的上下文不一致的条目视为未命中.
+    """
+    CANDIDATES = 3 # 精确计算相似度的候选数
+    ESTIMATE_SLACK = 0.15 # 签名估算存在误差，候选的估算相似度下限放宽的幅度
+
+    def __init__(self, db_path=None, num_perm=64, bands=16, min_chars=30):
+        """
+        构造函数.
+
+        Args:
+            db_path (str): SQLite 文件路径，为空时只保存在内存中.
+            num_perm (int): MinHash 签名长度.
+            bands (int): LSH 分段数.
+            min_chars (int): 短于该长度的原文只查找完全相同的段落 (短文本的相似度没有意义).
+        """
+        self.db_path = db_path
+        self.min_chars = min_chars
+        self.index = MinHashLSH(num_perm, bands)
+        self._exact = {} # 规范化原文的 sha1 -> 索引位置
+        self._row_ids = [] # 索引位置 -> 数据库行 id
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "fuzzy_hits": 0, "misses": 0, "stale": 0, "stores": 0}
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, source_hash TEXT UNIQUE NOT NULL, source TEXT NOT NULL, "
+            "translation TEXT NOT NULL, signature BLOB NOT NULL, updated_at REAL NOT NULL, context TEXT NOT NULL DEFAULT '')"
+        )
+        if "context" not in {row[1] for row in self._db.execute("PRAGMA table_info(entries)")}: # 旧版本的数据库，条目的上下文为空
+            self._db.execute("ALTER TABLE entries ADD COLUMN context TEXT NOT NULL DEFAULT ''")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+        self._load()
+
+    @staticmethod
+    def _digest(normalized):
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """把数据库中的签名载入索引，索引参数变化时重新计算签名."""
+        start = time.perf_counter()
+        params = json.dumps(self.index.params, sort_keys=True)
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'index_params'").fetchone()
+        if row is not None and row[0] != params:
+            logger.info("Translation memory index parameters changed, recomputing signatures")
+            for row_id, source in self._db.execute("SELECT id, source FROM entries").fetchall():
+                signature = self.index.signature(normalize_text(source))
+                self._db.execute("UPDATE entries SET signature = ? WHERE id = ?", (signature.tobytes(), row_id))
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('index_params', ?)", (params,))
+        self._db.commit()
+
+        rows = self._db.execute("SELECT id, source_hash, signature FROM entries ORDER BY id").fetchall()
+        if rows:
+            signatures = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.uint32).reshape(len(rows), self.index.num_perm)
+            self.index.add(signatures)
+            self._row_ids = [row[0] for row in rows]
+            self._exact = {row[1]: position for position, row in enumerate(rows)}
+        if self.db_path:
+            logger.info("Translation memory loaded from %s: %s entries in %.2fs", self.db_path, len(rows), time.perf_counter() - start)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _fetch(self, position):
+        """读取索引位置对应的 (原文, 译文, 上下文) (调用方需持有 _lock)."""
+        return self._db.execute("SELECT source, translation, context FROM entries WHERE id = ?", (self._row_ids[position],)).fetchone()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def lookup(self, text, min_similarity, context=None):
+        """
+        查找与原文最相似的已翻译段落.
+
+        Args:
+            text (str): 原文.
+            min_similarity (float): 相似度下限，1.0 表示只查找相同的段落.
+            context (callable): context(source) -> str，条目原文当前对应的上下文，与条目记录的上下文不一致时跳过该条目；
+                为 None 时不检查.
+
+        Returns:
+            MemoryMatch | None: 相似度不低于下限的最佳匹配.
+        """
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        digest = self._digest(normalized)
+        with self._lock:
+            position = self._exact.get(digest)
+            if position is not None:
+                source, translation, stored_context = self._fetch(position)
+                if context is None or stored_context == context(source):
+                    self._stats["exact_hits"] += 1
+                    return MemoryMatch(source, translation, 1.0)
+                self._stats["stale"] += 1
+        if min_similarity >= 1.0 or len(normalized) < self.min_chars:
+            self._count("misses")
+            return None
+
+        shingles = self.index.shingles(normalized)
+        signature = self.index.signature(shingles=shingles)
+        best = None
+        with self._lock:
+            candidates = self.index.query(signature, min_similarity - self.ESTIMATE_SLACK, self.CANDIDATES)
+            for position, _ in candidates:
+                source, translation, stored_context = self._fetch(position)
+                if context is not None and stored_context != context(source):
+                    continue
+                similarity = min(jaccard(self.index.shingles(normalize_text(source)), shingles), 0.999) # 1.0 只表示原文相同
+                if similarity >= min_similarity and (best is None or similarity > best.similarity):
+                    best = MemoryMatch(source, translation, similarity)
+            self._stats["fuzzy_hits" if best is not None else "misses"] += 1
+        return best
+
+    def add(self, source, translation, context=""):
+        """
+        记录原文段落的最终译文，相同的原文 (忽略空白差异) 只保留最新的译文.
+
+        Args:
+            source (str): 原文.
+            translation (str): 最终译文.
+            context (str): 产生译文时的上下文，见 lookup.
+
+        Returns:
+            bool: 是否写入了新条目或更新了译文.
+        """
+        normalized = normalize_text(source)
+        if not normalized or not translation.strip():
+            return False
+        digest = self._digest(normalized)
+        now = time.time()
+        with self._lock:
+            position = self._exact.get(digest)
+            if position is not None:
+                updated = self._db.execute(
+                    "UPDATE entries SET translation = ?, context = ?, updated_at = ? WHERE id = ? AND (translation != ? OR context != ?)",
+                    (translation, context, now, self._row_ids[position], translation, context)
+                ).rowcount
+                self._db.commit()
+                if updated:
+                    self._stats["stores"] += 1
+                return bool(updated)
+        signature = self.index.signature(normalized)
+        with self._lock:
+            if digest in self._exact: # 计算签名期间其他线程已经写入
+                return False
+            row_id = self._db.execute(
+                "INSERT INTO entries (source_hash, source, translation, signature, updated_at, context) VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, source, translation, signature.tobytes(), now, context)
+            ).lastrowid
+            self._db.commit()
+            self._exact[digest] = self.index.add(signature)
+            self._row_ids.append(row_id)
+            self._stats["stores"] += 1
+        return True
+
+    def add_many(self, pairs, context=""):
+        """
+        在一个事务中批量写入 (原文, 译文)，用于导入已有的双语对照.
+
+        Args:
+            pairs (iterable): (原文, 译文) 对.
+            context (str): 所有条目共同的上下文，见 lookup.
+
+        Returns:
+            int: 新增的条目数 (已有原文只更新译文，不计入).
+        """
+        entries = []
+        for source, translation in pairs:
+            normalized = normalize_text(source)
+            if normalized and translation.strip():
+                entries.append((self._digest(normalized), source, translation, self.index.signature(normalized)))
+        now = time.time()
+        signatures = []
+        with self._lock:
+            for digest, source, translation, signature in entries:
+                position = self._exact.get(digest)
+                if position is not None:
+                    self._db.execute("UPDATE entries SET translation = ?, context = ?, updated_at = ? WHERE id = ?", (translation, context, now, self._row_ids[position]))
+                    continue
+                row_id = self._db.execute(
+                    "INSERT INTO entries (source_hash, source, translation, signature, updated_at, context) VALUES (?, ?, ?, ?, ?, ?)",
+                    (digest, source, translation, signature.tobytes(), now, context)
+                ).lastrowid
+                self._exact[digest] = len(self._row_ids)
+                self._row_ids.append(row_id)
+                signatures.append(signature)
+            self._db.commit()
+            if signatures:
+                self.index.add(np.array(signatures))
+            self._stats["stores"] += len(signatures)
+        return len(signatures)
+
+    def stats(self):
+        """返回 exact_hits / fuzzy_hits / misses / stale (上下文不一致而跳过的相同原文) / stores 计数和条目数."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self.index)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def _describe_changes(reference, current, limit=20):
+    """按词比较两段原文，列出当前原文相对参考原文的改动."""
+    old, new = reference.split(), current.split()
+    changes = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == "replace":
+            changes.append(f"- 「{' '.join(old[i1:i2])}」改为「{' '.join(new[j1:j2])}」")
+        elif tag == "delete":
+            changes.append(f"- 删除「{' '.join(old[i1:i2])}」")
+        elif tag == "insert":
+            changes.append(f"- 新增「{' '.join(new[j1:j2])}」")
+    if len(changes) > limit:
+        changes = changes[:limit] + [f"- (另有 {len(changes) - limit} 处改动)"]
+    return "\n".join(changes) or "- 仅空白或标点不同"
+
+REUSE_NOTE = "翻译记忆：之前翻译过相同的原文，直接复用当时的最终译文，没有调用 LLM。" # 直接复用时代替问题列表显示的说明
+
+def reference_note(match, origin_text):
+    """
+    把相似段落的译文作为参考时传给意译步骤的 "直接翻译的问题".
+
+    说明直接翻译来自相似原文，并列出两段原文的差异，由意译步骤按当前原文修改.
+    """
+    return (
+        f"上面的\"直接翻译\"是一段相似原文 (相似度 {match.similarity:.0%}) 之前确定的译文，不是当前原文的翻译。"
+        "请以它为基础，按当前原文修改其中不一致的地方，其余措辞尽量保持不变，使术语和风格与之前的译文一致。\n"
+        f"相似原文：\n{match.source}\n"
+        f"当前原文相对相似原文的改动：\n{_describe_changes(match.source, origin_text)}"
+    )
+
+_translation_memory = None
+_translation_memory_lock = threading.Lock()
+
+def get_translation_memory():
+    """
+    获取进程级共享的翻译记忆，首次调用时从 TRANSLATION_MEMORY_DB_PATH 加载.
+
+    Returns:
+        TranslationMemory | None: TRANSLATION_MEMORY_ENABLED 关闭或无法打开数据库时返回 None.
+    """
+    global _translation_memory
+    if not TRANSLATION_MEMORY_ENABLED:
+        return None
+    if _translation_memory is None:
+        with _translation_memory_lock:
+            if _translation_memory is None:
+                try:
+                    _translation_memory = TranslationMemory(
+                        TRANSLATION_MEMORY_DB_PATH, TRANSLATION_MEMORY_NUM_PERM, TRANSLATION_MEMORY_BANDS, TRANSLATION_MEMORY_MIN_CHARS
+                    )
+                except Exception as e:
+                    logger.error("Error opening translation memory %s: %s", TRANSLATION_MEMORY_DB_PATH, e, exc_info=True)
+                    _translation_memory = False # 不再重试，本进程内不使用翻译记忆
+    return _translation_memory if _translation_memory is not False else None
@@ -1,173 +1,967 @@
 # backend/services/translation_service.py
+import asyncio
+import inspect
 import logging
-import openai
-from backend.config import PROPER_NOUNS_SPOTTING_PROMPT, STRAIGHT_UP_TRANSLATION_PROMPT, ISSUE_SPOTTING_PROMPT, LOOSE_TRANSLATION_PROMPT # 导入所有 prompt 变量
-from backend.config import OPENAI_API_KEY, OPENAI_API_BASE, OPENAI_MODEL
+import re
+import time
+
+from backend.config import MAX_TOKENS_PARAM, STREAM_INCLUDE_USAGE, REVISION_EARLY_EXIT, log_payload
+from backend.services.response_cache import ResponseCache, get_response_cache
+from backend.services.glossary import get_glossary, format_term_table, parse_term_table, prune_term_table
+from backend.services.token_budget import count_tokens, max_output_tokens, input_token_budget, split_text_to_budget, split_aligned_to_budget, token_counter
+from backend.services.rate_limiter import call_with_retry, call_with_retry_async, to_upstream_error
+from backend.services.errors import ConfigurationError, TranslationServiceError
+from backend.services.metrics import metrics
+from backend.services.prompt_templates import get_template
+from backend.services.routing import get_stage_routing
 
 logger = logging.getLogger(__name__)
 
+class StreamReplacement(str):
+    """流式输出中代替之前所有增量的完整文本 (如与术语表合并后的专有名词表)."""
+
+def apply_delta(text, delta):
+    """把 stream_prompt 返回的一段增量应用到已拼接的文本上，返回新的完整文本."""
+    return str(delta) if isinstance(delta, StreamReplacement) else text + delta
+
+def merge_term_tables(tables):
+    """合并分块识别得到的多个专有名词表 (按英文去重)，都无法解析时用空行拼接原文."""
+    merged, seen = [], set()
+    for source, target in (entry for table in tables for entry in parse_term_table(table)):
+        if source.lower() not in seen:
+            seen.add(source.lower())
+            merged.append((source, target))
+    return format_term_table(merged) if merged else "\n\n".join(tables)
+
+class _OpenedStream:
+    """已经建立并读到首个文本增量 (或已经结束) 的流式响应."""
+    def __init__(self, route, stream, estimated_tokens, info):
+        self.route = route
+        self.stream = stream
+        self.estimated_tokens = estimated_tokens
+        self.info = info
+        self.usage = None
+        self._chunks = iter(stream)
+        self._first = self._next_delta()
+
+    def _next_delta(self):
+        for chunk in self._chunks:
+            if getattr(chunk, "usage", None) is not None:
+                self.usage = chunk.usage # include_usage 时最后一个 chunk 携带 token 用量，choices 为空
+            if chunk.choices and chunk.choices[0].delta.content:
+                return chunk.choices[0].delta.content
+        return None
+
+    def deltas(self):
+        """依次返回文本增量 (包括已经读到的首个增量)."""
+        delta, self._first = self._first, None
+        while delta is not None:
+            yield delta
+            delta = self._next_delta()
+
+    def close(self):
+        """关闭底层连接 (对冲中落败的流，或调用方提前停止读取)."""
+        try:
+            self.stream.close()
+        except Exception as e:
+            logger.debug("Error closing stream: %s", e)
+
+class _AsyncOpenedStream:
+    """_OpenedStream 的异步版本，由 open() 建立并读到首个文本增量."""
+    def __init__(self, route, stream, estimated_tokens, info):
+        self.route = route
+        self.stream = stream
+        self.estimated_tokens = estimated_tokens
+        self.info = info
+        self.usage = None
+        self._chunks = stream.__aiter__()
+        self._first = None
+
+    @classmethod
+    async def open(cls, route, stream, estimated_tokens, info):
+        opened = cls(route, stream, estimated_tokens, info)
+        opened._first = await opened._next_delta()
+        return opened
+
+    async def _next_delta(self):
+        async for chunk in self._chunks:
+            if getattr(chunk, "usage", None) is not None:
+                self.usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                return chunk.choices[0].delta.content
+        return None
+
+    async def deltas(self):
+        """依次返回文本增量 (包括已经读到的首个增量)."""
+        delta, self._first = self._first, None
+        while delta is not None:
+            yield delta
+            delta = await self._next_delta()
+
+    async def close(self):
+        try:
+            await self.stream.close()
+        except Exception as e:
+            logger.debug("Error closing stream: %s", e)
+
 class BaseTranslationService: # 创建 BaseTranslationService 基类
     """翻译服务的基类，封装通用功能."""
-    def __init__(self, prompt):
+    stop_sequences = () # 停止序列，子类可以设置为 Prompt 中的分段标签，防止模型复述 Prompt 时长时间生成
+
+    def __init__(self, prompt_name):
         """
         构造函数.
 
         Args:
-            prompt (str):  当前服务需要使用的 Prompt 内容.
+            prompt_name (str):  当前服务使用的 Prompt 模板名称 (见 backend.config.PROMPT_FILES).
         """
-        self.prompt = prompt # 加载 prompt (由子类传入具体的 prompt)
-        self.api_key = OPENAI_API_KEY
-        self.api_base = OPENAI_API_BASE
-        self.model = OPENAI_MODEL
+        self.prompt_name = prompt_name # 模板由 prompt_templates 注册表管理，文件修改后自动重新加载
+        self.routing = get_stage_routing(prompt_name) # 该阶段的模型、API Base、超时和备用端点 (见 MODEL_ROUTING_PATH)
+        primary = self.routing.primary
+        self.api_key = primary.api_key
+        self.api_base = primary.api_base
+        self.model = primary.model # 主端点的模型，用于计算输入分块的预算和缓存 key
 
         if not self.api_key:
             logger.error("OPENAI_API_KEY is not configured. OpenAI API calls will fail.")
-        logger.info(f"{self.__class__.__name__} 初始化，API Base: {self.api_base}, Model: {self.model}") # 使用 __class__.__name__ 获取子类类名
-        self.client = openai.OpenAI(
-            api_key=self.api_key,
-            base_url=self.api_base if self.api_base else "https://api.openai.com/v1"
+        logger.info("%s 初始化，API Base: %s, Model: %s, Routes: %s", self.__class__.__name__, self.api_base, self.model, self.routing.describe()) # 使用 __class__.__name__ 获取子类类名
+        self.client = primary.client # 复用进程级共享的客户端和连接池
+        self.rate_limiter = primary.rate_limiter # 同一模型的所有服务共享 RPM / TPM 额度
+
+    @property
+    def template(self):
+        """当前的编译模板 (每次获取时按文件 mtime 检查是否需要重新加载)."""
+        return get_template(self.prompt_name)
+
+    @property
+    def prompt(self):
+        """当前的 Prompt 模板原文."""
+        return self.template.source
+
+    def require_api_key(self):
+        """
+        检查 API Key 是否已配置.
+
+        Raises:
+            ConfigurationError: 未设置 OPENAI_API_KEY.
+        """
+        if not self.api_key:
+            logger.error("OPENAI_API_KEY is not set. Cannot call OpenAI API.")
+            raise ConfigurationError("OpenAI API Key is not configured. Please set OPENAI_API_KEY environment variable or in .env file.")
+
+    def _estimated_tokens(self, constructed_prompt, params, model=None):
+        """限流器使用的 token 预估值：Prompt token 数加上输出上限."""
+        return count_tokens(constructed_prompt, model or self.model) + params.get(MAX_TOKENS_PARAM, 0)
+
+    def _request_params(self, constructed_prompt, route=None):
+        """
+        返回除 messages 外的 chat.completions 调用参数.
+
+        输出上限根据 Prompt 中可变输入部分的 token 数和端点模型的上下文长度计算，限制单次调用的最坏耗时；
+        这些参数会参与响应缓存 key 的计算，子类如需调整 temperature 等参数可以 Override 此方法.
+
+        Args:
+            route (Route): 发送请求的端点，为 None 时使用主端点.
+
+        Raises:
+            PromptTooLargeError: Prompt 超出该模型的上下文长度.
+        """
+        model = route.model if route is not None else self.model
+        prompt_tokens = count_tokens(constructed_prompt, model)
+        input_tokens = max(0, prompt_tokens - self.template.token_count(model))
+        params = {MAX_TOKENS_PARAM: max_output_tokens(prompt_tokens, input_tokens, model)}
+        if self.stop_sequences:
+            params["stop"] = list(self.stop_sequences)
+        logger.debug("%s prompt tokens: %s, %s: %s", self.__class__.__name__, prompt_tokens, MAX_TOKENS_PARAM, params[MAX_TOKENS_PARAM])
+        return params
+
+    def _params_for(self, route, constructed_prompt, params):
+        """主端点使用已经计算好的参数，备用端点按其模型的上下文长度重新计算输出上限."""
+        return params if route is self.routing.primary else self._request_params(constructed_prompt, route)
+
+    def _cache_key(self, constructed_prompt, params):
+        """
+        响应缓存 key，对应主端点 (模型和 API Base) 上的请求.
+
+        备用端点 (回退或对冲胜出) 给出的结果来自不同的模型或服务，不写入缓存，以免之后主端点的请求命中它们.
+        """
+        return ResponseCache.make_key(self.model, params, constructed_prompt, self.api_base)
+
+    def _request_on_route(self, route, constructed_prompt, params):
+        """
+        经过限流器向一个端点发送请求，临时故障自动重试.
+
+        Returns:
+            tuple: (文本结果, 本次调用的模型、token 用量和重试次数).
+
+        Raises:
+            UpstreamError: 不可重试的错误或重试次数用尽.
+        """
+        info = {"model": route.model, "primary": route is self.routing.primary}
+        params = self._params_for(route, constructed_prompt, params)
+        estimated_tokens = self._estimated_tokens(constructed_prompt, params, route.model)
+        response = call_with_retry(
+            lambda: route.client.chat.completions.create(
+                model=route.model,
+                messages=[
+                    {"role": "user", "content": constructed_prompt}
+                ],
+                **params,
+                **route.request_options()
+            ),
+            route.rate_limiter, estimated_tokens, self.__class__.__name__, max_retries=route.max_retries, call_info=info
+        )
+        return self._completion_result(route, constructed_prompt, estimated_tokens, response, info)
+
+    def _completion_result(self, route, constructed_prompt, estimated_tokens, response, info):
+        """从非流式响应中取出文本，记录 token 用量并归还多预估的 TPM 额度."""
+        content = response.choices[0].message.content or ""
+        if response.usage is not None:
+            token_counter.observe(route.model, constructed_prompt, response.usage.prompt_tokens)
+            route.rate_limiter.refund(estimated_tokens - response.usage.total_tokens) # 归还多预估的 TPM 额度
+            info["prompt_tokens"] = response.usage.prompt_tokens
+            info["completion_tokens"] = response.usage.completion_tokens
+        else:
+            info["prompt_tokens"] = count_tokens(constructed_prompt, route.model)
+            info["completion_tokens"] = count_tokens(content, route.model)
+        return content, info
+
+    async def _request_on_route_async(self, route, constructed_prompt, params):
+        """_request_on_route 的异步版本，使用该端点的 AsyncOpenAI 客户端."""
+        info = {"model": route.model, "primary": route is self.routing.primary}
+        params = self._params_for(route, constructed_prompt, params)
+        estimated_tokens = self._estimated_tokens(constructed_prompt, params, route.model)
+        response = await call_with_retry_async(
+            lambda: route.async_client.chat.completions.create(
+                model=route.model,
+                messages=[
+                    {"role": "user", "content": constructed_prompt}
+                ],
+                **params,
+                **route.request_options()
+            ),
+            route.rate_limiter, estimated_tokens, self.__class__.__name__, max_retries=route.max_retries, call_info=info
+        )
+        return self._completion_result(route, constructed_prompt, estimated_tokens, response, info)
+
+    def _request_completion(self, constructed_prompt, params, call_info):
+        """
+        按该阶段的路由发送请求并返回文本结果：主端点失败时改用备用端点，配置了对冲时慢请求会被对冲.
+
+        Args:
+            call_info (dict): 写入胜出端点的模型、token 用量、重试次数，并标记未命中缓存.
+
+        Raises:
+            UpstreamError: 所有端点都失败.
+        """
+        call_info["cache_hit"] = False
+        content, info = self.routing.call(
+            lambda route: self._request_on_route(route, constructed_prompt, params), "complete", self.__class__.__name__
+        )
+        call_info.update(info)
+        return content
+
+    async def _request_completion_async(self, constructed_prompt, params, call_info):
+        """_request_completion 的异步版本."""
+        call_info["cache_hit"] = False
+        content, info = await self.routing.call_async(
+            lambda route: self._request_on_route_async(route, constructed_prompt, params), "complete", self.__class__.__name__
         )
+        call_info.update(info)
+        return content
+
+    def _record_call(self, start, call_info, ttft=None, error=None):
+        """把一次 API 调用 (或缓存命中) 的耗时、token 用量和重试次数记入指标."""
+        metrics.record_llm_call(
+            self.__class__.__name__, call_info.get("model", self.model), time.perf_counter() - start, ttft=ttft,
+            prompt_tokens=call_info.get("prompt_tokens", 0), completion_tokens=call_info.get("completion_tokens", 0),
+            cache_hit=call_info.get("cache_hit", False), retries=call_info.get("retries", 0), error=error
+        )
+
+    def _split_input(self, origin_text, fixed_text=""):
+        """
+        原文放入 Prompt 后超出模型上下文预算时，按段落、句子切分原文.
+
+        Args:
+            origin_text (str): 原文.
+            fixed_text (str): 与原文一起放入 Prompt 的其他内容 (如专有名词表).
+
+        Returns:
+            list[str]: 原文片段，拼接后等于原文；未超出预算时只有一个片段.
+        """
+        fixed_tokens = self.template.token_count(self.model) + count_tokens(fixed_text, self.model)
+        return split_text_to_budget(origin_text, input_token_budget(self.model, fixed_tokens), self.model)
+
+    def _split_aligned(self, origin_text, straight_up, fixed_text=""):
+        """
+        原文和直接翻译一起放入 Prompt 后超出模型上下文预算时，按对齐的段落同时切分两者.
+
+        Args:
+            origin_text (str): 原文.
+            straight_up (str): 直接翻译的结果.
+            fixed_text (str): 与它们一起放入 Prompt 的其他内容 (如专有名词表、问题列表).
+
+        Returns:
+            list[tuple] | None: (原文片段, 直接翻译片段) 列表；未超出预算时返回 None.
+                直接翻译与原文的段落数不同、无法对齐时同样返回 None，请求照常发送 (超出模型上下文长度时抛出 PromptTooLargeError).
+        """
+        fixed_tokens = self.template.token_count(self.model) + count_tokens(fixed_text, self.model)
+        budget = input_token_budget(self.model, fixed_tokens)
+        if count_tokens(origin_text, self.model) + count_tokens(straight_up, self.model) <= budget:
+            return None
+        chunks = split_aligned_to_budget(origin_text, straight_up, budget, self.model)
+        if chunks is None:
+            logger.warning("%s input exceeds the token budget, but the straight-up translation cannot be aligned with the origin text by paragraph; sending it unsplit", self.__class__.__name__)
+            return None
+        return chunks if len(chunks) > 1 else None
 
     def _run_api_call(self, constructed_prompt): # 定义通用的 _run_api_call 方法 (protected 方法)
         """
         封装 OpenAI API 调用的通用逻辑.
 
+        相同模型、参数和 Prompt 的结果会从响应缓存中直接返回，并发的相同请求只会调用一次 API
+        (只缓存主端点给出的结果，见 _cache_key).
+        Prompt 超出模型上下文长度时不发送请求.
+
         Args:
             constructed_prompt (str):  构建好的完整 Prompt.
 
         Returns:
             str:  LLM 返回的文本结果.
-            str:  如果 API 调用出错，返回错误信息字符串.
+
+        Raises:
+            TranslationServiceError: Prompt 过大、上游调用失败等 (出错的结果不会写入缓存).
+        """
+        logger.debug("Constructed prompt for OpenAI API:\n%s", log_payload(constructed_prompt))
+        start = time.perf_counter()
+        call_info = {"cache_hit": True} # 缓存命中 (包括等待并发的相同请求) 时 _request_completion 不会被调用
+        try:
+            params = self._request_params(constructed_prompt)
+            cache = get_response_cache()
+            if cache is not None:
+                llm_result = cache.get_or_compute(
+                    self._cache_key(constructed_prompt, params),
+                    lambda: self._request_completion(constructed_prompt, params, call_info),
+                    store=lambda _: call_info.get("primary", True)
+                )
+            else:
+                llm_result = self._request_completion(constructed_prompt, params, call_info)
+            logger.debug("Raw LLM response: %s", log_payload(llm_result))
+        except TranslationServiceError as e:
+            logger.error("Error calling OpenAI API from %s: %s", self.__class__.__name__, e, exc_info=True) # 在日志中包含类名
+            self._record_call(start, call_info, error=e)
+            raise
+        self._record_call(start, call_info)
+        return llm_result
+
+    async def _run_api_call_async(self, constructed_prompt):
+        """
+        _run_api_call 的异步版本：等待上游响应、限流排队和重试退避期间让出事件循环.
+
+        Raises:
+            TranslationServiceError: Prompt 过大、上游调用失败等 (出错的结果不会写入缓存).
         """
-        logger.debug(f"Constructed prompt for OpenAI API:\n{constructed_prompt}")
+        logger.debug("Constructed prompt for OpenAI API:\n%s", log_payload(constructed_prompt))
+        start = time.perf_counter()
+        call_info = {"cache_hit": True}
+        try:
+            params = self._request_params(constructed_prompt)
+            cache = get_response_cache()
+            if cache is not None:
+                llm_result = await cache.aget_or_compute(
+                    self._cache_key(constructed_prompt, params),
+                    lambda: self._request_completion_async(constructed_prompt, params, call_info),
+                    store=lambda _: call_info.get("primary", True)
+                )
+            else:
+                llm_result = await self._request_completion_async(constructed_prompt, params, call_info)
+            logger.debug("Raw LLM response: %s", log_payload(llm_result))
+        except TranslationServiceError as e:
+            logger.error("Error calling OpenAI API from %s: %s", self.__class__.__name__, e, exc_info=True)
+            self._record_call(start, call_info, error=e)
+            raise
+        self._record_call(start, call_info)
+        return llm_result
+
+    def _open_stream(self, route, constructed_prompt, params):
+        """
+        在一个端点上建立流式请求并读到首个文本增量，建立连接阶段的临时故障自动重试.
+
+        Returns:
+            _OpenedStream: 已读到首个增量的流.
+
+        Raises:
+            UpstreamError: 不可重试的错误、重试次数用尽，或在首个增量之前中断.
+        """
+        import openai # 延迟导入，见 registry
+        info = {"model": route.model, "primary": route is self.routing.primary}
+        params = self._params_for(route, constructed_prompt, params)
+        estimated_tokens = self._estimated_tokens(constructed_prompt, params, route.model)
+        extra = {"stream_options": {"include_usage": True}} if STREAM_INCLUDE_USAGE else {} # 不参与缓存 key
+        stream = call_with_retry(
+            lambda: route.client.chat.completions.create(
+                model=route.model,
+                messages=[
+                    {"role": "user", "content": constructed_prompt}
+                ],
+                stream=True,
+                **params,
+                **extra,
+                **route.request_options()
+            ),
+            route.rate_limiter, estimated_tokens, self.__class__.__name__, max_retries=route.max_retries, call_info=info
+        )
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            return _OpenedStream(route, stream, estimated_tokens, info)
+        except openai.OpenAIError as e:
+            stream.close()
+            raise to_upstream_error(e, 1) from e
+
+    async def _open_stream_async(self, route, constructed_prompt, params):
+        """_open_stream 的异步版本，对冲中落败被取消时关闭已经建立的连接."""
+        import openai
+        info = {"model": route.model, "primary": route is self.routing.primary}
+        params = self._params_for(route, constructed_prompt, params)
+        estimated_tokens = self._estimated_tokens(constructed_prompt, params, route.model)
+        extra = {"stream_options": {"include_usage": True}} if STREAM_INCLUDE_USAGE else {}
+        stream = await call_with_retry_async(
+            lambda: route.async_client.chat.completions.create(
+                model=route.model,
                 messages=[
                     {"role": "user", "content": constructed_prompt}
-                ]
+                ],
+                stream=True,
+                **params,
+                **extra,
+                **route.request_options()
+            ),
+            route.rate_limiter, estimated_tokens, self.__class__.__name__, max_retries=route.max_retries, call_info=info
+        )
+        try:
+            return await _AsyncOpenedStream.open(route, stream, estimated_tokens, info)
+        except openai.OpenAIError as e:
+            await stream.close()
+            raise to_upstream_error(e, 1) from e
+        except asyncio.CancelledError:
+            await asyncio.shield(stream.close())
+            raise
+
+    def _finish_stream(self, opened, constructed_prompt, llm_result, call_info):
+        """流结束后记录 token 用量并归还多预估的 TPM 额度."""
+        route, usage = opened.route, opened.usage
+        if usage is not None:
+            token_counter.observe(route.model, constructed_prompt, usage.prompt_tokens)
+            call_info["prompt_tokens"], call_info["completion_tokens"] = usage.prompt_tokens, usage.completion_tokens
+        else:
+            call_info["prompt_tokens"] = count_tokens(constructed_prompt, route.model)
+            call_info["completion_tokens"] = count_tokens(llm_result, route.model)
+        route.rate_limiter.refund(opened.estimated_tokens - call_info["prompt_tokens"] - call_info["completion_tokens"])
+
+    def _stream_api_call(self, constructed_prompt):
+        """
+        以流式方式调用 OpenAI API，逐段返回 LLM 生成的文本增量.
+
+        缓存命中时一次性返回完整结果；流结束后拼接好的完整结果会写入响应缓存 (只缓存主端点给出的结果).
+
+        Args:
+            constructed_prompt (str):  构建好的完整 Prompt.
+
+        Yields:
+            str:  LLM 返回的文本增量.
+
+        Raises:
+            TranslationServiceError: Prompt 过大、上游调用失败等. 收到首个增量之前的临时故障会自动重试，
+                重试用尽后改用备用端点；已经开始输出后中断的流不会重试.
+        """
+        import openai
+        logger.debug("Constructed prompt for OpenAI API (stream):\n%s", log_payload(constructed_prompt))
+        cache = get_response_cache()
+        start = time.perf_counter()
+        call_info = {"cache_hit": False}
+        ttft = None
+        try:
+            params = self._request_params(constructed_prompt)
+            key = self._cache_key(constructed_prompt, params) if cache is not None else None
+            if cache is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    call_info["cache_hit"] = True
+                    self._record_call(start, call_info, ttft=time.perf_counter() - start)
+                    yield cached
+                    return
+            opened = self.routing.call(
+                lambda route: self._open_stream(route, constructed_prompt, params), "first_token", self.__class__.__name__,
+                discard=_OpenedStream.close
             )
-            llm_result = response.choices[0].message.content
-            logger.debug(f"Raw LLM response: {llm_result}")
-            return llm_result
-        except Exception as e:
-            logger.error(f"Error calling OpenAI API from {self.__class__.__name__}: {e}", exc_info=True) # 在日志中包含类名
-            return f"Error calling OpenAI API: {e}"
+            call_info.update(opened.info)
+            parts = []
+            try:
+                for delta in opened.deltas():
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(delta)
+                    yield delta
+            except openai.OpenAIError as e:
+                raise to_upstream_error(e, 1) from e
+            finally:
+                opened.close()
+            llm_result = "".join(parts)
+            logger.debug("Raw LLM response (stream): %s", log_payload(llm_result))
+            self._finish_stream(opened, constructed_prompt, llm_result, call_info)
+            if cache is not None and call_info["primary"]:
+                cache.set(key, llm_result)
+        except TranslationServiceError as e:
+            logger.error("Error calling OpenAI API (stream) from %s: %s", self.__class__.__name__, e, exc_info=True)
+            self._record_call(start, call_info, ttft=ttft, error=e)
+            raise
+        self._record_call(start, call_info, ttft=ttft)
+
+    async def _stream_api_call_async(self, constructed_prompt):
+        """
+        _stream_api_call 的异步版本 (异步生成器)，缓存读写在线程池中执行.
 
-    def run_prompt(self, origin_text, **kwargs): # 基类的 run_prompt 方法 (模板方法)
+        Raises:
+            TranslationServiceError: 与 _stream_api_call 相同.
+        """
+        import openai
+        logger.debug("Constructed prompt for OpenAI API (stream):\n%s", log_payload(constructed_prompt))
+        cache = get_response_cache()
+        start = time.perf_counter()
+        call_info = {"cache_hit": False}
+        ttft = None
+        try:
+            params = self._request_params(constructed_prompt)
+            key = self._cache_key(constructed_prompt, params) if cache is not None else None
+            if cache is not None:
+                cached = await asyncio.to_thread(cache.get, key)
+                if cached is not None:
+                    call_info["cache_hit"] = True
+                    self._record_call(start, call_info, ttft=time.perf_counter() - start)
+                    yield cached
+                    return
+            opened = await self.routing.call_async(
+                lambda route: self._open_stream_async(route, constructed_prompt, params), "first_token", self.__class__.__name__,
+                discard=_AsyncOpenedStream.close
+            )
+            call_info.update(opened.info)
+            parts = []
+            try:
+                async for delta in opened.deltas():
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(delta)
+                    yield delta
+            except openai.OpenAIError as e:
+                raise to_upstream_error(e, 1) from e
+            finally:
+                await opened.close()
+            llm_result = "".join(parts)
+            logger.debug("Raw LLM response (stream): %s", log_payload(llm_result))
+            self._finish_stream(opened, constructed_prompt, llm_result, call_info)
+            if cache is not None and call_info["primary"]:
+                await asyncio.to_thread(cache.set, key, llm_result)
+        except TranslationServiceError as e:
+            logger.error("Error calling OpenAI API (stream) from %s: %s", self.__class__.__name__, e, exc_info=True)
+            self._record_call(start, call_info, ttft=ttft, error=e)
+            raise
+        self._record_call(start, call_info, ttft=ttft)
+
+    def build_prompt(self, *args):
         """
-        运行 Prompt 的模板方法，子类需要Override 此方法实现具体的 Prompt 处理逻辑.
+        构建完整 Prompt，子类需要Override 此方法，参数与子类的 run_prompt 相同.
         """
-        raise NotImplementedError("run_prompt 方法需要在子类中被Override 实现") # 抛出 NotImplementedError 异常，强制子类实现
+        raise NotImplementedError("build_prompt 方法需要在子类中被Override 实现")
 
-class ProperNounsSpottingService(BaseTranslationService): # ProperNounsSpottingService 继承自 BaseTranslationService
-    def __init__(self):
-        super().__init__(PROPER_NOUNS_SPOTTING_PROMPT) # 调用父类构造函数，并传入 Proper Nouns Spotting Prompt
+    # 调用前后的处理 (分块、本地回答、构建 Prompt、后处理) 由以下方法提供，参数与子类的 build_prompt 相同；
+    # run_prompt / stream_prompt / arun_prompt / astream_prompt 以及离线批量模式共用这些步骤，只在调用方式上不同.
 
-    def run_prompt(self, origin_text): # 实现子类特有的 run_prompt 方法
+    def chunk_args(self, *args):
         """
-        运行 Proper Nouns Spotting Prompt，调用 OpenAI API.
+        输入超出上下文预算时的分块.
+
+        Returns:
+            list[tuple] | None: 每个片段的 (调用参数, 追加在该片段结果之后的文本)；不需要分块时返回 None.
         """
-        logger.info("Running Proper Nouns Spotting Prompt with OpenAI API...")
-        logger.debug(f"Origin text: {origin_text}")
+        return None
 
-        if not self.api_key:
-            logger.error("OPENAI_API_KEY is not set. Cannot call OpenAI API.")
-            return "Error: OpenAI API Key is not configured. Please set OPENAI_API_KEY environment variable or in .env file."
+    def join_chunks(self, results):
+        """合并各片段的结果，results 为 (片段结果, 追加的文本) 列表，默认按顺序拼接."""
+        return "".join(result + suffix for result, suffix in results)
 
-        constructed_prompt = self.prompt.replace("{{origin_text}}", origin_text) # 构建特定于 Proper Nouns Spotting 的 Prompt
-        llm_result = self._run_api_call(constructed_prompt) # 复用基类的 _run_api_call 方法
+    def local_answer(self, *args):
+        """不调用 LLM 就能得到的结果 (如术语表可以回答、没有问题时跳过意译)，没有时返回 None."""
+        return None
 
-        return llm_result # 直接返回 LLM 结果 (假设 LLM 返回 Markdown 表格)
+    def postprocess(self, llm_result, *args):
+        """LLM 返回的完整结果的后处理 (如把新术语记入术语表)，返回该步骤的输出."""
+        return llm_result
 
-class StraightUpTranslationService(BaseTranslationService): # StraightUpTranslationService 继承自 BaseTranslationService
-    def __init__(self):
-        super().__init__(STRAIGHT_UP_TRANSLATION_PROMPT) # 调用父类构造函数，并传入 Straight-up Translation Prompt
+    postprocess_in_thread = False # 异步调用时 postprocess 是否在线程池中执行 (会读写文件等阻塞操作时设为 True)
+
+    def _prepare(self, *args):
+        """
+        四个入口共用的准备步骤.
+
+        Returns:
+            tuple: (分块, 本地结果, Prompt)，只有一个不为 None.
 
-    def run_prompt(self, origin_text, proper_nouns_table=""): # 实现子类特有的 run_prompt 方法
+        Raises:
+            ConfigurationError: 需要调用 API 但未配置 API Key.
         """
-        运行 Straight-up Translation Prompt, 调用 OpenAI API 进行直接翻译.
+        if logger.isEnabledFor(logging.DEBUG):
+            for name, value in zip(inspect.signature(self.build_prompt).parameters, args):
+                logger.debug("%s %s: %s", self.__class__.__name__, name, log_payload(value))
+        chunks = self.chunk_args(*args)
+        if chunks is not None:
+            logger.info("Origin text exceeds the token budget, splitting into %s chunks", len(chunks))
+            return chunks, None, None
+        local_result = self.local_answer(*args)
+        if local_result is not None:
+            return None, local_result, None
+        self.require_api_key()
+        return None, None, self.build_prompt(*args)
+
+    def run_prompt(self, *args):
         """
-        logger.info("Running Straight-up Translation Prompt with OpenAI API...")
-        logger.debug(f"Origin text: {origin_text}")
-        logger.debug(f"Proper nouns table:\n{proper_nouns_table}")
+        运行 Prompt，调用 OpenAI API.
 
-        if not self.api_key:
-            logger.error("OPENAI_API_KEY is not set. Cannot call OpenAI API.")
-            return "Error: OpenAI API Key is not configured. Please set OPENAI_API_KEY environment variable or in .env file."
+        输入超出上下文预算时分块运行后合并；local_answer 能回答时不调用 API；否则返回经过 postprocess 的 LLM 结果.
 
-        constructed_prompt = self.prompt.replace("{{origin_text}}", origin_text) # 构建特定于 Straight-up Translation 的 Prompt
-        constructed_prompt = constructed_prompt.replace("{{proper_nouns}}", proper_nouns_table)
-        llm_result = self._run_api_call(constructed_prompt) # 复用基类的 _run_api_call 方法
+        Raises:
+            TranslationServiceError: 未配置 API Key 或 API 调用失败.
+        """
+        logger.info("Running %s prompt with OpenAI API...", self.__class__.__name__)
+        chunks, local_result, constructed_prompt = self._prepare(*args)
+        if chunks is not None:
+            return self.join_chunks([(self.run_prompt(*chunk), suffix) for chunk, suffix in chunks])
+        if local_result is not None:
+            return local_result
+        return self.postprocess(self._run_api_call(constructed_prompt), *args)
+
+    def stream_prompt(self, *args):
+        """
+        以流式方式运行 Prompt，参数与子类的 run_prompt 相同.
 
-        return llm_result # 直接返回 LLM 结果 (假设 LLM 返回 纯文本)
+        Yields:
+            str:  LLM 返回的文本增量，依次用 apply_delta 拼接即为 run_prompt 的完整结果
+                (StreamReplacement 代替之前已拼接的文本，如专有名词表与术语表合并后的最终结果).
 
-class IssueSpottingService(BaseTranslationService): # IssueSpottingService 继承自 BaseTranslationService
-    def __init__(self):
-        super().__init__(ISSUE_SPOTTING_PROMPT) # 调用父类构造函数，并传入 Issue Spotting Prompt
+        Raises:
+            TranslationServiceError: 未配置 API Key 或 API 调用失败.
+        """
+        logger.info("Streaming %s prompt with OpenAI API...", self.__class__.__name__)
+        chunks, local_result, constructed_prompt = self._prepare(*args)
+        if chunks is not None:
+            joined = _ChunkedStream()
+            for chunk, suffix in chunks:
+                for delta in self.stream_prompt(*chunk):
+                    yield joined.feed(delta)
+                if suffix:
+                    yield suffix
+                joined.end_chunk(suffix)
+            replacement = joined.replacement(self.join_chunks(joined.results))
+        elif local_result is not None:
+            yield local_result
+            return
+        else:
+            parts = []
+            for delta in self._stream_api_call(constructed_prompt):
+                parts.append(delta)
+                yield delta
+            llm_result = "".join(parts)
+            replacement = _replacement(llm_result, self.postprocess(llm_result, *args))
+        if replacement is not None:
+            yield replacement
+
+    # 离线批量模式 (见 backend.services.batch)：Prompt 不直接发送，而是写入批量任务，结果取回后再用 postprocess 处理.
+
+    def batch_prompt(self, *args):
+        """
+        批量任务中的 Prompt.
 
-    def run_prompt(self, straight_up, origin_text, proper_nouns): # 实现子类特有的 run_prompt 方法，接收三个参数
+        Returns:
+            str | None: 构建好的 Prompt；输入需要分块 (超出上下文预算) 时返回 None，由批量模式改为直接调用 run_prompt.
         """
-        运行 Issue Spotting Prompt,  指出直接翻译存在的问题。
+        return self.build_prompt(*args) if self.chunk_args(*args) is None else None
 
-        Args:
-            straight_up (str): 直接翻译的结果
-            origin_text (str): 原始英文文本
-            proper_nouns (str): 专有名词表格 (Markdown 格式字符串)
+    def batch_request(self, constructed_prompt):
+        """
+        批量任务中一次请求的 body，与 _run_api_call 发送的请求相同 (使用主端点的模型).
 
         Returns:
-            str:  LLM 返回的 润色后的文本 结果.
+            tuple: (请求 body, 响应缓存 key).
+
+        Raises:
+            PromptTooLargeError: Prompt 超出模型上下文长度.
         """
-        logger.info("Running Issue Spotting Prompt with OpenAI API...")
-        logger.debug(f"Straight up translation: {straight_up}")
-        logger.debug(f"Origin text: {origin_text}")
-        logger.debug(f"Proper nouns: {proper_nouns}")
+        params = self._request_params(constructed_prompt)
+        body = {"model": self.model, "messages": [{"role": "user", "content": constructed_prompt}], **params}
+        return body, self._cache_key(constructed_prompt, params)
+
+    # 异步版本：在 Gradio 等事件循环中使用 AsyncOpenAI 客户端，等待 LLM 响应期间不占用线程，
+    # 大量并发请求可以共享同一个事件循环. 参数和返回值与对应的同步方法相同.
+
+    async def _apostprocess(self, llm_result, *args):
+        if self.postprocess_in_thread:
+            return await asyncio.to_thread(self.postprocess, llm_result, *args)
+        return self.postprocess(llm_result, *args)
+
+    async def arun_prompt(self, *args):
+        """run_prompt 的异步版本."""
+        logger.info("Running %s prompt with OpenAI API (async)...", self.__class__.__name__)
+        chunks, local_result, constructed_prompt = self._prepare(*args)
+        if chunks is not None:
+            return self.join_chunks([(await self.arun_prompt(*chunk), suffix) for chunk, suffix in chunks])
+        if local_result is not None:
+            return local_result
+        return await self._apostprocess(await self._run_api_call_async(constructed_prompt), *args)
+
+    async def astream_prompt(self, *args):
+        """stream_prompt 的异步版本 (异步生成器)."""
+        logger.info("Streaming %s prompt with OpenAI API (async)...", self.__class__.__name__)
+        chunks, local_result, constructed_prompt = self._prepare(*args)
+        if chunks is not None:
+            joined = _ChunkedStream()
+            for chunk, suffix in chunks:
+                async for delta in self.astream_prompt(*chunk):
+                    yield joined.feed(delta)
+                if suffix:
+                    yield suffix
+                joined.end_chunk(suffix)
+            replacement = joined.replacement(self.join_chunks(joined.results))
+        elif local_result is not None:
+            yield local_result
+            return
+        else:
+            parts = []
+            async for delta in self._stream_api_call_async(constructed_prompt):
+                parts.append(delta)
+                yield delta
+            llm_result = "".join(parts)
+            replacement = _replacement(llm_result, await self._apostprocess(llm_result, *args))
+        if replacement is not None:
+            yield replacement
+
+def _replacement(streamed, result):
+    """流式返回的文本与最终结果不同时，返回代替它的 StreamReplacement."""
+    return StreamReplacement(result) if result != streamed else None
+
+class _ChunkedStream:
+    """分块流式调用时拼接各片段的增量，片段内的 StreamReplacement 加上之前片段的文本后代替整体."""
+    def __init__(self):
+        self.text = "" # 之前片段 (含追加的文本) 拼接后的结果
+        self.piece = "" # 当前片段已返回的结果
+        self.results = [] # (片段结果, 追加的文本)
 
-        if not self.api_key:
-            logger.error("OPENAI_API_KEY is not set. Cannot call OpenAI API.")
-            return "Error: OpenAI API Key is not configured. Please set OPENAI_API_KEY environment variable or in .env file."
+    def feed(self, delta):
+        self.piece = apply_delta(self.piece, delta)
+        return StreamReplacement(self.text + delta) if isinstance(delta, StreamReplacement) else delta
 
-        constructed_prompt = self.prompt.replace("{{straight_up}}", straight_up) # 构建特定于 Issue Spotting 的 Prompt
-        constructed_prompt = constructed_prompt.replace("{{origin_text}}", origin_text)
-        constructed_prompt = constructed_prompt.replace("{{proper_nouns}}", proper_nouns)
+    def end_chunk(self, suffix):
+        self.results.append((self.piece, suffix))
+        self.text += self.piece + suffix
+        self.piece = ""
 
-        llm_result = self._run_api_call(constructed_prompt) # 复用基类的 _run_api_call 方法
-        return llm_result
+    def replacement(self, joined):
+        return _replacement(self.text, joined)
+
+class ProperNounsSpottingService(BaseTranslationService): # ProperNounsSpottingService 继承自 BaseTranslationService
+    """
+    Proper Nouns Spotting.
+
+    启用术语表时，如果原文中没有未知的候选术语，直接由术语表在本地生成结果，不调用 API；
+    否则调用 API，并把返回的新术语记入术语表，已知术语统一使用术语表中的译法
+    (流式调用先返回 LLM 的原始表格，结束后以 StreamReplacement 返回合并后的表格).
+    """
+    stop_sequences = ("<输入文本>", "<示例>") # 模型开始复述 Prompt 中的分段标签时停止生成
+    postprocess_in_thread = True # 术语表可能写回文件
+
+    def __init__(self):
+        super().__init__("proper_nouns_spotting") # 调用父类构造函数，并传入 Proper Nouns Spotting Prompt 模板名称
+
+    def build_prompt(self, origin_text):
+        """构建特定于 Proper Nouns Spotting 的 Prompt."""
+        return self.template.render(origin_text=origin_text)
+
+    def chunk_args(self, origin_text):
+        """原文超出上下文预算时分块识别，流式调用时各块的表格之间空一行."""
+        chunks = self._split_input(origin_text)
+        if len(chunks) == 1:
+            return None
+        return [((chunk,), "\n\n" if i < len(chunks) - 1 else "") for i, chunk in enumerate(chunks)]
+
+    def join_chunks(self, results):
+        """合并各块的表格 (按英文去重)."""
+        return merge_term_tables([table for table, _ in results])
+
+    def local_answer(self, origin_text):
+        """术语表能在本地回答时返回结果."""
+        glossary = get_glossary()
+        local_result = glossary.try_answer(origin_text) if glossary is not None else None
+        if local_result is not None:
+            logger.info("Proper nouns answered from glossary, skipping OpenAI API call.")
+        return local_result
+
+    def postprocess(self, llm_result, origin_text):
+        """把新术语记入术语表，已知术语统一使用术语表中的译法."""
+        glossary = get_glossary()
+        if glossary is not None:
+            merged = glossary.learn(origin_text, llm_result)
+            if merged:
+                return format_term_table(merged)
+        return llm_result # 直接返回 LLM 结果 (假设 LLM 返回 Markdown 表格)
+
+class StraightUpTranslationService(BaseTranslationService): # StraightUpTranslationService 继承自 BaseTranslationService
+    stop_sequences = ("<翻译前的原文>", "<专有名词>") # 模型开始复述 Prompt 中的分段标签时停止生成
+
+    def __init__(self):
+        super().__init__("straight_up_translation") # 调用父类构造函数，并传入 Straight-up Translation Prompt 模板名称
+
+    def build_prompt(self, origin_text, proper_nouns_table=""):
+        """构建特定于 Straight-up Translation 的 Prompt，专有名词表只保留原文中出现的术语."""
+        proper_nouns_table = prune_term_table(proper_nouns_table, origin_text)
+        return self.template.render(origin_text=origin_text, proper_nouns=proper_nouns_table)
+
+    def chunk_args(self, origin_text, proper_nouns_table=""):
+        """原文超出上下文预算时分块翻译，片段末尾的空白不交给模型，按原文的分隔拼接."""
+        chunks = self._split_input(origin_text, proper_nouns_table)
+        if len(chunks) == 1:
+            return None
+        return [((chunk.rstrip(), proper_nouns_table), chunk[len(chunk.rstrip()):]) for chunk in chunks]
+
+# 问题列表去掉空白、列表符号和标点后等于其中之一时，视为直接翻译没有问题
+CLEAN_ISSUE_MARKERS = {
+    "", "无", "没有", "无问题", "没有问题", "未发现问题", "没有发现问题", "未发现明显问题", "没有明显问题",
+    "none", "noissues", "noissue", "n/a", "na",
+}
+_ISSUE_NOISE_RE = re.compile(r"[\s\-*•·。.,，、!！:：;；()（）\[\]【】\"'“”‘’`]+")
+
+REVIEW_ISSUES_TAG = "<直接翻译的问题>"
+REVIEW_REVISION_TAG = "<意译>"
+
+def is_clean_issue_list(issues):
+    """判断问题识别的结果是否为空或只说明没有问题 (如 "无"、"没有问题"、"None")."""
+    if issues is None:
+        return False
+    return _ISSUE_NOISE_RE.sub("", issues).lower() in CLEAN_ISSUE_MARKERS
+
+def parse_review(text):
+    """
+    把 review_and_revise 模板的输出拆分为问题列表和修改后的译文.
+
+    Args:
+        text (str): LLM 返回的文本，格式为 "<直接翻译的问题>\n问题列表\n<意译>\n译文" (开头的标签可以省略).
+
+    Returns:
+        tuple: (问题列表, 修改后的译文). 输出为空时两者都是 None；没有 <意译> 部分 (如没有问题) 时译文为 None.
+    """
+    if not text or not text.strip():
+        return None, None
+    issues, tag, revision = text.partition(REVIEW_REVISION_TAG)
+    issues = issues.strip()
+    if issues.startswith(REVIEW_ISSUES_TAG):
+        issues = issues[len(REVIEW_ISSUES_TAG):].strip()
+    revision = revision.strip("\r\n") if tag else ""
+    return issues, revision if revision.strip() else None
+
+def join_issue_lists(issue_lists):
+    """合并分块识别的问题列表：没有问题的块不列出，所有块都没有问题时返回第一块的结果 (如 "无")."""
+    issues = [issue_list.strip() for issue_list in issue_lists if not is_clean_issue_list(issue_list)]
+    return "\n".join(issues) if issues else issue_lists[0]
+
+class IssueSpottingService(BaseTranslationService): # IssueSpottingService 继承自 BaseTranslationService
+    def __init__(self):
+        super().__init__("issue_spotting") # 调用父类构造函数，并传入 Issue Spotting Prompt 模板名称
+
+    def build_prompt(self, straight_up, origin_text, proper_nouns):
+        """构建特定于 Issue Spotting 的 Prompt，专有名词表只保留原文或直接翻译中出现的术语."""
+        proper_nouns = prune_term_table(proper_nouns, origin_text, straight_up)
+        return self.template.render(straight_up=straight_up, origin_text=origin_text, proper_nouns=proper_nouns)
+
+    def chunk_args(self, straight_up, origin_text, proper_nouns):
+        """原文和直接翻译超出上下文预算时按对齐的段落分块识别，流式调用时各块的问题列表之间换行."""
+        chunks = self._split_aligned(origin_text, straight_up, proper_nouns)
+        if chunks is None:
+            return None
+        return [((straight, origin, proper_nouns), "\n" if i < len(chunks) - 1 else "") for i, (origin, straight) in enumerate(chunks)]
+
+    def join_chunks(self, results):
+        """合并各块的问题列表."""
+        return join_issue_lists([issues for issues, _ in results])
 
 class LooseTranslationService(BaseTranslationService): # LooseTranslationService 继承自 BaseTranslationService
+    stop_sequences = ("<直接翻译>", "<原文>", "<专有名词>") # 模型开始复述 Prompt 中的分段标签时停止生成
+
     def __init__(self):
-        super().__init__(LOOSE_TRANSLATION_PROMPT) # 调用父类构造函数，并传入 Loose Translation Prompt
+        super().__init__("loose_translation") # 调用父类构造函数，并传入 Loose Translation Prompt 模板名称
+
+    def build_prompt(self, straight_up, issue_spotting_result, origin_text, proper_nouns):
+        """构建特定于 Loose Translation 的 Prompt，专有名词表只保留原文或直接翻译中出现的术语."""
+        proper_nouns = prune_term_table(proper_nouns, origin_text, straight_up)
+        return self.template.render(straight_up=straight_up, issue=issue_spotting_result, origin_text=origin_text, proper_nouns=proper_nouns)
 
-    def run_prompt(self, straight_up, issue_spotting_result, origin_text, proper_nouns): # 修改 run_prompt 方法，移除 last_translation_text 参数
+    def chunk_args(self, straight_up, issue_spotting_result, origin_text, proper_nouns):
         """
-        运行 Loose Translation Prompt,  进行意译，更准确传达原文含义。
+        原文和直接翻译超出上下文预算时按对齐的段落分块意译，每块都附上完整的问题列表，
+        片段末尾的空白不交给模型，按直接翻译的分隔拼接.
+        """
+        if REVISION_EARLY_EXIT and is_clean_issue_list(issue_spotting_result):
+            return None # 不调用 LLM，见 local_answer
+        chunks = self._split_aligned(origin_text, straight_up, f"{issue_spotting_result}\n{proper_nouns}")
+        if chunks is None:
+            return None
+        return [
+            ((straight.rstrip(), issue_spotting_result, origin.rstrip(), proper_nouns), straight[len(straight.rstrip()):])
+            for origin, straight in chunks
+        ]
+
+    def skip_revision(self, issue_spotting_result):
+        """
+        REVISION_EARLY_EXIT 开启且问题列表为空或只说明没有问题时跳过意译，直接使用直接翻译的结果 (不调用 API).
+        """
+        if REVISION_EARLY_EXIT and is_clean_issue_list(issue_spotting_result):
+            logger.info("No issues found in the straight-up translation, skipping Loose Translation API call.")
+            return True
+        return False
 
-        Args:
-            straight_up (str): 直接翻译的结果
-            issue_spotting_result (str): 问题识别结果
-            origin_text (str): 原始英文文本
-            proper_nouns (str): 专有名词表格 (Markdown 格式字符串)
+    def local_answer(self, straight_up, issue_spotting_result, origin_text, proper_nouns):
+        """没有问题时直接使用直接翻译的结果."""
+        return straight_up if self.skip_revision(issue_spotting_result) else None
 
-        Returns:
-            str:  LLM 返回的 意译 结果.
-        """
-        logger.info("Running Loose Translation Prompt with OpenAI API...")
-        logger.debug(f"Straight up translation: {straight_up}")
-        logger.debug(f"Issue spotting result: {issue_spotting_result}")
-        logger.debug(f"Origin text: {origin_text}")
-        logger.debug(f"Proper nouns: {proper_nouns}")
+class ReviewAndReviseService(BaseTranslationService):
+    """
+    用一次调用同时完成问题识别和意译 (review_and_revise 模板)，输出用 parse_review 拆分为两个步骤的结果.
 
-        if not self.api_key:
-            logger.error("OPENAI_API_KEY is not set. Cannot call OpenAI API.")
-            return "Error: OpenAI API Key is not configured. Please set OPENAI_API_KEY environment variable or in .env file."
+    与分开调用相比少一次往返，直接翻译、原文和专有名词表只发送一次；没有问题时模型只返回 "无"，不生成译文.
+    """
+    stop_sequences = ("<直接翻译>", "<原文>", "<专有名词>") # 模型开始复述 Prompt 中的分段标签时停止生成
 
-        constructed_prompt = self.prompt.replace("{{straight_up}}", straight_up) # 构建特定于 Loose Translation 的 Prompt
-        constructed_prompt = constructed_prompt.replace("{{issue}}", issue_spotting_result) # 使用 issue_spotting_result，变量名更清晰
-        constructed_prompt = constructed_prompt.replace("{{origin_text}}", origin_text)
-        constructed_prompt = constructed_prompt.replace("{{proper_nouns}}", proper_nouns)
+    def __init__(self):
+        super().__init__("review_and_revise")
 
-        llm_result = self._run_api_call(constructed_prompt) # 复用基类的 _run_api_call 方法
-        return llm_result
+    def build_prompt(self, straight_up, origin_text, proper_nouns):
+        """构建 Review and Revise 的 Prompt，专有名词表只保留原文或直接翻译中出现的术语."""
+        proper_nouns = prune_term_table(proper_nouns, origin_text, straight_up)
+        return self.template.render(straight_up=straight_up, origin_text=origin_text, proper_nouns=proper_nouns)
+
+    def chunk_args(self, straight_up, origin_text, proper_nouns):
+        """原文和直接翻译超出上下文预算时按对齐的段落分块调用，片段末尾的空白不交给模型."""
+        chunks = self._split_aligned(origin_text, straight_up, proper_nouns)
+        if chunks is None:
+            return None
+        return [((straight.rstrip(), origin.rstrip(), proper_nouns), straight[len(straight.rstrip()):]) for origin, straight in chunks]
+
+    def join_chunks(self, results):
+        """
+        合并各块的输出：问题列表用 join_issue_lists 合并；每一块都给出了修改后的译文时按直接翻译的分隔拼接译文，
+        否则只返回问题列表，意译步骤按合并后的问题列表单独调用 (见 pipeline._fused_revision).
+        """
+        reviews = [parse_review(result) for result, _ in results]
+        issues = join_issue_lists([issue_list or "" for issue_list, _ in reviews])
+        if any(revision is None for _, revision in reviews):
+            return issues
+        revision = "".join(revision.rstrip() + suffix for (_, revision), (_, suffix) in zip(reviews, results))
+        return f"{REVIEW_ISSUES_TAG}\n{issues}\n{REVIEW_REVISION_TAG}\n{revision}"
 
 if __name__ == '__main__':
     # 单元测试 (可选)
@@ -0,0 +1,106 @@
+# benchmarks/bench_import_time.py
+"""
+冷启动导入耗时测试：在全新的子进程中用 python -X importtime 导入各个模块，报告累计导入耗时的中位数和被连带导入的重量级依赖.
+
+后端模块 (命令行工具、流水线、Service) 按需导入 openai SDK、numpy 和 gradio；默认检查 backend.* 导入后没有加载这些包，
+违反时 (或超过 --max-ms 预算时) 以退出码 1 结束，可以放在 CI 中防止冷启动时间回退.
+
+示例:
+    python -m benchmarks.bench_import_time
+    python -m benchmarks.bench_import_time --modules backend.cli,app --repeat 5 --max-ms 300
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = "backend.config,backend.services.translation_service,backend.services.pipeline,backend.cli"
+HEAVY_PACKAGES = ("openai", "httpx", "httpx2", "pydantic", "numpy", "tiktoken", "gradio")
+FORBIDDEN_IN_BACKEND = ("openai", "numpy", "gradio") # backend.* 导入时不应加载的包
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure(module):
+    """
+    在新进程中导入 module 一次.
+
+    Returns:
+        tuple: (累计导入毫秒数, 已加载的重量级依赖列表).
+    """
+    script = f"import sys, {module}; print(','.join(p for p in {HEAVY_PACKAGES!r} if p in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        # 格式: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1]) / 1000.0
+    if cumulative is None:
+        raise RuntimeError(f"No importtime entry for {module}")
+    loaded = [package for package in proc.stdout.strip().split(",") if package]
+    return cumulative, loaded
+
+def run_module(module, repeat):
+    timings, loaded = [], set()
+    for _ in range(repeat):
+        ms, packages = measure(module)
+        timings.append(ms)
+        loaded.update(packages)
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(timings), 1),
+        "min_ms": round(min(timings), 1),
+        "max_ms": round(max(timings), 1),
+        "loaded": sorted(loaded),
+    }
+
+def check(result, max_ms):
+    """返回违反约束的说明列表."""
+    problems = []
+    if result["module"].startswith("backend."):
+        forbidden = [package for package in result["loaded"] if package in FORBIDDEN_IN_BACKEND]
+        if forbidden:
+            problems.append(f"{result['module']} imports {', '.join(forbidden)}")
+    if max_ms and result["median_ms"] > max_ms:
+        problems.append(f"{result['module']} takes {result['median_ms']}ms (budget {max_ms}ms)")
+    return problems
+
+def format_report(results):
+    header = ["module", "median", "min", "max", "heavy packages loaded"]
+    lines = [" | ".join(header), " | ".join("---" for _ in header)]
+    for r in results:
+        lines.append(" | ".join((r["module"], f"{r['median_ms']}ms", f"{r['min_ms']}ms", f"{r['max_ms']}ms", ", ".join(r["loaded"]) or "-")))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="测量各模块在新进程中的冷启动导入耗时，检查后端模块没有导入重量级依赖")
+    parser.add_argument("--modules", default=DEFAULT_MODULES, help="逗号分隔的模块名 (如加上 app 测量界面的启动)")
+    parser.add_argument("--repeat", type=int, default=5, help="每个模块导入的次数，报告中位数")
+    parser.add_argument("--max-ms", type=float, default=0, help="累计导入耗时的上限 (毫秒)，0 表示不检查")
+    parser.add_argument("--output", default=None, help="把结果保存为 JSON")
+    args = parser.parse_args()
+
+    results, problems = [], []
+    for module in (value.strip() for value in args.modules.split(",") if value.strip()):
+        print(f"Importing {module} x{args.repeat}...", file=sys.stderr)
+        result = run_module(module, args.repeat)
+        results.append(result)
+        problems.extend(check(result, args.max_ms))
+    print(format_report(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if problems:
+        for problem in problems:
+            print(f"FAIL: {problem}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
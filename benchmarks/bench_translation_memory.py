@@ -0,0 +1,155 @@
+# benchmarks/bench_translation_memory.py
+"""
+翻译记忆索引的规模测试：在 1 万到 10 万以上条目上测量写入、加载和查询的耗时以及近似重复的召回率.
+
+语料是随机词表生成的句子；近似重复的查询把已有句子中的一两个词替换掉，不相关的查询是新生成的句子.
+同时测量逐条比较全部签名的线性扫描作为对照.
+
+示例:
+    python -m benchmarks.bench_translation_memory --sizes 10000,100000 --queries 500
+    python -m benchmarks.bench_translation_memory --sizes 200000 --output tm.json
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+from benchmarks.run_benchmark import percentile, peak_rss_mb
+from backend.config import TRANSLATION_MEMORY_REFERENCE_THRESHOLD
+from backend.services.translation_memory import TranslationMemory, normalize_text, jaccard
+
+def make_vocabulary(rng, size=5000):
+    return ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+def make_sentence(rng, vocabulary):
+    words = [rng.choice(vocabulary) for _ in range(rng.randint(12, 30))]
+    return " ".join(words).capitalize() + "."
+
+def mutate(rng, sentence, vocabulary, changes):
+    """把句子中的 changes 个词替换为随机词，模拟只有少量差异的样板句."""
+    words = sentence.split()
+    for i in rng.sample(range(len(words)), changes):
+        words[i] = rng.choice(vocabulary)
+    return " ".join(words)
+
+def timed_lookups(memory, queries, threshold):
+    latencies, matches = [], []
+    for text in queries:
+        start = time.perf_counter()
+        matches.append(memory.lookup(text, threshold))
+        latencies.append(time.perf_counter() - start)
+    return latencies, matches
+
+def timed_scans(memory, queries, threshold):
+    """线性扫描全部签名，返回延迟和找到的位置."""
+    latencies, found = [], []
+    index = memory.index
+    for text in queries:
+        start = time.perf_counter()
+        signature = index.signature(normalize_text(text))
+        found.append([position for position, _ in index.scan(signature, threshold - memory.ESTIMATE_SLACK, memory.CANDIDATES)])
+        latencies.append(time.perf_counter() - start)
+    return latencies, found
+
+def run_size(size, args, rng, vocabulary):
+    sources = [make_sentence(rng, vocabulary) for _ in range(size)]
+    pairs = [(source, f"译文 {i}") for i, source in enumerate(sources)]
+    targets = rng.sample(range(size), min(args.queries, size))
+    near = [mutate(rng, sources[i], vocabulary, rng.randint(1, args.max_changes)) for i in targets]
+    fresh = [make_sentence(rng, vocabulary) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tm.sqlite3")
+        memory = TranslationMemory(path, args.num_perm, args.bands)
+        start = time.perf_counter()
+        for offset in range(0, size, args.batch):
+            memory.add_many(pairs[offset:offset + args.batch])
+        build = time.perf_counter() - start
+        memory.close()
+
+        start = time.perf_counter()
+        memory = TranslationMemory(path, args.num_perm, args.bands)
+        load = time.perf_counter() - start
+        db_mb = os.path.getsize(path) / (1024 * 1024)
+
+        near_latencies, near_matches = timed_lookups(memory, near, args.threshold)
+        fresh_latencies, fresh_matches = timed_lookups(memory, fresh, args.threshold)
+        scan_count = min(len(near), args.scan_queries)
+        scan_latencies, scan_found = timed_scans(memory, near[:scan_count], args.threshold)
+
+        add_latencies = []
+        for _ in range(min(200, args.queries)):
+            source = make_sentence(rng, vocabulary)
+            start = time.perf_counter()
+            memory.add(source, "译文")
+            add_latencies.append(time.perf_counter() - start)
+
+        shingles = memory.index.shingles
+        eligible = [k for k, i in enumerate(targets) if jaccard(shingles(normalize_text(sources[i])), shingles(normalize_text(near[k]))) >= args.threshold]
+        found = sum(1 for k in eligible if near_matches[k] is not None and near_matches[k].source == sources[targets[k]])
+        scan_eligible = [k for k in eligible if k < scan_count]
+        scan_hits = sum(1 for k in scan_eligible if targets[k] in scan_found[k])
+        index_mb = memory.index.nbytes / (1024 * 1024)
+        memory.close()
+
+    return {
+        "entries": size,
+        "build_s": round(build, 3),
+        "build_per_s": round(size / build, 1),
+        "load_s": round(load, 3),
+        "db_mb": round(db_mb, 1),
+        "index_mb": round(index_mb, 1),
+        "add_p50_ms": round(percentile(add_latencies, 50) * 1000, 3),
+        "near_p50_ms": round(percentile(near_latencies, 50) * 1000, 3),
+        "near_p99_ms": round(percentile(near_latencies, 99) * 1000, 3),
+        "fresh_p50_ms": round(percentile(fresh_latencies, 50) * 1000, 3),
+        "fresh_p99_ms": round(percentile(fresh_latencies, 99) * 1000, 3),
+        "scan_p50_ms": round(percentile(scan_latencies, 50) * 1000, 3),
+        "eligible": len(eligible), # 与原句的实际相似度不低于 threshold 的近似重复查询数
+        "recall": round(found / max(1, len(eligible)), 4),
+        "scan_recall": round(scan_hits / max(1, len(scan_eligible)), 4),
+        "false_positives": sum(1 for match in fresh_matches if match is not None),
+        "rss_mb": round(peak_rss_mb(), 1),
+    }
+
+def format_report(results):
+    header = ["entries", "build/s", "load s", "index MB", "near p50", "near p99", "fresh p50", "scan p50", "recall", "scan recall", "false +"]
+    lines = [" | ".join(header), " | ".join("---" for _ in header)]
+    for r in results:
+        lines.append(" | ".join(str(value) for value in (
+            r["entries"], r["build_per_s"], r["load_s"], r["index_mb"], f"{r['near_p50_ms']}ms", f"{r['near_p99_ms']}ms",
+            f"{r['fresh_p50_ms']}ms", f"{r['scan_p50_ms']}ms", r["recall"], r["scan_recall"], r["false_positives"],
+        )))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="测量翻译记忆索引在不同条目数下的写入、加载和查询性能")
+    parser.add_argument("--sizes", default="10000,100000", help="逗号分隔的条目数")
+    parser.add_argument("--queries", type=int, default=500, help="每种查询的次数")
+    parser.add_argument("--scan-queries", type=int, default=100, help="线性扫描对照的查询次数")
+    parser.add_argument("--max-changes", type=int, default=2, help="近似重复的查询最多替换的词数")
+    parser.add_argument("--threshold", type=float, default=TRANSLATION_MEMORY_REFERENCE_THRESHOLD, help="查询的相似度下限")
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=5000, help="写入时每个事务的条目数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="把结果保存为 JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(rng)
+    results = []
+    for size in (int(value) for value in args.sizes.split(",") if value.strip()):
+        print(f"Building translation memory with {size} entries...", file=sys.stderr)
+        results.append(run_size(size, args, rng, vocabulary))
+    print(format_report(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
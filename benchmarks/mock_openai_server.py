@@ -0,0 +1,229 @@
+# benchmarks/mock_openai_server.py
+"""
+本地的 OpenAI 兼容模拟服务，只实现 POST /v1/chat/completions (含 stream=True)，用于离线压测.
+
+可以配置首 token 延迟、每秒输出 token 数、输出长度以及错误注入比例，
+不消耗真实 API 额度即可测量流水线的吞吐和延迟. 问题识别和合并调用 (review_and_revise) 的回复格式与真实模型一致，
+可以按比例回答 "无" 模拟没有问题的直接翻译.
+
+单独运行:
+    python -m benchmarks.mock_openai_server --port 8765 --latency 0.2 --tokens-per-second 80
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORD = "lorem " # 约 1 token
+ISSUES_TAG = "<直接翻译的问题>" # 问题识别和合并调用的 Prompt 以该标签结尾
+REVISION_TAG = "<意译>" # 合并调用的回复中译文部分的标签
+
+class MockConfig:
+    """模拟服务的行为参数."""
+    def __init__(self, latency=0.2, jitter=0.05, tokens_per_second=100.0, output_tokens=120, error_rate=0.0, error_status=429, retry_after=0.1, seed=None, slow_rate=0.0, slow_latency=2.0, clean_rate=0.0):
+        """
+        构造函数.
+
+        Args:
+            latency (float): 首 token 前的固定延迟 (秒)，模拟排队和 prefill.
+            jitter (float): 延迟的随机波动上限 (秒).
+            tokens_per_second (float): 输出速度，<=0 表示瞬间输出.
+            output_tokens (int): 每次回复的输出 token 数，为 max_tokens 所限.
+            error_rate (float): 按此比例返回 error_status.
+            error_status (int): 注入的错误状态码 (如 429、500、503).
+            retry_after (float): 注入 429 / 503 时 Retry-After 响应头的秒数，<=0 表示不返回.
+            seed (int): 随机种子，用于复现错误注入序列.
+            slow_rate (float): 按此比例在首 token 前额外等待 slow_latency 秒，模拟长尾延迟.
+            slow_latency (float): 慢请求的额外延迟 (秒).
+            clean_rate (float): 问题识别和合并调用按此比例回答 "无" (直接翻译没有问题).
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.clean_rate = clean_rate
+
+    def reply_pieces(self, prompt, completion_tokens):
+        """
+        生成回复的文本增量.
+
+        问题识别和合并调用按 clean_rate 只回答 "无"；合并调用的回复由问题列表和 <意译> 部分组成，其余 Prompt 回复 completion_tokens 个词.
+        """
+        if prompt.rstrip().endswith(ISSUES_TAG):
+            if self.clean_rate > 0 and self.random.random() < self.clean_rate:
+                return ["无"]
+            if REVISION_TAG in prompt:
+                issues = max(1, completion_tokens // 2)
+                return [WORD] * issues + [f"\n{REVISION_TAG}\n"] + [WORD] * max(1, completion_tokens - issues)
+        return [WORD] * completion_tokens
+
+class MockStats:
+    """服务端计数，线程安全."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def add(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: getattr(self, name) for name in ("requests", "errors", "prompt_tokens", "completion_tokens", "max_in_flight")}
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # 支持 keep-alive，与真实服务一致地复用连接
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        encoded = data.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(encoded), encoded))
+        self.wfile.flush()
+
+    def do_POST(self):
+        config, stats = self.server.config, self.server.stats
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        stats.add(requests=1, in_flight=1)
+        try:
+            if config.error_rate > 0 and config.random.random() < config.error_rate:
+                stats.add(errors=1)
+                headers = {"Retry-After": str(config.retry_after)} if config.retry_after > 0 and config.error_status in (429, 503) else {}
+                self._send_json(config.error_status, {"error": {"message": "Injected error", "type": "mock_error"}}, headers)
+                return
+
+            prompt = "".join(str(message.get("content", "")) for message in request.get("messages", []))
+            prompt_tokens = max(1, len(prompt) // 4)
+            max_tokens = request.get("max_tokens") or request.get("max_completion_tokens") or config.output_tokens
+            pieces = config.reply_pieces(prompt, max(1, min(config.output_tokens, int(max_tokens))))
+            completion_tokens = len(pieces)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+            model = request.get("model", "mock-model")
+            delay = config.latency + (config.random.uniform(0, config.jitter) if config.jitter > 0 else 0)
+            if config.slow_rate > 0 and config.random.random() < config.slow_rate:
+                delay += config.slow_latency
+            time.sleep(delay)
+            token_interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+            if request.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for piece in pieces:
+                    chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    self._write_chunk("data: " + json.dumps(chunk) + "\n\n")
+                    if token_interval:
+                        time.sleep(token_interval)
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": [], "usage": usage}
+                    self._write_chunk("data: " + json.dumps(chunk) + "\n\n")
+                self._write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            else:
+                time.sleep(token_interval * completion_tokens)
+                self._send_json(200, {
+                    "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+            stats.add(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        finally:
+            stats.add(in_flight=-1)
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 1024 # 默认的监听队列只有 5，高并发压测时连接会被拒绝
+    daemon_threads = True
+
+class MockOpenAIServer:
+    """在后台线程中运行的模拟服务."""
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        """
+        构造函数.
+
+        Args:
+            config (MockConfig): 行为参数.
+            host (str): 监听地址.
+            port (int): 监听端口，0 表示自动分配.
+        """
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self._server = _Server((host, port), _Handler)
+        self._server.config = self.config
+        self._server.stats = self.stats
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="首 token 延迟 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="延迟随机波动上限 (秒)")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="输出速度，<=0 表示瞬间输出")
+    parser.add_argument("--output-tokens", type=int, default=120, help="每次回复的输出 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="错误注入比例 (0~1)")
+    parser.add_argument("--error-status", type=int, default=429, help="注入的错误状态码")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="429 / 503 的 Retry-After 秒数")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="额外变慢的请求比例 (0~1)，模拟长尾延迟")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="慢请求的额外延迟 (秒)")
+    parser.add_argument("--clean-rate", type=float, default=0.0, help="问题识别回答 \"无\" 的比例 (0~1)")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.jitter, args.tokens_per_second, args.output_tokens, args.error_rate, args.error_status, args.retry_after, args.seed, args.slow_rate, args.slow_latency, args.clean_rate)
+    server = MockOpenAIServer(config, args.host, args.port).start()
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
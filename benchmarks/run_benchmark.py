@@ -0,0 +1,330 @@
+# benchmarks/run_benchmark.py
+"""
+离线压测：启动本地模拟服务，把 OPENAI_API_BASE 指向它，在不同并发下驱动四个 Service 和完整流水线.
+
+报告每个场景的 p50 / p95 / p99 延迟、请求数 / 秒、输出 token 数 / 秒、错误数以及进程内存，
+可以用 --output 保存为 JSON，并用 --baseline 与之前的结果对比.
+
+示例:
+    python -m benchmarks.run_benchmark --concurrency 1,4,16 --requests 32 --output bench.json
+    python -m benchmarks.run_benchmark --baseline bench.json --error-rate 0.05
+    python -m benchmarks.run_benchmark --slow-rate 0.05 --slow-latency 3 --hedge
+    python -m benchmarks.run_benchmark --concurrency 64,256 --requests 256 --stream --async --no-pipeline
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_openai_server import MockConfig, MockOpenAIServer
+
+SAMPLE_PARAGRAPH = (
+    "Large Language Models use the Transformer architecture and attention to generate text token by token. "
+    "Prompt Engineering and Retrieval-Augmented Generation help the model follow instructions and cite sources. "
+)
+SAMPLE_TABLE = "| 英文 | 中文 |\n| --- | --- |\n| Transformer | Transformer |\n| Prompt Engineering | 提示工程 |\n"
+
+def percentile(values, q):
+    """线性插值分位数，q 取 0~100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def peak_rss_mb():
+    """进程的峰值常驻内存 (MB)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # macOS 单位为字节，Linux 为 KB
+
+def configure_environment(base_url, args):
+    """在导入 backend 之前设置环境变量 (backend.config 在导入时读取配置)."""
+    os.environ["OPENAI_API_BASE"] = base_url
+    os.environ["OPENAI_API_KEY"] = os.environ.get("BENCHMARK_API_KEY", "benchmark-key")
+    os.environ.setdefault("OPENAI_MODEL", "gpt-3.5-turbo")
+    os.environ["RESPONSE_CACHE_ENABLED"] = "true" if args.cache else "false" # 默认关闭缓存，测量的是真实调用路径
+    os.environ["GLOSSARY_ENABLED"] = "true" if args.glossary else "false"
+    os.environ["TRANSLATION_MEMORY_ENABLED"] = "false" # 各场景的输入只有编号不同，翻译记忆会让流水线跳过大部分调用
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("RETRY_BASE_DELAY", "0.05")
+    if args.hedge_base_url:
+        os.environ["MODEL_ROUTING_PATH"] = write_hedge_routing(base_url, args.hedge_base_url, os.environ["OPENAI_MODEL"])
+    else:
+        os.environ["MODEL_ROUTING_PATH"] = "" # 不使用本地的路由配置，所有请求都发往被测服务
+
+def write_hedge_routing(base_url, backup_base_url, model):
+    """生成所有阶段都以 backup_base_url 作为对冲端点的路由配置文件，返回文件路径."""
+    routing = {"default": {
+        "routes": [{"model": model, "api_base": base_url}, {"model": model, "api_base": backup_base_url}],
+        "hedge": {"percentile": 0.9, "min_delay": 0.05, "initial_delay": 1.0, "min_samples": 10},
+    }}
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+        json.dump(routing, f)
+    return f.name
+
+def completion_tokens_served(servers):
+    """已输出的 token 总数：内置模拟服务直接计数，外部服务使用 backend 指标中记录的 usage."""
+    if servers:
+        return sum(server.stats.snapshot()["completion_tokens"] for server in servers)
+    from backend.services.metrics import metrics
+    return sum(entry["completion_tokens"] for entry in metrics.summary()["llm"].values())
+
+def sample_inputs(count, run_id):
+    """生成互不相同的输入，避免并发的相同请求被合并."""
+    return [f"[{run_id}-{i}] {SAMPLE_PARAGRAPH}" for i in range(count)]
+
+def service_args(name, text):
+    """按 Service 的 run_prompt 签名组装参数."""
+    straight_up = "大型语言模型使用 Transformer 架构逐个生成 token。"
+    if name == "ProperNounsSpottingService":
+        return (text,)
+    if name == "StraightUpTranslationService":
+        return (text, SAMPLE_TABLE)
+    if name == "IssueSpottingService":
+        return (straight_up, text, SAMPLE_TABLE)
+    return (straight_up, "1. 术语不一致", text, SAMPLE_TABLE)
+
+class ScenarioResult:
+    """一个压测场景的统计结果."""
+    def __init__(self, name, concurrency, latencies, ttfts, errors, wall, completion_tokens, rss_mb, heap_peak_mb):
+        self.name = name
+        self.concurrency = concurrency
+        self.latencies = latencies
+        self.ttfts = ttfts
+        self.errors = errors
+        self.wall = wall
+        self.completion_tokens = completion_tokens
+        self.rss_mb = rss_mb
+        self.heap_peak_mb = heap_peak_mb
+
+    @property
+    def key(self):
+        return f"{self.name}@{self.concurrency}"
+
+    def to_dict(self):
+        count = len(self.latencies)
+        return {
+            "name": self.name,
+            "concurrency": self.concurrency,
+            "requests": count,
+            "errors": self.errors,
+            "p50": percentile(self.latencies, 50),
+            "p95": percentile(self.latencies, 95),
+            "p99": percentile(self.latencies, 99),
+            "ttft_p50": percentile(self.ttfts, 50) if self.ttfts else None,
+            "requests_per_second": count / self.wall if self.wall else 0.0,
+            "tokens_per_second": self.completion_tokens / self.wall if self.wall else 0.0,
+            "wall_seconds": self.wall,
+            "peak_rss_mb": self.rss_mb,
+            "heap_peak_mb": self.heap_peak_mb,
+        }
+
+def _timed_call(service, name, text, stream):
+    """执行一次 Service 调用，返回 (延迟, 首 token 时间, 是否出错)."""
+    from backend.services.errors import TranslationServiceError
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if stream:
+            for _ in service.stream_prompt(*service_args(name, text)):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+        else:
+            service.run_prompt(*service_args(name, text))
+    except TranslationServiceError:
+        return time.perf_counter() - start, ttft, True
+    return time.perf_counter() - start, ttft, False
+
+async def _timed_call_async(service, name, text, stream, semaphore):
+    """_timed_call 的异步版本，semaphore 限制同时进行的调用数."""
+    from backend.services.errors import TranslationServiceError
+    async with semaphore:
+        start = time.perf_counter()
+        ttft = None
+        try:
+            if stream:
+                async for _ in service.astream_prompt(*service_args(name, text)):
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+            else:
+                await service.arun_prompt(*service_args(name, text))
+        except TranslationServiceError:
+            return time.perf_counter() - start, ttft, True
+        return time.perf_counter() - start, ttft, False
+
+async def _gather_async(service, name, inputs, stream, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(_timed_call_async(service, name, text, stream, semaphore) for text in inputs))
+
+def run_service_scenario(service_cls, concurrency, requests, stream, servers, trace_memory, use_async=False):
+    """在给定并发下调用某个 Service requests 次，use_async 时在一个事件循环中使用异步接口，否则每个并发占用一个线程."""
+    from backend.services.registry import get_service
+    service = get_service(service_cls)
+    name = service_cls.__name__
+    inputs = sample_inputs(requests, f"{name}-{concurrency}-{time.monotonic_ns()}")
+    before = completion_tokens_served(servers)
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if use_async:
+        outcomes = asyncio.run(_gather_async(service, name, inputs, stream, concurrency))
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(lambda text: _timed_call(service, name, text, stream), inputs))
+    wall = time.perf_counter() - start
+    heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+    tokens = completion_tokens_served(servers) - before
+    return ScenarioResult(
+        f"{name}{' (stream)' if stream else ''}{' (async)' if use_async else ''}", concurrency,
+        [latency for latency, _, _ in outcomes], [ttft for _, ttft, _ in outcomes if ttft is not None],
+        sum(1 for _, _, error in outcomes if error), wall, tokens, peak_rss_mb(), heap_peak
+    )
+
+def run_pipeline_scenario(concurrency, segments, servers, trace_memory, fused=False):
+    """
+    用每个阶段并发上限为 concurrency 的流水线翻译 segments 个片段，延迟为每个片段从开始到完成的时间.
+
+    fused 为 True 时问题识别和意译使用合并调用 (FUSED_STAGES).
+    """
+    from backend.services.pipeline import TranslationPipeline, DEFAULT_STAGES, FUSED_STAGES
+    stages = FUSED_STAGES if fused else DEFAULT_STAGES
+    pipeline = TranslationPipeline(stages, concurrency={stage.name: concurrency for stage in stages})
+    inputs = sample_inputs(segments, f"pipeline-{concurrency}-{time.monotonic_ns()}")
+    before = completion_tokens_served(servers)
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    try:
+        for result in pipeline.run_iter(inputs):
+            latencies.append(time.perf_counter() - start)
+            errors += 0 if result.ok else 1
+    finally:
+        pipeline.shutdown()
+    wall = time.perf_counter() - start
+    heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+    tokens = completion_tokens_served(servers) - before
+    return ScenarioResult(f"TranslationPipeline{' (fused)' if fused else ''}", concurrency, latencies, [], errors, wall, tokens, peak_rss_mb(), heap_peak)
+
+def format_report(results, baseline=None):
+    """渲染为对齐的文本表格，有 baseline 时附加 p95 和吞吐的变化百分比."""
+    header = f"{'scenario':<42}{'conc':>5}{'reqs':>6}{'err':>5}{'p50':>8}{'p95':>8}{'p99':>8}{'ttft':>8}{'req/s':>9}{'tok/s':>10}{'rss MB':>9}"
+    if baseline:
+        header += f"{'Δp95':>9}{'Δreq/s':>9}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        row = result.to_dict()
+        line = (f"{row['name']:<42}{row['concurrency']:>5}{row['requests']:>6}{row['errors']:>5}"
+                f"{row['p50']:>8.3f}{row['p95']:>8.3f}{row['p99']:>8.3f}"
+                f"{(format(row['ttft_p50'], '.3f') if row['ttft_p50'] is not None else '-'):>8}"
+                f"{row['requests_per_second']:>9.2f}{row['tokens_per_second']:>10.1f}{row['peak_rss_mb']:>9.1f}")
+        previous = (baseline or {}).get(result.key)
+        if previous:
+            delta = lambda new, old: f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            line += f"{delta(row['p95'], previous['p95']):>9}{delta(row['requests_per_second'], previous['requests_per_second']):>9}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="使用本地模拟服务压测四个 Service 和完整流水线")
+    parser.add_argument("--base-url", default=None, help="使用已运行的 OpenAI 兼容服务，而不是启动内置模拟服务")
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发级别")
+    parser.add_argument("--requests", type=int, default=32, help="每个 Service 场景的请求数")
+    parser.add_argument("--segments", type=int, default=16, help="流水线场景的片段数")
+    parser.add_argument("--services", default="all", help="逗号分隔的 Service 类名，或 all / none")
+    parser.add_argument("--no-pipeline", action="store_true", help="跳过流水线场景")
+    parser.add_argument("--stream", action="store_true", help="Service 场景使用 stream_prompt 并统计首 token 时间")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Service 场景在一个事件循环中使用 arun_prompt / astream_prompt，而不是每个并发一个线程")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟服务的首 token 延迟 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="额外变慢的请求比例，模拟长尾延迟")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="慢请求的额外延迟 (秒)")
+    parser.add_argument("--clean-rate", type=float, default=0.0, help="模拟服务的问题识别回答 \"无\" 的比例，用于测量跳过意译的效果")
+    parser.add_argument("--fused", action="store_true", help="流水线场景把问题识别和意译合并为一次调用")
+    parser.add_argument("--hedge", action="store_true", help="再启动一个模拟服务作为备用端点，并为所有步骤开启对冲请求")
+    parser.add_argument("--cache", action="store_true", help="启用响应缓存 (默认关闭)")
+    parser.add_argument("--glossary", action="store_true", help="启用术语表 (默认关闭)")
+    parser.add_argument("--trace-memory", action="store_true", help="用 tracemalloc 统计 Python 堆峰值 (会降低吞吐)")
+    parser.add_argument("--output", default=None, help="把结果保存为 JSON")
+    parser.add_argument("--baseline", default=None, help="与之前保存的 JSON 结果对比")
+    args = parser.parse_args()
+
+    server = backup = None
+    base_url = args.base_url
+    mock_config = lambda seed: MockConfig(args.latency, args.jitter, args.tokens_per_second, args.output_tokens, args.error_rate,
+                                          args.error_status, args.retry_after, seed, args.slow_rate, args.slow_latency, args.clean_rate)
+    if base_url is None:
+        server = MockOpenAIServer(mock_config(args.seed)).start()
+        base_url = server.base_url
+    args.hedge_base_url = None
+    if args.hedge:
+        backup = MockOpenAIServer(mock_config(args.seed + 1)).start() # 备用端点的慢请求与主端点相互独立
+        args.hedge_base_url = backup.base_url
+    configure_environment(base_url, args)
+    servers = [mock for mock in (server, backup) if mock is not None] if server is not None else []
+
+    from backend.services.translation_service import ProperNounsSpottingService, StraightUpTranslationService, IssueSpottingService, LooseTranslationService
+    service_classes = [ProperNounsSpottingService, StraightUpTranslationService, IssueSpottingService, LooseTranslationService]
+    if args.services == "none":
+        service_classes = []
+    elif args.services != "all":
+        wanted = {name.strip() for name in args.services.split(",")}
+        service_classes = [cls for cls in service_classes if cls.__name__ in wanted]
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    print(f"Benchmarking against {base_url} (threads at start: {threading.active_count()})")
+    results = []
+    for service_cls in service_classes:
+        for level in levels:
+            results.append(run_service_scenario(service_cls, level, args.requests, args.stream, servers, args.trace_memory, args.use_async))
+            print(f"  done: {results[-1].key}")
+    if not args.no_pipeline:
+        for level in levels:
+            results.append(run_pipeline_scenario(level, args.segments, servers, args.trace_memory, args.fused))
+            print(f"  done: {results[-1].key}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+    print()
+    print(format_report(results, baseline))
+
+    if args.output:
+        payload = {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "settings": vars(args),
+            "results": {result.key: result.to_dict() for result in results},
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"\nResults saved to {args.output}")
+    if server is not None:
+        server.stop()
+    if backup is not None:
+        backup.stop()
+
+if __name__ == "__main__":
+    main()
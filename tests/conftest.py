@@ -0,0 +1,27 @@
+# tests/conftest.py
+"""
+测试环境配置.
+
+backend.config 在导入时读取环境变量，这里在任何测试模块导入 backend 之前设置：
+不访问真实 API，不启动指标服务，关闭持久化的缓存、术语表和翻译记忆 (需要时由测试自己创建).
+"""
+import os
+import tempfile
+
+_TEST_DIR = tempfile.mkdtemp(prefix="translator-tests-")
+
+for _name, _value in {
+    "OPENAI_API_KEY": "test-key",
+    "OPENAI_API_BASE": "http://127.0.0.1:9/v1",
+    "OPENAI_MODEL": "gpt-3.5-turbo",
+    "MODEL_ROUTING_PATH": "",
+    "METRICS_PORT": "0",
+    "METRICS_TRACE_PATH": "",
+    "RESPONSE_CACHE_ENABLED": "false",
+    "GLOSSARY_ENABLED": "false",
+    "TRANSLATION_MEMORY_ENABLED": "false",
+    "PIPELINE_MEMO_ENABLED": "false",
+    "LOG_DIR": os.path.join(_TEST_DIR, "logs"),
+    "BATCH_DIR": os.path.join(_TEST_DIR, "batches"),
+}.items():
+    os.environ[_name] = _value
@@ -0,0 +1,26 @@
+# tests/test_batch.py
+import pytest
+
+from backend.services.batch import parse_batch_line
+from backend.services.errors import UpstreamError
+
+def _line(status_code=200, content="译文", error=None, usage=None):
+    body = {"choices": [{"message": {"content": content}}], "usage": usage} if status_code == 200 else {"error": {"message": "bad request"}}
+    return {"custom_id": "straight_up-0", "response": {"status_code": status_code, "body": body}, "error": error}
+
+def test_parse_batch_line_success():
+    assert parse_batch_line(_line(usage={"prompt_tokens": 10, "completion_tokens": 5})) == ("译文", {"prompt_tokens": 10, "completion_tokens": 5})
+
+def test_parse_batch_line_empty_content():
+    assert parse_batch_line(_line(content=None)) == ("", None)
+
+def test_parse_batch_line_http_error():
+    with pytest.raises(UpstreamError) as info:
+        parse_batch_line(_line(status_code=400))
+    assert info.value.status_code == 400
+    assert "bad request" in str(info.value)
+
+def test_parse_batch_line_request_error():
+    line = {"custom_id": "straight_up-1", "response": None, "error": {"code": "APIConnectionError", "message": "connection reset"}}
+    with pytest.raises(UpstreamError, match="connection reset"):
+        parse_batch_line(line)
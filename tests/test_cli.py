@@ -0,0 +1,38 @@
+# tests/test_cli.py
+import json
+
+from backend.cli import load_checkpoint, main
+
+def _row(segment_id, error=None):
+    return json.dumps({"id": segment_id, "translation": None if error else "译文", "error": error}, ensure_ascii=False) + "\n"
+
+def test_load_checkpoint_missing_file(tmp_path):
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == {}
+
+def test_load_checkpoint_keeps_latest_successful_rows(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(_row("a#0") + _row("a#1", "UpstreamError: boom") + _row("a#2") + _row("a#2", "UpstreamError: retry failed"), encoding="utf-8")
+    assert set(load_checkpoint(str(path))) == {"a#0"}
+
+def test_load_checkpoint_truncates_partial_last_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    complete = _row("a#0") + _row("a#1")
+    path.write_text(complete + '{"id": "a#2", "transl', encoding="utf-8")
+    assert set(load_checkpoint(str(path))) == {"a#0", "a#1"}
+    assert path.read_text(encoding="utf-8") == complete
+
+def test_load_checkpoint_truncates_at_corrupt_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(_row("a#0") + "not json\n" + _row("a#1"), encoding="utf-8")
+    assert set(load_checkpoint(str(path))) == {"a#0"}
+    assert path.read_text(encoding="utf-8") == _row("a#0")
+
+def test_main_skips_checkpointed_segments(tmp_path, monkeypatch):
+    from backend.cli import source_hash
+    document = tmp_path / "doc.md"
+    document.write_text("Only paragraph.\n", encoding="utf-8")
+    output = tmp_path / "out.jsonl"
+    output.write_text(json.dumps({"id": f"{document}#0", "source_hash": source_hash("Only paragraph."), "translation": "唯一的段落。", "error": None}, ensure_ascii=False) + "\n", encoding="utf-8")
+    monkeypatch.setattr("backend.services.pipeline.TranslationPipeline.run_iter", lambda self, segments, overrides=None: iter(()))
+    assert main([str(document), "-o", str(output), "--output-dir", str(tmp_path / "out")]) == 0
+    assert (tmp_path / "out" / "doc.md").read_text(encoding="utf-8") == "唯一的段落。\n"
@@ -0,0 +1,86 @@
+# tests/test_glossary.py
+import json
+
+from backend.services.glossary import AhoCorasickMatcher, Glossary, format_term_table, parse_term_table, prune_term_table
+
+TABLE = """以下是识别出的术语：
+
+| 英文 | 中文 |
+| --- | --- |
+| Prompt Engineering | 提示词工程 |
+| Token | Token |
+| Transformer | Transformer |
+
+以上."""
+
+def test_parse_term_table_skips_header_separator_and_text():
+    assert parse_term_table(TABLE) == [
+        ("Prompt Engineering", "提示词工程"),
+        ("Token", "Token"),
+        ("Transformer", "Transformer"),
+    ]
+
+def test_parse_term_table_without_table():
+    assert parse_term_table("没有专有名词。") == []
+    assert parse_term_table("| English | Chinese |\n|:---|:---:|") == []
+
+def test_format_term_table_round_trip():
+    entries = [("GPT-4", "GPT-4"), ("Attention", "注意力")]
+    assert parse_term_table(format_term_table(entries)) == entries
+
+def test_matcher_respects_word_boundaries():
+    matcher = AhoCorasickMatcher(["he", "she", "Token", "Prompt Engineering", "Prompt"])
+    text = "ushers token Tokenizer prompt engineering, PROMPT."
+    found = {(text[start:end], matcher.patterns[index]) for start, end, index in matcher.find_all(text)}
+    assert found == {
+        ("token", "Token"),
+        ("prompt", "Prompt"),
+        ("prompt engineering", "Prompt Engineering"),
+        ("PROMPT", "Prompt"),
+    }
+
+def test_matcher_non_alphanumeric_edges():
+    matcher = AhoCorasickMatcher(["C++", "GPT-4"])
+    text = "C++ and GPT-4o and GPT-4."
+    found = [text[start:end] for start, end, _ in matcher.find_all(text)]
+    assert found == ["C++", "GPT-4"]
+
+def test_prune_term_table_keeps_terms_in_texts():
+    pruned = prune_term_table(TABLE, "A Transformer reads each token.")
+    assert parse_term_table(pruned) == [("Token", "Token"), ("Transformer", "Transformer")]
+
+def test_glossary_learns_and_answers_locally():
+    glossary = Glossary(None, ignore_after=1, local_answer=True)
+    text = "Prompt Engineering is related to Transformer."
+    assert glossary.try_answer(text) is None
+    merged = glossary.learn(text, TABLE)
+    assert ("Prompt Engineering", "提示词工程") in merged
+    answer = glossary.try_answer(text)
+    assert answer is not None
+    assert dict(parse_term_table(answer)) == {"Prompt Engineering": "提示词工程", "Transformer": "Transformer"}
+
+def test_glossary_does_not_answer_locally_by_default():
+    glossary = Glossary(None, ignore_after=1)
+    text = "We fine-tune diffusion models with the Transformer."
+    glossary.learn(text, "| Transformer | Transformer |")
+    assert glossary.unknown_candidates(text) == []
+    assert glossary.try_answer(text) is None # 全小写的 diffusion models 不是候选词，仍交给 LLM 识别
+
+def test_glossary_ignores_candidate_only_after_repeated_misses():
+    glossary = Glossary(None, ignore_after=2, local_answer=True)
+    text = "Yesterday Alice met Transformer."
+    table = "| 英文 | 中文 |\n| --- | --- |\n| Transformer | Transformer |"
+    glossary.learn(text, table)
+    assert glossary.try_answer(text) is None # Alice 只被忽略了一次，仍交给 LLM 判断
+    glossary.learn(text, table)
+    assert glossary.try_answer(text) is not None
+
+def test_glossary_persists_to_file(tmp_path):
+    path = str(tmp_path / "glossary.json")
+    glossary = Glossary(path, save_delay=0)
+    glossary.learn("Transformer", "| Transformer | 变换器 |")
+    glossary.flush()
+    with open(path, encoding="utf-8") as f:
+        assert "变换器" in json.dumps(json.load(f), ensure_ascii=False)
+    reloaded = Glossary(path)
+    assert dict(reloaded.lookup("A Transformer."))["Transformer"] == "变换器"
@@ -0,0 +1,68 @@
+# tests/test_incremental.py
+from backend.services.incremental import PipelineSnapshot, StageMemo, split_edited_text, stage_key
+from backend.services.ingestion import segment_document, translatable_segments
+from backend.services.pipeline import SegmentResult
+
+def test_stage_key_depends_on_inputs():
+    key = stage_key("straight_up", "m", "digest", ("text", "table"))
+    assert key == stage_key("straight_up", "m", "digest", ("text", "table"))
+    assert key != stage_key("straight_up", "m", "digest", ("text2", "table"))
+    assert key != stage_key("straight_up", "m2", "digest", ("text", "table"))
+    assert key != stage_key("straight_up", "m", "digest2", ("text", "table"))
+
+def test_stage_memo_validator_and_lru():
+    memo = StageMemo(max_items=2)
+    memo.set("a", "A", "v1")
+    assert memo.get("a", "v1") == "A"
+    assert memo.get("a", "v2") is None
+    assert memo.get("a") == "A"
+    memo.set("b", "B")
+    memo.set("c", "C")
+    assert memo.get("a") is None
+    assert memo.stats()["stale"] == 1
+
+def test_split_edited_text_local_edit():
+    pieces = ["alpha", "\n\n", "beta", "\n\n", "gamma"]
+    editable = [True, False, True, False, True]
+    edited = "alpha\n\nBETA changed\n\ngamma"
+    assert split_edited_text(pieces, edited, editable) == ["alpha", "\n\n", "BETA changed", "\n\n", "gamma"]
+
+def test_split_edited_text_insertion_goes_to_editable_piece():
+    pieces = ["alpha", "\n\n", "beta"]
+    editable = [True, False, True]
+    result = split_edited_text(pieces, "alpha more\n\nbeta", editable)
+    assert result == ["alpha more", "\n\n", "beta"]
+    assert "".join(split_edited_text(pieces, "completely different", editable)) == "completely different"
+
+def _snapshot(text, translations, stage="loose_translation"):
+    segments = segment_document(text)
+    results = []
+    for position, segment in enumerate(translatable_segments(segments)):
+        result = SegmentResult(position, segment.text)
+        result.outputs[stage] = translations[position]
+        result.keys[stage] = f"key-{position}"
+        results.append(result)
+    return PipelineSnapshot(segments, results)
+
+def test_collect_overrides_records_only_changed_segments():
+    snapshot = _snapshot("# Title\n\nFirst paragraph.\n\nSecond paragraph.\n", ["标题", "第一段。", "第二段。"])
+    rendered = snapshot.render("loose_translation", True)
+    assert rendered == "# 标题\n\n第一段。\n\n第二段。\n"
+    changed = snapshot.collect_overrides("loose_translation", True, rendered.replace("第二段。", "修改后的第二段。"))
+    assert changed == 1
+    assert snapshot.overrides == {"key-2": "修改后的第二段。"}
+    assert snapshot.collect_overrides("loose_translation", True, rendered) == 0
+
+def test_collect_overrides_remasks_urls():
+    snapshot = _snapshot("See https://example.com/a for details.\n", ["详情见 <URL1>。"])
+    rendered = snapshot.render("loose_translation", True)
+    assert rendered == "详情见 https://example.com/a。\n"
+    snapshot.collect_overrides("loose_translation", True, "详情请见 https://example.com/a。\n")
+    assert snapshot.overrides == {"key-0": "详情请见 <URL1>。"}
+
+def test_collect_overrides_joined_output():
+    snapshot = _snapshot("First.\n\nSecond.\n", ["| A | 甲 |", "| B | 乙 |"], stage="proper_nouns")
+    rendered = snapshot.render("proper_nouns", False)
+    assert rendered == "| A | 甲 |\n\n| B | 乙 |"
+    assert snapshot.collect_overrides("proper_nouns", False, "| A | 甲 |\n\n| B | 乙乙 |") == 1
+    assert snapshot.overrides == {"key-1": "| B | 乙乙 |"}
@@ -0,0 +1,67 @@
+# tests/test_ingestion.py
+import pytest
+
+from backend.services.ingestion import mask_urls, reassemble, restore_urls, segment_document, translatable_segments
+
+DOCUMENT = """# Getting Started
+
+Read the [guide](https://example.com/docs_(v2) "Guide") or visit <https://example.com> first.
+
+```python
+print("not translated")
+```
+
+| Name | Value |
+| --- | --- |
+| a | 1 |
+
+- First item
+- Second item
+
+![diagram](images/diagram.png)
+
+Plain paragraph with https://example.com/path?q=1 in it.
+"""
+
+def test_segment_kinds_and_translatable_blocks():
+    segments = segment_document(DOCUMENT)
+    kinds = {segment.kind for segment in segments}
+    assert {"heading", "paragraph", "code", "blank"} <= kinds
+    code = [segment for segment in segments if segment.kind == "code"]
+    assert code and not any(segment.translatable for segment in code)
+    assert translatable_segments(segments)[0].text == "Getting Started"
+
+def test_urls_are_masked_in_segment_text():
+    segments = segment_document(DOCUMENT)
+    texts = [segment.text for segment in translatable_segments(segments)]
+    assert not any("https://" in text for text in texts)
+    link = next(segment for segment in segments if "guide" in segment.text)
+    assert link.restore(link.text) == 'Read the [guide](https://example.com/docs_(v2) "Guide") or visit <https://example.com> first.'
+
+def test_reassemble_round_trip_without_translations():
+    segments = segment_document(DOCUMENT)
+    assert reassemble(segments, {}) == DOCUMENT
+    assert reassemble(segments, {segment.index: segment.text for segment in translatable_segments(segments)}) == DOCUMENT
+
+def test_reassemble_keeps_structure_and_restores_urls():
+    segments = segment_document(DOCUMENT)
+    translations = {segment.index: f"译文 {segment.text}" for segment in translatable_segments(segments)}
+    result = reassemble(segments, translations)
+    assert result.startswith("# 译文 Getting Started\n")
+    assert 'print("not translated")' in result
+    assert "(https://example.com/docs_(v2) \"Guide\")" in result
+    assert "https://example.com/path?q=1" in result
+
+@pytest.mark.parametrize("max_tokens", [8, 20])
+def test_long_paragraphs_are_split_and_round_trip(max_tokens):
+    text = ("This is a long sentence that keeps going. " * 10).strip() + "\n\nShort one.\n"
+    segments = segment_document(text, max_tokens=max_tokens)
+    assert len(translatable_segments(segments)) > 2
+    assert reassemble(segments, {}) == text
+
+def test_mask_and_restore_urls():
+    masked, urls = mask_urls("See https://a.example/x and [b](https://b.example).")
+    assert "https://" not in masked
+    assert restore_urls(masked, urls) == "See https://a.example/x and [b](https://b.example)."
+    assert restore_urls(masked.replace("<URL1>", "＜URL1＞"), urls).startswith("See https://a.example/x")
+    assert restore_urls(None, urls) is None
@@ -0,0 +1,144 @@
+# tests/test_pipeline.py
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services.errors import PipelineCancelledError
+from backend.services.incremental import StageMemo, stage_key
+from backend.services.pipeline import Stage, TranslationPipeline
+
+class _StubService:
+    """不调用 LLM 的 Service：输出为阶段名和参数，记录每次调用."""
+    model = "stub-model"
+    template = SimpleNamespace(digest="stub-template")
+    name = "stub"
+    calls = None
+    lock = threading.Lock()
+
+    def run_prompt(self, *args):
+        with self.lock:
+            self.calls.append((self.name, args))
+        if any("fail" in arg for arg in args):
+            raise RuntimeError(f"{self.name} failed")
+        return f"{self.name}({', '.join(args)})"
+
+class _Terms(_StubService):
+    name = "terms"
+
+class _Draft(_StubService):
+    name = "draft"
+
+class _Review(_StubService):
+    name = "review"
+
+class _Final(_StubService):
+    name = "final"
+
+# 菱形依赖：terms -> draft / review -> final
+STAGES = (
+    Stage("terms", _Terms, (), lambda text, r: (text,)),
+    Stage("draft", _Draft, ("terms",), lambda text, r: (text, r["terms"])),
+    Stage("review", _Review, ("terms",), lambda text, r: (r["terms"],)),
+    Stage("final", _Final, ("draft", "review"), lambda text, r: (r["draft"], r["review"])),
+)
+
+@pytest.fixture(autouse=True)
+def calls():
+    _StubService.calls = []
+    return _StubService.calls
+
+@pytest.fixture
+def pipeline():
+    pipeline = TranslationPipeline(STAGES, memo=StageMemo())
+    yield pipeline
+    pipeline.shutdown()
+
+def test_runs_dag_in_dependency_order(pipeline, calls):
+    results = pipeline.run(["a", "b"])
+    assert [result.index for result in results] == [0, 1]
+    assert all(result.ok for result in results)
+    assert results[0].outputs["final"] == "final(draft(a, terms(a)), review(terms(a)))"
+    assert set(results[1].durations) == {"terms", "draft", "review", "final"}
+    for segment in ("a", "b"):
+        order = [name for name, args in calls if segment in "".join(args)]
+        assert order.index("terms") < order.index("draft") < order.index("final")
+        assert order.index("review") < order.index("final")
+    assert len(calls) == 8
+
+def test_failure_only_affects_its_segment(pipeline, calls):
+    results = pipeline.run(["ok", "fail"])
+    assert results[0].ok
+    assert isinstance(results[1].error, RuntimeError)
+    assert not any(name == "draft" and "fail" in args[0] for name, args in calls)
+
+def test_memo_reuses_unchanged_segments(pipeline, calls):
+    pipeline.run(["a", "b"])
+    calls.clear()
+    results = pipeline.run(["a", "c"])
+    assert results[0].reused == {"terms": "memo", "draft": "memo", "review": "memo", "final": "memo"}
+    assert not results[1].reused
+    assert {args[0] for name, args in calls if name == "terms"} == {"c"}
+
+def test_override_recomputes_downstream_only(pipeline, calls):
+    first = pipeline.run(["a"])[0]
+    calls.clear()
+    overrides = {first.keys["draft"]: "edited draft"}
+    result = pipeline.run(["a"], overrides)[0]
+    assert result.reused["draft"] == "override"
+    assert result.outputs["final"] == "final(edited draft, review(terms(a)))"
+    assert [name for name, _ in calls] == ["final"]
+
+def test_stage_key_matches_result_keys(pipeline):
+    result = pipeline.run(["a"])[0]
+    assert result.keys["terms"] == stage_key("terms", _StubService.model, _StubService.template.digest, ("a",))
+
+def test_shutdown_cancels_new_runs(calls):
+    pipeline = TranslationPipeline(STAGES, memo=StageMemo())
+    pipeline.shutdown()
+    results = pipeline.run(["a", "b"])
+    assert all(isinstance(result.error, PipelineCancelledError) for result in results)
+    assert calls == []
+
+def test_dependency_cycle_is_rejected():
+    stages = (
+        Stage("x", _Terms, ("y",), lambda text, r: (text,)),
+        Stage("y", _Draft, ("x",), lambda text, r: (text,)),
+    )
+    with pytest.raises(ValueError, match="cycle"):
+        TranslationPipeline(stages, memo=StageMemo())
+
+def test_translation_memory_entry_is_stale_after_prompt_change(calls, monkeypatch):
+    from backend.services.pipeline import FINAL_STAGE
+    from backend.services.translation_memory import TranslationMemory
+    stages = STAGES[:3] + (Stage(FINAL_STAGE, _Final, ("draft", "review"), lambda text, r: (r["draft"], r["review"])),)
+    memory = TranslationMemory(None)
+    def run():
+        pipeline = TranslationPipeline(stages, memo=StageMemo(), translation_memory=memory)
+        try:
+            return pipeline.run(["a"])[0]
+        finally:
+            pipeline.shutdown()
+    first = run()
+    assert run().reused[FINAL_STAGE] == "tm"
+    calls.clear()
+    monkeypatch.setattr(_Final, "template", SimpleNamespace(digest="edited-template"))
+    result = run()
+    assert FINAL_STAGE not in result.reused
+    assert result.outputs[FINAL_STAGE] == first.outputs[FINAL_STAGE]
+    assert ("final", ("draft(a, terms(a))", "review(terms(a))")) in calls
+    assert memory.stats()["stale"] == 1
+    memory.close()
+
+def test_segment_limits_use_the_smallest_routed_context():
+    from backend.services.pipeline import segment_limits
+    class _Large(_StubService):
+        model = "gpt-4o"
+        template = SimpleNamespace(digest="large", token_count=lambda model: 100)
+    class _Small(_StubService):
+        model = "gpt-4"
+        template = SimpleNamespace(digest="small", token_count=lambda model: 5000)
+    stages = (Stage("a", _Large, (), lambda text, r: (text,)), Stage("b", _Small, ("a",), lambda text, r: (text,)))
+    max_tokens, model = segment_limits(stages)
+    assert model == "gpt-4"
+    assert max_tokens < 1500 # 8192 的上下文减去 5000 token 的模板后只剩约 950 token 的输入预算
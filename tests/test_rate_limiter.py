@@ -0,0 +1,104 @@
+# tests/test_rate_limiter.py
+import email.utils
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services import rate_limiter
+from backend.services.errors import RateLimitedError, UpstreamError
+from backend.services.rate_limiter import RateLimiter, TokenBucket, call_with_retry, retry_after_seconds
+
+def _error_with_headers(headers):
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+def _status_error(status_code, headers=None):
+    import openai
+    from backend.services.registry import _httpx
+    httpx = _httpx()
+    request = httpx.Request("POST", "http://127.0.0.1:9/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    error_cls = openai.RateLimitError if status_code == 429 else openai.APIStatusError
+    return error_cls(f"status {status_code}", response=response, body=None)
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+    assert bucket.unlimited
+    assert bucket.reserve(10 ** 9, time.monotonic()) == 0.0
+
+def test_token_bucket_reserve_and_refill():
+    bucket = TokenBucket(60) # 每秒补充 1 个
+    now = time.monotonic()
+    assert bucket.reserve(60, now) == 0.0
+    assert bucket.reserve(2, now) == pytest.approx(2.0)
+    assert bucket.reserve(1, now + 10) == pytest.approx(0.0) # 10 秒补充 10 个，偿还欠下的 2 个后仍有剩余
+
+def test_token_bucket_oversized_request_is_capped():
+    bucket = TokenBucket(60)
+    now = time.monotonic()
+    assert bucket.reserve(1000, now) == 0.0 # 超过容量的单次请求按容量计算
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+
+def test_token_bucket_refund():
+    bucket = TokenBucket(60)
+    now = time.monotonic()
+    bucket.reserve(60, now)
+    bucket.refund(30, now)
+    assert bucket.reserve(30, now) == 0.0
+
+def test_rate_limiter_waits_for_rpm(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limiter.time, "sleep", sleeps.append)
+    limiter = RateLimiter("m", rpm=60, tpm=0)
+    for _ in range(60):
+        assert limiter.acquire(100) == 0.0
+    wait = limiter.acquire(100)
+    assert wait == pytest.approx(1.0, abs=0.05)
+    assert sleeps == [wait]
+    assert limiter.stats()["acquired"] == 61
+
+def test_rate_limiter_block_for(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, "sleep", lambda seconds: None)
+    limiter = RateLimiter("m", rpm=0, tpm=0)
+    limiter.block_for(5)
+    assert limiter.acquire(1) == pytest.approx(5.0, abs=0.05)
+    assert limiter.stats()["throttled"] == 1
+
+def test_retry_after_seconds_formats():
+    assert retry_after_seconds(_error_with_headers({"retry-after-ms": "1500"})) == pytest.approx(1.5)
+    assert retry_after_seconds(_error_with_headers({"retry-after": "7"})) == pytest.approx(7.0)
+    http_date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert retry_after_seconds(_error_with_headers({"retry-after": http_date})) == pytest.approx(30, abs=2)
+    assert retry_after_seconds(_error_with_headers({"retry-after": "soon"})) is None
+    assert retry_after_seconds(_error_with_headers({})) is None
+    assert retry_after_seconds(ValueError("no response")) is None
+
+def test_call_with_retry_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt, retry_after=None: 0.0)
+    errors = [_status_error(429, {"retry-after-ms": "1"}), _status_error(503)]
+    def request():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+    call_info = {}
+    limiter = RateLimiter("m", rpm=0, tpm=0)
+    assert call_with_retry(request, limiter, 10, max_retries=3, call_info=call_info) == "ok"
+    assert call_info["retries"] == 2
+    assert limiter.stats()["retries"] == 2
+
+def test_call_with_retry_gives_up(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt, retry_after=None: 0.0)
+    def request():
+        raise _status_error(429)
+    with pytest.raises(RateLimitedError):
+        call_with_retry(request, RateLimiter("m", rpm=0, tpm=0), 10, max_retries=1)
+
+def test_call_with_retry_does_not_retry_client_errors():
+    calls = []
+    def request():
+        calls.append(1)
+        raise _status_error(400)
+    with pytest.raises(UpstreamError) as info:
+        call_with_retry(request, RateLimiter("m", rpm=0, tpm=0), 10, max_retries=3)
+    assert info.value.status_code == 400
+    assert len(calls) == 1
@@ -0,0 +1,127 @@
+# tests/test_response_cache.py
+import threading
+import time
+
+import pytest
+
+from backend.services import response_cache
+from backend.services.response_cache import ResponseCache
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(memory_items=4, db_path=str(tmp_path / "cache.sqlite3"), ttl=60)
+    yield cache
+    cache.close()
+
+def test_make_key_depends_on_every_field():
+    key = ResponseCache.make_key("m", {"max_tokens": 10}, "prompt", "http://a/v1")
+    assert key == ResponseCache.make_key("m", {"max_tokens": 10}, "prompt", "http://a/v1")
+    assert key != ResponseCache.make_key("m2", {"max_tokens": 10}, "prompt", "http://a/v1")
+    assert key != ResponseCache.make_key("m", {"max_tokens": 11}, "prompt", "http://a/v1")
+    assert key != ResponseCache.make_key("m", {"max_tokens": 10}, "prompt2", "http://a/v1")
+    assert key != ResponseCache.make_key("m", {"max_tokens": 10}, "prompt", "http://b/v1")
+
+def test_miss_then_memory_hit(cache):
+    assert cache.get("k") is None
+    cache.set("k", "value")
+    assert cache.get("k") == "value"
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["memory_hits"] == 1
+
+def test_disk_hit_after_memory_eviction(cache):
+    for i in range(6): # 内存层只保留 4 条
+        cache.set(f"k{i}", f"v{i}")
+    assert cache.get("k0") == "v0"
+    assert cache.stats()["disk_hits"] == 1
+
+def test_disk_tier_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = ResponseCache(memory_items=4, db_path=path)
+    first.set("k", "value")
+    first.close()
+    second = ResponseCache(memory_items=4, db_path=path)
+    try:
+        assert second.get("k") == "value"
+    finally:
+        second.close()
+
+def test_ttl_expiry(cache, monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache.set("k", "value")
+    now[0] += 30
+    assert cache.get("k") == "value"
+    now[0] += 60
+    assert cache.get("k") is None
+
+def test_get_or_compute_stores_result(cache):
+    calls = []
+    assert cache.get_or_compute("k", lambda: calls.append(1) or "value") == "value"
+    assert cache.get_or_compute("k", lambda: calls.append(1) or "other") == "value"
+    assert len(calls) == 1
+
+def test_get_or_compute_store_predicate(cache):
+    assert cache.get_or_compute("k", lambda: "backup", store=lambda _: False) == "backup"
+    assert cache.get("k") is None
+
+def test_get_or_compute_does_not_cache_errors(cache):
+    def fail():
+        raise RuntimeError("upstream down")
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("k", fail)
+    assert cache.get_or_compute("k", lambda: "value") == "value"
+
+def test_singleflight_runs_compute_once(cache):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+def test_async_singleflight_runs_compute_once(cache):
+    import asyncio
+    calls = []
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_compute("k", compute) for _ in range(5)))
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(calls) == 1
+
+def _store_after_miss(cache, monkeypatch):
+    """模拟上一个 leader 在本次未命中之后、本次成为 leader 之前写入结果."""
+    get = cache.get
+    def get_then_store(key):
+        value = get(key)
+        cache.set(key, "stored by previous leader")
+        return value
+    monkeypatch.setattr(cache, "get", get_then_store)
+
+def test_leader_rechecks_cache_before_computing(cache, monkeypatch):
+    _store_after_miss(cache, monkeypatch)
+    assert cache.get_or_compute("k", lambda: pytest.fail("compute() should not run")) == "stored by previous leader"
+
+def test_async_leader_rechecks_cache_before_computing(cache, monkeypatch):
+    import asyncio
+    _store_after_miss(cache, monkeypatch)
+    async def compute():
+        pytest.fail("compute() should not run")
+    assert asyncio.run(cache.aget_or_compute("k", compute)) == "stored by previous leader"
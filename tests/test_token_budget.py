@@ -0,0 +1,64 @@
+# tests/test_token_budget.py
+import pytest
+
+from backend.services.errors import PromptTooLargeError
+from backend.services.token_budget import count_tokens, input_token_budget, max_output_tokens, split_aligned_to_budget, split_text_to_budget
+
+PARAGRAPHS = "First paragraph, sentence one. Sentence two is here.\n\nSecond paragraph follows. It has more words.\n\n" * 5
+
+def test_split_returns_text_within_budget_unchanged():
+    assert split_text_to_budget("Short text.", 100) == ["Short text."]
+
+@pytest.mark.parametrize("budget", [5, 12, 30, 60])
+def test_split_round_trips_and_respects_budget(budget):
+    chunks = split_text_to_budget(PARAGRAPHS, budget)
+    assert "".join(chunks) == PARAGRAPHS
+    assert all(count_tokens(chunk) <= budget for chunk in chunks)
+    assert len(chunks) > 1
+
+def test_split_prefers_paragraph_boundaries():
+    chunks = split_text_to_budget(PARAGRAPHS, 30)
+    assert all(chunk.endswith("\n\n") for chunk in chunks)
+
+def test_split_without_separators_cuts_hard():
+    text = "x" * 4000
+    chunks = split_text_to_budget(text, 50)
+    assert "".join(chunks) == text
+    assert all(count_tokens(chunk) <= 50 for chunk in chunks)
+
+def test_split_cjk_text():
+    text = "这是第一句话。这是第二句话！这是第三句话？" * 20
+    chunks = split_text_to_budget(text, 40)
+    assert "".join(chunks) == text
+    assert all(count_tokens(chunk) <= 40 for chunk in chunks)
+
+def test_split_aligned_keeps_paragraph_pairs_together():
+    source = "First paragraph here.\n\nSecond paragraph here.\n\nThird paragraph here.\n"
+    target = "第一段。\n\n第二段。\n\n第三段。"
+    budget = count_tokens("First paragraph here.\n\n") + count_tokens("第一段。\n\n") + 1
+    chunks = split_aligned_to_budget(source, target, budget)
+    assert len(chunks) == 3
+    assert "".join(s for s, _ in chunks) == source
+    assert "".join(t for _, t in chunks) == target
+    assert chunks[1] == ("Second paragraph here.\n\n", "第二段。\n\n")
+    assert split_aligned_to_budget(source, target, 10 ** 6) == [(source, target)]
+
+def test_split_aligned_rejects_different_paragraph_counts():
+    assert split_aligned_to_budget("One.\n\nTwo.", "一。二。", 1) is None
+
+def test_max_output_tokens_grows_with_input_and_is_capped():
+    small = max_output_tokens(200, 50, "unknown-model")
+    large = max_output_tokens(600, 450, "unknown-model")
+    assert small < large
+    assert max_output_tokens(200, 10 ** 6, "unknown-model") <= 4096
+
+def test_max_output_tokens_rejects_prompt_over_context():
+    with pytest.raises(PromptTooLargeError):
+        max_output_tokens(10 ** 6, 10 ** 6, "unknown-model")
+
+def test_input_budget_leaves_room_for_output():
+    fixed = 500
+    budget = input_token_budget("unknown-model", fixed)
+    assert budget >= 1
+    output = max_output_tokens(fixed + budget, budget, "unknown-model")
+    assert output >= 1
@@ -0,0 +1,96 @@
+# tests/test_translation_memory.py
+import random
+
+import numpy as np
+import pytest
+
+from backend.services.translation_memory import MinHashLSH, TranslationMemory, jaccard, reference_note
+
+SOURCE = "The quick brown fox jumps over the lazy dog near the river bank every morning."
+
+def _sentence(rng):
+    words = ["model", "token", "layer", "vector", "prompt", "output", "input", "weight", "batch", "graph", "cache", "query"]
+    return " ".join(rng.choice(words) for _ in range(14)) + "."
+
+def test_signature_estimates_jaccard():
+    index = MinHashLSH(num_perm=128, bands=32)
+    other = SOURCE.replace("every morning", "each evening")
+    left, right = index.shingles(SOURCE), index.shingles(other)
+    estimate = (index.signature(shingles=left) == index.signature(shingles=right)).mean()
+    assert estimate == pytest.approx(jaccard(left, right), abs=0.15)
+
+def test_lsh_query_finds_near_duplicate():
+    rng = random.Random(0)
+    index = MinHashLSH(num_perm=64, bands=16)
+    texts = [_sentence(rng) for _ in range(200)] + [SOURCE]
+    index.add(np.vstack([index.signature(text) for text in texts]))
+    near = SOURCE.replace("lazy", "sleepy")
+    found = index.query(index.signature(near), min_estimate=0.5, limit=3)
+    assert found and found[0][0] == len(texts) - 1
+    assert index.query(index.signature(near), min_estimate=0.5, limit=3) == index.scan(index.signature(near), min_estimate=0.5, limit=3)
+
+def test_exact_lookup_ignores_whitespace(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "tm.sqlite3"))
+    try:
+        assert memory.add(SOURCE, "敏捷的棕色狐狸……")
+        match = memory.lookup("  " + SOURCE.replace(" ", "  ") + "\n", 1.0)
+        assert match is not None and match.exact
+        assert match.translation == "敏捷的棕色狐狸……"
+        assert memory.lookup(SOURCE.replace("lazy", "sleepy"), 1.0) is None # 默认只复用相同的原文
+    finally:
+        memory.close()
+
+def test_fuzzy_lookup_and_reference_note():
+    memory = TranslationMemory(None)
+    try:
+        memory.add(SOURCE, "译文")
+        similar = SOURCE.replace("lazy", "sleepy")
+        match = memory.lookup(similar, 0.6)
+        assert match is not None and not match.exact
+        assert 0.6 <= match.similarity < 1.0
+        assert "sleepy" in reference_note(match, similar)
+        assert memory.lookup("Completely unrelated sentence about databases and indexes.", 0.6) is None
+    finally:
+        memory.close()
+
+def test_entries_survive_reopen(tmp_path):
+    path = str(tmp_path / "tm.sqlite3")
+    memory = TranslationMemory(path)
+    memory.add(SOURCE, "译文")
+    memory.close()
+    reopened = TranslationMemory(path)
+    try:
+        assert len(reopened) == 1
+        assert reopened.lookup(SOURCE, 1.0).translation == "译文"
+    finally:
+        reopened.close()
+
+def test_entries_from_another_context_are_misses():
+    memory = TranslationMemory(None)
+    try:
+        memory.add(SOURCE, "旧译文", "prompt-v1")
+        assert memory.lookup(SOURCE, 1.0, lambda source: "prompt-v1").translation == "旧译文"
+        assert memory.lookup(SOURCE, 1.0, lambda source: "prompt-v2") is None
+        assert memory.lookup(SOURCE.replace("lazy", "sleepy"), 0.6, lambda source: "prompt-v2") is None
+        assert memory.stats()["stale"] == 1
+        assert memory.add(SOURCE, "旧译文", "prompt-v2") # 译文相同、上下文不同时同样更新
+        assert memory.lookup(SOURCE, 1.0, lambda source: "prompt-v2").translation == "旧译文"
+    finally:
+        memory.close()
+
+def test_database_without_context_column_is_migrated(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "tm.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE entries (id INTEGER PRIMARY KEY, source_hash TEXT UNIQUE NOT NULL, source TEXT NOT NULL, "
+        "translation TEXT NOT NULL, signature BLOB NOT NULL, updated_at REAL NOT NULL)"
+    )
+    db.commit()
+    db.close()
+    memory = TranslationMemory(path)
+    try:
+        memory.add(SOURCE, "译文", "ctx")
+        assert memory.lookup(SOURCE, 1.0, lambda source: "ctx").translation == "译文"
+    finally:
+        memory.close()
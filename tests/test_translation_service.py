@@ -0,0 +1,137 @@
+# tests/test_translation_service.py
+import asyncio
+
+import pytest
+
+from backend.services import translation_service
+from backend.services.glossary import Glossary, parse_term_table
+from backend.services.translation_service import (
+    IssueSpottingService, LooseTranslationService, ProperNounsSpottingService, ReviewAndReviseService,
+    StraightUpTranslationService, StreamReplacement, apply_delta, is_clean_issue_list, merge_term_tables, parse_review,
+)
+
+@pytest.mark.parametrize("issues", ["", "无", "无。", "- 无", "没有问题", "未发现明显问题。", "None", "N/A", "No issues."])
+def test_clean_issue_lists(issues):
+    assert is_clean_issue_list(issues)
+
+@pytest.mark.parametrize("issues", [None, "1. 术语 Token 翻译不一致", "无主语，需要补充", "None of the terms are translated"])
+def test_issue_lists_with_problems(issues):
+    assert not is_clean_issue_list(issues)
+
+def test_parse_review_with_revision():
+    issues, revision = parse_review("<直接翻译的问题>\n1. 语序生硬\n<意译>\n修改后的译文。\n")
+    assert issues == "1. 语序生硬"
+    assert revision == "修改后的译文。"
+
+def test_parse_review_without_revision():
+    assert parse_review("无") == ("无", None)
+    assert parse_review("<直接翻译的问题>\n无\n<意译>\n  \n") == ("无", None)
+    assert parse_review("   ") == (None, None)
+
+def test_apply_delta_and_merge_term_tables():
+    text = apply_delta(apply_delta("", "| A | 甲 |"), "\n")
+    assert apply_delta(text, StreamReplacement("replaced")) == "replaced"
+    merged = merge_term_tables(["| A | 甲 |\n| B | 乙 |", "| a | 另一个 |\n| C | 丙 |"])
+    assert parse_term_table(merged) == [("A", "甲"), ("B", "乙"), ("C", "丙")]
+
+def _fake_answer(prompt):
+    return f"answer-{len(prompt)}"
+
+def _stub_transport(service, answer=_fake_answer):
+    """替换发送请求的部分，四个入口的其余逻辑照常执行."""
+    calls = []
+    def run(prompt):
+        calls.append(prompt)
+        return answer(prompt)
+    async def arun(prompt):
+        return run(prompt)
+    def stream(prompt):
+        result = run(prompt)
+        yield result[:3]
+        yield result[3:]
+    async def astream(prompt):
+        for delta in stream(prompt):
+            yield delta
+    service._run_api_call = run
+    service._run_api_call_async = arun
+    service._stream_api_call = stream
+    service._stream_api_call_async = astream
+    return calls
+
+def _all_entry_points(service, *args):
+    async def collect_async_stream():
+        text = ""
+        async for delta in service.astream_prompt(*args):
+            text = apply_delta(text, delta)
+        return text
+    streamed = ""
+    for delta in service.stream_prompt(*args):
+        streamed = apply_delta(streamed, delta)
+    return [service.run_prompt(*args), streamed, asyncio.run(service.arun_prompt(*args)), asyncio.run(collect_async_stream())]
+
+def test_entry_points_agree_for_straight_up():
+    service = StraightUpTranslationService()
+    _stub_transport(service)
+    results = _all_entry_points(service, "A short sentence.", "| A | 甲 |")
+    assert len(set(results)) == 1
+
+def test_entry_points_agree_when_input_is_chunked(monkeypatch):
+    service = StraightUpTranslationService()
+    calls = _stub_transport(service)
+    text = "First paragraph here.\n\nSecond paragraph here.\n\nThird paragraph here.\n"
+    monkeypatch.setattr(service, "_split_input", lambda origin_text, fixed_text="": [p + "\n\n" for p in origin_text.rstrip("\n").split("\n\n")] if "\n\n" in origin_text else [origin_text])
+    results = _all_entry_points(service, text, "")
+    assert len(set(results)) == 1
+    assert results[0].count("answer-") == 3
+    assert results[0].endswith("\n\n")
+    assert len(calls) == 12
+
+def test_loose_translation_skips_clean_issue_list():
+    service = LooseTranslationService()
+    calls = _stub_transport(service)
+    assert _all_entry_points(service, "直接翻译。", "无", "Origin.", "") == ["直接翻译。"] * 4
+    assert calls == []
+
+ORIGIN = "First paragraph here.\n\nSecond paragraph here.\n\nThird paragraph here.\n"
+STRAIGHT_UP = "第一段。\n\n第二段。\n\n第三段。"
+
+def _small_budget(monkeypatch):
+    """把输入预算压到一个段落对，原文和直接翻译按段落分为三块."""
+    monkeypatch.setattr(translation_service, "input_token_budget", lambda model, fixed_tokens: 12)
+
+def test_issue_spotting_chunks_aligned_paragraphs(monkeypatch):
+    _small_budget(monkeypatch)
+    service = IssueSpottingService()
+    answers = {"第一段。": "无", "第二段。": "1. 语序生硬", "第三段。": "2. 漏译"}
+    calls = _stub_transport(service, lambda prompt: next(a for s, a in answers.items() if s in prompt))
+    results = _all_entry_points(service, STRAIGHT_UP, ORIGIN, "")
+    assert results == ["1. 语序生硬\n2. 漏译"] * 4
+    assert len(calls) == 12
+
+def test_loose_translation_chunks_keep_straight_up_separators(monkeypatch):
+    _small_budget(monkeypatch)
+    service = LooseTranslationService()
+    calls = _stub_transport(service, lambda prompt: "意译")
+    results = _all_entry_points(service, STRAIGHT_UP, "1. 语序生硬", ORIGIN, "")
+    assert results == ["意译\n\n意译\n\n意译"] * 4
+    assert all("1. 语序生硬" in prompt for prompt in calls)
+
+def test_review_chunks_join_issues_and_revisions(monkeypatch):
+    _small_budget(monkeypatch)
+    service = ReviewAndReviseService()
+    _stub_transport(service, lambda prompt: "<直接翻译的问题>\n1. 问题\n<意译>\n修改后。")
+    result = service.run_prompt(STRAIGHT_UP, ORIGIN, "")
+    assert parse_review(result) == ("1. 问题\n1. 问题\n1. 问题", "修改后。\n\n修改后。\n\n修改后。")
+    _stub_transport(service, lambda prompt: "无" if "第二段" in prompt else "<直接翻译的问题>\n1. 问题\n<意译>\n修改后。")
+    assert parse_review(service.run_prompt(STRAIGHT_UP, ORIGIN, "")) == ("1. 问题\n1. 问题", None) # 由意译步骤单独修改
+
+def test_proper_nouns_streams_replacement_with_glossary_terms(monkeypatch):
+    glossary = Glossary(None, ignore_after=100, local_answer=True)
+    glossary.learn("Known Transformer", "| Transformer | 变换器 |")
+    monkeypatch.setattr(translation_service, "get_glossary", lambda: glossary)
+    service = ProperNounsSpottingService()
+    _stub_transport(service, lambda prompt: "| Transformer | Transformer |\n| Diffusion | 扩散 |")
+    deltas = list(service.stream_prompt("We compare the Transformer with Diffusion models."))
+    assert isinstance(deltas[-1], StreamReplacement)
+    assert dict(parse_term_table(deltas[-1])) == {"Transformer": "变换器", "Diffusion": "扩散"}
+    assert service.local_answer("We compare the Transformer with Diffusion models.") is not None